@@ -0,0 +1,399 @@
+import numpy as np
+import ctypes
+import time
+import json
+import itertools
+import os
+import os.path as path
+import resource
+import subprocess
+import sys
+from KS_Sampling import ks_cpp, get_dist, get_dist_condensed, ks_sampling_core, ks_sampling_core_cpp
+from KS_Sampling import ks_sampling, ks_sampling_mem, ks_sampling_pruned
+
+
+def _time_mem_kernel(kernel, X, seed, n_result, repeat):
+    n_sample, n_feature = X.shape
+    vdist = np.zeros(n_result, dtype=np.float32)
+    result = np.zeros(n_result, dtype=np.uintp)
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        kernel(
+            X.ctypes.data_as(ctypes.c_void_p),
+            seed.ctypes.data_as(ctypes.c_void_p),
+            result.ctypes.data_as(ctypes.c_void_p),
+            vdist.ctypes.data_as(ctypes.c_void_p),
+            ctypes.c_size_t(n_sample),
+            ctypes.c_size_t(n_feature),
+            ctypes.c_size_t(seed.shape[0]),
+            ctypes.c_size_t(n_result),
+            None,
+        )
+        timings.append(time.perf_counter() - t0)
+    return min(timings), result.copy()
+
+
+def bench_mem_kernel(n_sample=10000, n_features=(10, 100, 1000, 10000), n_iter=100, repeat=3):
+    """
+    bench_mem_kernel(n_sample=10000, n_features=(10, 100, 1000, 10000), n_iter=100, repeat=3)
+
+    Per-iteration throughput of `kennard_stone_mem` (squared norm,
+    blocked dot product) versus `kennard_stone_mem_naive`
+    (element-wise distance).
+
+    Time of one iteration is evaluated as the difference of runs with
+    `n_iter + 2` and 2 selected samples, divided by `n_iter`.
+    Throughput is reported as GB/s of `X` streamed per iteration.
+
+    Returns
+    -------
+
+    report: list of dict
+    """
+    rng = np.random.default_rng(0)
+    seed = np.array([0, 1], dtype=np.uintp)
+    report = []
+    for n_feature in n_features:
+        X = np.asarray(100 * rng.standard_normal((n_sample, n_feature)), dtype=np.float32)
+        entry = {"n_sample": n_sample, "n_feature": n_feature}
+        for name in ["kennard_stone_mem", "kennard_stone_mem_naive"]:
+            kernel = getattr(ks_cpp, name)
+            t_init, _ = _time_mem_kernel(kernel, X, seed, 2, repeat)
+            t_full, result = _time_mem_kernel(kernel, X, seed, n_iter + 2, repeat)
+            t_iter = max(t_full - t_init, 1e-12) / n_iter
+            entry[name] = {"t_iter": t_iter, "GB/s": X.nbytes / t_iter / 1e9, "result": result}
+        entry["agreement"] = np.mean(entry["kennard_stone_mem"]["result"] == entry["kennard_stone_mem_naive"]["result"])
+        entry["speedup"] = entry["kennard_stone_mem_naive"]["t_iter"] / entry["kennard_stone_mem"]["t_iter"]
+        report.append(entry)
+    return report
+
+
+def bench_ks_backends(n_samples=(1000, 5000, 20000), n_feature=100, repeat=3):
+    """
+    bench_ks_backends(n_samples=(1000, 5000, 20000), n_feature=100, repeat=3)
+
+    Wall time of full selection by NumPy backend `ks_sampling_core`
+    versus C backend `ks_sampling_core_cpp`, for both full and
+    condensed distance storage. Distance generation is not timed.
+
+    Returns
+    -------
+
+    report: list of dict
+    """
+    rng = np.random.default_rng(0)
+    report = []
+    for n_sample in n_samples:
+        X = np.asarray(100 * rng.standard_normal((n_sample, n_feature)), dtype=np.float32)
+        for storage, builder in [("full", get_dist), ("condensed", get_dist_condensed)]:
+            dist = builder(X)
+            entry = {"n_sample": n_sample, "n_feature": n_feature, "storage": storage}
+            for name, core in [("Python", ks_sampling_core), ("C", ks_sampling_core_cpp)]:
+                timings = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    result, _ = core(dist)
+                    timings.append(time.perf_counter() - t0)
+                entry[name] = {"time": min(timings), "result": result}
+            entry["agreement"] = np.mean(entry["Python"]["result"] == entry["C"]["result"])
+            entry["speedup"] = entry["Python"]["time"] / entry["C"]["time"]
+            report.append(entry)
+            del dist
+    return report
+
+
+def _impl_others(name):
+    # Reference implementations are imported lazily, they require scikit-learn
+    import KS_Sampling_Others as others
+    return {
+        "hxhc": lambda X, n_result: others.ks_from_hxhc(X, test_size=X.shape[0] - n_result)[0],
+        "karoka": lambda X, n_result: others.ks_from_karoka(X, n_result),
+        "XiaqiongFan": lambda X, n_result: others.ks_from_XiaqiongFan(X, n_result)[0],
+        "hxhc/fast": lambda X, n_result: others.ks_from_hxhc_fast(X, test_size=X.shape[0] - n_result)[0],
+        "karoka/fast": lambda X, n_result: others.ks_from_karoka_fast(X, n_result),
+        "XiaqiongFan/fast": lambda X, n_result: others.ks_from_XiaqiongFan_fast(X, n_result)[0],
+    }[name]
+
+
+IMPLEMENTATIONS = {
+    "ks_sampling/C": lambda X, n_result: ks_sampling(X, n_result=n_result, backend="C")[0],
+    "ks_sampling/C/condensed": lambda X, n_result: ks_sampling(X, n_result=n_result, backend="C", storage="condensed")[0],
+    "ks_sampling/Python": lambda X, n_result: ks_sampling(X, n_result=n_result, backend="Python")[0],
+    "ks_sampling_mem/C": lambda X, n_result: ks_sampling_mem(X, n_result=n_result, backend="C")[0],
+    "ks_sampling_mem/C/ooc": lambda X, n_result: ks_sampling_mem(X, n_result=n_result, backend="C", n_block=4096)[0],
+    "ks_sampling_mem/Python": lambda X, n_result: ks_sampling_mem(X, n_result=n_result, backend="Python")[0],
+    "ks_sampling_pruned": lambda X, n_result: ks_sampling_pruned(X, n_result=n_result)[0],
+    "hxhc": lambda X, n_result: _impl_others("hxhc")(X, n_result),
+    "karoka": lambda X, n_result: _impl_others("karoka")(X, n_result),
+    "XiaqiongFan": lambda X, n_result: _impl_others("XiaqiongFan")(X, n_result),
+    "hxhc/fast": lambda X, n_result: _impl_others("hxhc/fast")(X, n_result),
+    "karoka/fast": lambda X, n_result: _impl_others("karoka/fast")(X, n_result),
+    "XiaqiongFan/fast": lambda X, n_result: _impl_others("XiaqiongFan/fast")(X, n_result),
+}
+
+# Largest `n_sample` for slow reference implementations (quadratic Python loops)
+MAX_N_SAMPLE = {"hxhc": 5000, "karoka": 500, "XiaqiongFan": 500, "ks_sampling_mem/Python": 5000,
+                "hxhc/fast": 20000, "karoka/fast": 20000, "XiaqiongFan/fast": 20000}
+
+# Implementations not affected by thread count, only run with the first thread count
+SERIAL = {"hxhc", "karoka", "XiaqiongFan", "hxhc/fast", "karoka/fast", "XiaqiongFan/fast"}
+
+REFERENCE = "ks_sampling/Python"
+
+
+def _bench_data(n_sample, n_feature, offset=0.):
+    # Same data in every process for the same shape; `offset` is added to every feature,
+    # which squared-norm expansion of distances should be insensitive to
+    return np.asarray(100 * np.random.default_rng(0).standard_normal((n_sample, n_feature)) + offset, dtype=np.float32)
+
+
+def _run_case(impl, n_sample, n_feature, n_result, repeat, offset=0.):
+    # Executed in child process; peak RSS is of the whole child process
+    X = _bench_data(n_sample, n_feature, offset)
+    if impl in SERIAL:
+        import KS_Sampling_Others  # noqa: F401, import is not timed
+    rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = IMPLEMENTATIONS[impl](X, n_result)
+        timings.append(time.perf_counter() - t0)
+    return {
+        "time": min(timings),
+        "times": timings,
+        "base_rss_mb": rss_base / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "result": [int(v) for v in result],
+    }
+
+
+def _agreement(result, reference):
+    # Fraction of positions with the same selection; order of the seed pair is not significant
+    result, reference = list(result), list(reference)
+    if len(result) != len(reference):
+        return 0.
+    result[:2], reference[:2] = sorted(result[:2]), sorted(reference[:2])
+    return float(np.mean(np.asarray(result) == np.asarray(reference))) if result else 1.
+
+
+def run_case(impl, n_sample, n_feature, n_result, n_thread=None, repeat=3, timeout=None, offset=0.):
+    """
+    run_case(impl, n_sample, n_feature, n_result, n_thread=None, repeat=3, timeout=None, offset=0.)
+
+    Run one benchmark case of implementation `impl` (key of
+    `IMPLEMENTATIONS`) in a fresh Python process with
+    `OMP_NUM_THREADS=n_thread`, so that peak RSS and thread count
+    are not affected by other cases. `offset` is added to the data.
+
+    Returns
+    -------
+
+    entry: dict
+        Case parameters, and "time" (best wall time of `repeat` runs,
+        in seconds), "peak_rss_mb", "base_rss_mb" (RSS after data
+        generation) and "result"; or "error" if the child failed.
+    """
+    case = {"impl": impl, "n_sample": n_sample, "n_feature": n_feature, "n_result": n_result, "repeat": repeat,
+            "offset": offset}
+    env = dict(os.environ)
+    if n_thread is not None:
+        env["OMP_NUM_THREADS"] = str(n_thread)
+    entry = dict(case, n_thread=n_thread)
+    try:
+        proc = subprocess.run(
+            [sys.executable, path.abspath(__file__), "--case", json.dumps(case)],
+            env=env, cwd=path.dirname(path.abspath(__file__)),
+            capture_output=True, text=True, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        entry["error"] = "timeout"
+        return entry
+    if proc.returncode != 0:
+        entry["error"] = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "exit code {}".format(proc.returncode)
+        return entry
+    entry.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return entry
+
+
+def bench_suite(n_samples=(1000, 5000), n_features=(10, 100), n_results=(0.1, 1.0), n_threads=(1, None),
+                impls=None, repeat=3, timeout=600, output=None, offsets=(0., 1e6)):
+    """
+    bench_suite(n_samples=(1000, 5000), n_features=(10, 100), n_results=(0.1, 1.0), n_threads=(1, None),
+                impls=None, repeat=3, timeout=600, output=None, offsets=(0., 1e6))
+
+    Sweep Kennard-Stone implementations over `n_sample`, `n_feature`,
+    `n_result`, data offset and OpenMP thread count. Every case runs in
+    its own process (see `run_case`); wall time, peak RSS and agreement
+    of selection with `REFERENCE` (NumPy backend on full distance) of
+    the same data are recorded.
+
+    Parameters
+    ----------
+
+    n_results: tuple
+        Float values not larger than 1 are fractions of `n_sample`.
+
+    n_threads: tuple
+        `None` for default thread count of OpenMP.
+
+    impls: list or None
+        Keys of `IMPLEMENTATIONS`; all if `None`. Implementations are
+        skipped for `n_sample` larger than `MAX_N_SAMPLE`.
+
+    output: str or None
+        Path of JSON report, see `compare_reports`.
+
+    offsets: tuple
+        Offsets added to every feature of the data (standard deviation
+        100); large offsets check cancellation of squared-norm expansion
+        of distances, which zero-mean data do not reveal.
+
+    Returns
+    -------
+
+    report: dict
+        "environment" and list of "cases".
+    """
+    impls = list(IMPLEMENTATIONS) if impls is None else list(impls)
+    cases = []
+    for n_sample, n_feature, n_result, offset in itertools.product(n_samples, n_features, n_results, offsets):
+        n_result = int(round(n_result * n_sample)) if isinstance(n_result, float) and n_result <= 1 else int(n_result)
+        n_result = max(2, min(n_result, n_sample))
+        reference = None
+        for n_thread in n_threads:
+            for impl in impls:
+                if n_sample > MAX_N_SAMPLE.get(impl, np.inf):
+                    continue
+                # Single-threaded implementations are not repeated for every thread count
+                if impl in SERIAL and n_thread != n_threads[0]:
+                    continue
+                entry = run_case(impl, n_sample, n_feature, n_result, n_thread, repeat, timeout, offset)
+                if impl == REFERENCE and "result" in entry and reference is None:
+                    reference = entry["result"]
+                cases.append(entry)
+        if reference is None:
+            reference = run_case(REFERENCE, n_sample, n_feature, n_result, n_threads[0], 1, timeout, offset).get("result")
+        for entry in cases:
+            if (entry["n_sample"], entry["n_feature"], entry["n_result"], entry["offset"]) == (n_sample, n_feature, n_result, offset):
+                entry["agreement"] = None if reference is None or "result" not in entry else _agreement(entry["result"], reference)
+    for entry in cases:
+        entry.pop("result", None)
+    report = {
+        "environment": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": sys.platform,
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "cases": cases,
+    }
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+def compare_reports(baseline, report, tol_time=1.2, tol_agreement=1e-6):
+    """
+    compare_reports(baseline, report, tol_time=1.2, tol_agreement=1e-6)
+
+    Regressions of `report` against `baseline` (reports or paths of
+    JSON reports by `bench_suite`): cases with the same parameters
+    whose wall time grew by more than factor `tol_time`, whose
+    agreement dropped, or which failed.
+
+    Returns
+    -------
+
+    regressions: list of dict
+    """
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+    if isinstance(report, str):
+        with open(report) as f:
+            report = json.load(f)
+    key = lambda e: (e["impl"], e["n_sample"], e["n_feature"], e["n_result"], e.get("offset", 0.), e["n_thread"])
+    old = {key(e): e for e in baseline["cases"]}
+    regressions = []
+    for entry in report["cases"]:
+        base = old.get(key(entry))
+        if base is None or "error" in base:
+            continue
+        if "error" in entry:
+            regressions.append(dict(entry, reason="error"))
+        elif entry["time"] > tol_time * base["time"]:
+            regressions.append(dict(entry, reason="time", baseline_time=base["time"]))
+        elif (entry.get("agreement") or 0) < (base.get("agreement") or 0) - tol_agreement:
+            regressions.append(dict(entry, reason="agreement", baseline_agreement=base["agreement"]))
+    return regressions
+
+
+def print_report(report):
+    print("{:>24s} {:>8s} {:>9s} {:>8s} {:>8s} {:>7s} {:>10s} {:>10s} {:>10s}".format(
+        "impl", "n_sample", "n_feature", "n_result", "offset", "threads", "time/s", "peak/MB", "agreement"))
+    for e in report["cases"]:
+        print("{:>24s} {:>8d} {:>9d} {:>8d} {:>8.0e} {:>7s} ".format(
+            e["impl"], e["n_sample"], e["n_feature"], e["n_result"], e.get("offset", 0.), str(e["n_thread"] or "-")), end="")
+        if "error" in e:
+            print(e["error"])
+        else:
+            print("{:>10.4f} {:>10.1f} {:>10s}".format(
+                e["time"], e["peak_rss_mb"], "-" if e["agreement"] is None else "{:.3f}".format(e["agreement"])))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark of Kennard-Stone implementations")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--kernels", action="store_true", help="Print C kernel and backend tables only")
+    parser.add_argument("--n-sample", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--n-feature", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--n-result", type=float, nargs="+", default=[0.1, 1.0],
+                        help="Fractions of n_sample if not larger than 1")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 0], help="0 for OpenMP default")
+    parser.add_argument("--offset", type=float, nargs="+", default=[0., 1e6], help="Offsets added to the data")
+    parser.add_argument("--impl", nargs="+", default=None, choices=list(IMPLEMENTATIONS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", default=None, help="Path of JSON report")
+    parser.add_argument("--baseline", default=None, help="JSON report to check regressions against")
+    args = parser.parse_args()
+
+    if args.case is not None:
+        case = json.loads(args.case)
+        print(json.dumps(_run_case(case["impl"], case["n_sample"], case["n_feature"], case["n_result"], case["repeat"],
+                                   case.get("offset", 0.))))
+        sys.exit(0)
+
+    if args.kernels:
+        print("{:>10s} {:>14s} {:>10s} {:>14s} {:>10s} {:>8s} {:>10s}".format(
+            "n_feature", "t_iter/ms", "GB/s", "naive/ms", "GB/s", "speedup", "agreement"))
+        for entry in bench_mem_kernel():
+            print("{:>10d} {:>14.4f} {:>10.2f} {:>14.4f} {:>10.2f} {:>8.2f} {:>10.3f}".format(
+                entry["n_feature"],
+                1e3 * entry["kennard_stone_mem"]["t_iter"], entry["kennard_stone_mem"]["GB/s"],
+                1e3 * entry["kennard_stone_mem_naive"]["t_iter"], entry["kennard_stone_mem_naive"]["GB/s"],
+                entry["speedup"], entry["agreement"]))
+        print()
+        print("{:>10s} {:>10s} {:>12s} {:>12s} {:>8s} {:>10s}".format(
+            "n_sample", "storage", "Python/s", "C/s", "speedup", "agreement"))
+        for entry in bench_ks_backends():
+            print("{:>10d} {:>10s} {:>12.4f} {:>12.4f} {:>8.2f} {:>10.3f}".format(
+                entry["n_sample"], entry["storage"], entry["Python"]["time"], entry["C"]["time"],
+                entry["speedup"], entry["agreement"]))
+        sys.exit(0)
+
+    n_results = [v if v <= 1 else int(v) for v in args.n_result]
+    n_threads = [v or None for v in args.threads]
+    report = bench_suite(args.n_sample, args.n_feature, n_results, n_threads, args.impl,
+                         args.repeat, args.timeout, args.output, args.offset)
+    print_report(report)
+    if args.baseline is not None:
+        regressions = compare_reports(args.baseline, report)
+        for e in regressions:
+            print("REGRESSION ({}): {} n_sample={} n_feature={} n_result={} threads={}".format(
+                e["reason"], e["impl"], e["n_sample"], e["n_feature"], e["n_result"], e["n_thread"]))
+        sys.exit(1 if regressions else 0)
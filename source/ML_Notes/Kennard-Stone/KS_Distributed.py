@@ -0,0 +1,300 @@
+import numpy as np
+import ctypes
+import os
+import queue
+import traceback
+import multiprocessing as mp
+from collections import deque
+
+
+def ks_sampling_spmd(comm, X_local, seed=None, n_result=None):
+    """
+    ks_sampling_spmd(comm, X_local, seed=None, n_result=None)
+
+    Kennard-Stone Sampling Program
+        (distributed, every process owns a row shard of samples)
+
+    Called by every process of `comm` with its own rows `X_local`;
+    shards are concatenated in rank order as the whole dataset.
+    Every process keeps squared norms, minimum squared distances and
+    selection flags of its own rows only. Rows are centred by the
+    global column mean (one `allreduce`), since squared distances are
+    evaluated as t_i + t_j - 2 x_i.x_j in float32. In every iteration, each
+    process updates its minimums by `kennard_stone_mem_update` and finds
+    its local sup, the global sup is found by `allgather` of local sups
+    (ties broken by the smallest sample index, same to `ks_sampling_mem`),
+    and the owner of the selected sample broadcasts its row.
+
+    Parameters
+    ----------
+
+    comm: communicator
+        `mpi4py.MPI.COMM_WORLD` style object, with `Get_rank`,
+        `Get_size`, `allgather`, `allreduce`, `bcast` and `sendrecv`
+        (lowercase, pickle-based). `LocalComm` is a stand-in on one machine.
+
+    X_local: np.ndarray, shape: (n_local, n_feature)
+        Rows of this process.
+
+    seed: np.ndarray or list or None, shape: (n_seed, )
+        Initial selected seed, global sample indexes.
+        If set as `None`, the farthest pair is found by passing shards
+        around a ring of processes (each pair of shards once), so every
+        process holds two shards at a time; it costs O(n_sample^2)
+        distances, and providing seed is preferred for large datasets.
+
+    n_result: int or None, optional
+        Number of samples that should be selected.
+        If set as `None`, `n_sample` will be used instead.
+
+    Returns
+    -------
+
+    (result, v_dist) on every process, same to `ks_sampling_mem`.
+    """
+    from KS_Sampling import ks_cpp
+    rank, size = comm.Get_rank(), comm.Get_size()
+    X_local = np.ascontiguousarray(X_local, dtype=np.float32)
+    n_local, n_feature = X_local.shape
+    counts = comm.allgather(n_local)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    i_start, n_sample = int(offsets[rank]), int(offsets[-1])
+    if n_result is None:
+        n_result = n_sample
+    assert(n_result <= n_sample)
+    center = comm.allreduce(X_local.sum(axis=0, dtype=np.float64)) / max(n_sample, 1)
+    X_local = np.ascontiguousarray(X_local - center, dtype=np.float32)
+    t = np.zeros(n_local, dtype=np.float32)
+    ks_cpp.squared_norm_vector(X_local.ctypes.data_as(ctypes.c_void_p), t.ctypes.data_as(ctypes.c_void_p),
+                               ctypes.c_size_t(n_local), ctypes.c_size_t(n_feature))
+    if seed is None or len(seed) == 0:
+        seed = _farthest_pair_ring(comm, X_local, t, offsets)
+    seed = [int(i) for i in seed]
+
+    def owner(i):
+        return int(np.searchsorted(offsets, i, side="right")) - 1
+
+    def get_row(i):
+        # Row `i` and its squared norm, broadcast from its owner
+        root = owner(i)
+        row = (X_local[i - i_start], t[i - i_start]) if root == rank else None
+        return comm.bcast(row, root=root)
+
+    min_vals = np.full(n_local, np.inf, dtype=np.float32)
+    selected = np.zeros(n_local, dtype=bool)
+    result = np.zeros(n_result, dtype=int)
+    v_dist = np.zeros(n_result, dtype=float)
+    sup_index = ctypes.c_size_t(0)
+
+    def update(i):
+        # Select global sample `i`, update minimums of own rows, and return global sup
+        x_ref, t_ref = get_row(i)
+        if i_start <= i < i_start + n_local:
+            selected[i - i_start] = True
+        sup_val = ks_cpp.kennard_stone_mem_update(
+            X_local.ctypes.data_as(ctypes.c_void_p),
+            t.ctypes.data_as(ctypes.c_void_p),
+            np.ascontiguousarray(x_ref, dtype=np.float32).ctypes.data_as(ctypes.c_void_p),
+            ctypes.c_float(t_ref),
+            min_vals.ctypes.data_as(ctypes.c_void_p),
+            selected.ctypes.data_as(ctypes.c_void_p),
+            ctypes.c_size_t(n_local),
+            ctypes.c_size_t(n_feature),
+            ctypes.byref(sup_index),
+        ) if n_local > 0 else -1.
+        local = (float(sup_val), i_start + int(sup_index.value))
+        return max(comm.allgather(local), key=lambda sup: (sup[0], -sup[1]))
+
+    result[:len(seed)] = seed
+    for i in seed:
+        sup = update(i)
+    if len(seed) == 2:
+        x0, t0 = get_row(seed[0])
+        x1, t1 = get_row(seed[1])
+        v_dist[0] = np.linalg.norm(np.asarray(x0, dtype=np.float64) - np.asarray(x1, dtype=np.float64))
+    for n in range(len(seed), n_result):
+        v_dist[n - 1] = np.sqrt(max(sup[0], 0.))
+        result[n] = sup[1]
+        sup = update(sup[1])
+    return result, v_dist
+
+
+def _farthest_pair_ring(comm, X_local, t, offsets):
+    # Farthest pair of all samples; at step `s`, every process pairs its shard with
+    # the shard of rank - s, received around the ring, for s = 0 .. size // 2.
+    from KS_Sampling import ks_cpp
+    rank, size = comm.Get_rank(), comm.Get_size()
+    n_feature = X_local.shape[1]
+    idx = np.zeros(2, dtype=np.uintp)
+    sup = (-1., 0, 0)
+    for s in range(size // 2 + 1):
+        src = (rank - s) % size
+        if s == 0:
+            X_other, t_other = X_local, t
+        else:
+            X_other, t_other = comm.sendrecv((X_local, t), dest=(rank + s) % size, source=src)
+        if s > 0 and 2 * s == size and rank >= size // 2:
+            continue  # the same pair of shards is evaluated by rank - size / 2
+        if X_local.shape[0] == 0 or X_other.shape[0] == 0:
+            continue
+        sup_val = ks_cpp.farthest_pair(
+            X_local.ctypes.data_as(ctypes.c_void_p), t.ctypes.data_as(ctypes.c_void_p),
+            ctypes.c_size_t(X_local.shape[0]),
+            X_other.ctypes.data_as(ctypes.c_void_p), t_other.ctypes.data_as(ctypes.c_void_p),
+            ctypes.c_size_t(X_other.shape[0]),
+            ctypes.c_size_t(n_feature), ctypes.c_bool(s == 0),
+            idx.ctypes.data_as(ctypes.c_void_p), None,
+        )
+        pair = sorted([int(offsets[rank] + idx[0]), int(offsets[src] + idx[1])])
+        if (sup_val, -pair[0], -pair[1]) > (sup[0], -sup[1], -sup[2]):
+            sup = (sup_val, pair[0], pair[1])
+    sup = max(comm.allgather(sup), key=lambda sup: (sup[0], -sup[1], -sup[2]))
+    return sup[1], sup[2]
+
+
+class LocalComm:
+    """
+    LocalComm(rank, inboxes)
+
+    Stand-in of `mpi4py` communicator for processes on one machine,
+    with the subset of lowercase (pickle-based) methods used by
+    `ks_sampling_spmd`. Every rank has an inbox queue; messages from
+    one sender arrive in order, and messages from other senders are
+    kept until they are received.
+    """
+    def __init__(self, rank, inboxes):
+        self.rank = rank
+        self.size = len(inboxes)
+        self.inboxes = inboxes
+        self.pending = [deque() for _ in range(self.size)]
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    def send(self, obj, dest):
+        self.inboxes[dest].put((self.rank, obj))
+
+    def recv(self, source):
+        while not self.pending[source]:
+            sender, obj = self.inboxes[self.rank].get()
+            self.pending[sender].append(obj)
+        return self.pending[source].popleft()
+
+    def sendrecv(self, sendobj, dest, source):
+        self.send(sendobj, dest)
+        return self.recv(source)
+
+    def bcast(self, obj, root=0):
+        if self.rank == root:
+            for dest in range(self.size):
+                if dest != root:
+                    self.send(obj, dest)
+            return obj
+        return self.recv(root)
+
+    def allgather(self, obj):
+        for dest in range(self.size):
+            if dest != self.rank:
+                self.send(obj, dest)
+        return [obj if source == self.rank else self.recv(source) for source in range(self.size)]
+
+    def allreduce(self, obj):
+        # Sum in rank order, so that every rank gets the same value
+        values = self.allgather(obj)
+        total = values[0]
+        for value in values[1:]:
+            total = total + value
+        return total
+
+
+def _load_shard(shard):
+    # Rows of a shard: array, path of `.npy` file, or (path, i0, i1) rows of `.npy` file
+    if isinstance(shard, tuple):
+        shard_path, i0, i1 = shard
+        return np.ascontiguousarray(np.load(shard_path, mmap_mode="r")[i0:i1], dtype=np.float32)
+    if isinstance(shard, (str, os.PathLike)):
+        return np.ascontiguousarray(np.load(shard, mmap_mode="r"), dtype=np.float32)
+    return np.ascontiguousarray(shard, dtype=np.float32)
+
+
+def _sharded_worker(rank, inboxes, shard, n_thread, seed, n_result, output):
+    if n_thread is not None:
+        os.environ["OMP_NUM_THREADS"] = str(n_thread)
+    try:
+        comm = LocalComm(rank, inboxes)
+        value = ks_sampling_spmd(comm, _load_shard(shard), seed, n_result)
+        if rank == 0:
+            output.put(("result", value))
+    except BaseException:
+        output.put(("error", traceback.format_exc()))
+
+
+def ks_sampling_sharded(X, seed=None, n_result=None, n_proc=None, n_thread=None, timeout=1.):
+    """
+    ks_sampling_sharded(X, seed=None, n_result=None, n_proc=None, n_thread=None, timeout=1.)
+
+    Kennard-Stone Sampling Program
+        (row shards of samples in worker processes on one machine)
+
+    Runs `ks_sampling_spmd` in `n_proc` processes connected by
+    `LocalComm`. The selection is the same to `ks_sampling_mem`.
+    On a cluster, run `ks_sampling_spmd` with `mpi4py.MPI.COMM_WORLD`
+    and the rows of every rank instead.
+
+    Parameters
+    ----------
+
+    X: np.ndarray or str or list
+        Samples, or path of `.npy` file (every worker reads its rows
+        from file, so `X` is never loaded in this process), or list of
+        shards (arrays or paths), one worker for each.
+
+    seed, n_result:
+        See `ks_sampling_spmd`.
+
+    n_proc: int or None, optional
+        Number of worker processes, if `X` is not a list of shards.
+        If set as `None`, `os.cpu_count()` is used.
+
+    n_thread: int or None, optional
+        OpenMP threads of every worker.
+
+    timeout: float, optional
+        Interval (seconds) of checking that workers are alive.
+    """
+    if isinstance(X, list):
+        shards = X
+    else:
+        n_proc = os.cpu_count() if n_proc is None else n_proc
+        n_sample = np.load(X, mmap_mode="r").shape[0] if isinstance(X, (str, os.PathLike)) else X.shape[0]
+        bounds = np.linspace(0, n_sample, n_proc + 1).astype(int)
+        if isinstance(X, (str, os.PathLike)):
+            shards = [(X, bounds[r], bounds[r + 1]) for r in range(n_proc)]
+        else:
+            shards = [X[bounds[r]:bounds[r + 1]] for r in range(n_proc)]
+    ctx = mp.get_context("spawn")  # OpenMP runtime is not safe to fork
+    inboxes = [ctx.Queue() for _ in shards]
+    output = ctx.Queue()
+    procs = [ctx.Process(target=_sharded_worker, args=(rank, inboxes, shard, n_thread, seed, n_result, output), daemon=True)
+             for rank, shard in enumerate(shards)]
+    for proc in procs:
+        proc.start()
+    try:
+        while True:
+            try:
+                status, value = output.get(timeout=timeout)
+                break
+            except queue.Empty:
+                if any(proc.exitcode not in (None, 0) for proc in procs):
+                    raise RuntimeError("Worker process of sharded Kennard-Stone sampling exited unexpectedly.")
+        if status == "error":
+            raise RuntimeError("Worker process of sharded Kennard-Stone sampling failed:\n" + value)
+        return value
+    finally:
+        for proc in procs:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
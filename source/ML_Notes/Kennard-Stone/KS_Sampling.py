@@ -1,33 +1,605 @@
 import numpy as np
 import ctypes
+import hashlib
 import os
 import os.path as path
-from pathos.multiprocessing import ProcessingPool as Pool
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 
 prog_dir = path.dirname(path.abspath(__file__))
 cpp_name = "ks_cpp"
+cpp_flags = ["-fopenmp", "-O3", "-shared", "-fPIC"]
 
-if not os.path.isfile(prog_dir + "/" + cpp_name + ".so"):
-    current_dir = os.path.abspath(".")
-    os.chdir(path.dirname(path.abspath(__file__)))
-    os.system("gcc -fopenmp -O3 -shared -o " + cpp_name + ".so " + cpp_name + ".c")
-    os.chdir(current_dir)
-ks_cpp = np.ctypeslib.load_library(cpp_name + ".so", prog_dir)
 
+def ks_cpp_cache_dir():
+    """
+    ks_cpp_cache_dir()
+
+    Per-user directory of compiled C program: `KS_CPP_CACHE` if set,
+    otherwise `ks_cpp` in `XDG_CACHE_HOME` (default `~/.cache`).
+    """
+    cache_dir = os.environ.get("KS_CPP_CACHE")
+    if not cache_dir:
+        cache_root = os.environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+        cache_dir = path.join(cache_root, cpp_name)
+    return cache_dir
+
+
+def ks_cpp_build_key(native=None, cc=None):
+    """
+    ks_cpp_build_key(native=None, cc=None)
+
+    Compiler command and hash key of compiled C program. The key covers
+    source of `ks_cpp.c`, compiler and flags, so the library is rebuilt
+    whenever any of them changes.
+
+    Parameters
+    ----------
+
+    native: bool or None, optional
+        Compile with `-march=native`. If set as `None`, enabled by
+        environment variable `KS_CPP_NATIVE=1`. Libraries built with
+        it should not be shared between different machines; the key
+        also covers the machine name in that case.
+
+    cc: str or None, optional
+        Compiler, `CC` environment variable or `gcc` by default.
+    """
+    if native is None:
+        native = os.environ.get("KS_CPP_NATIVE", "0") == "1"
+    cc = cc or os.environ.get("CC") or "gcc"
+    flags = cpp_flags + (["-march=native"] if native else [])
+    with open(path.join(prog_dir, cpp_name + ".c"), "rb") as f:
+        source = f.read()
+    digest = hashlib.sha256(source)
+    digest.update(" ".join([cc] + flags).encode())
+    if native:
+        digest.update(os.uname().nodename.encode() + os.uname().machine.encode())
+    return [cc] + flags, digest.hexdigest()[:16]
+
+
+def _file_lock(lock_path):
+    # Exclusive lock of file between processes (no-op where `fcntl` is unavailable)
+    f = open(lock_path, "a")
+    try:
+        import fcntl
+        fcntl.flock(f, fcntl.LOCK_EX)
+    except ImportError:
+        pass
+    return f
+
+
+def build_ks_cpp(native=None, cc=None, force=False):
+    """
+    build_ks_cpp(native=None, cc=None, force=False)
+
+    Compile `ks_cpp.c` into per-user cache (`ks_cpp_cache_dir`), and
+    return path of the shared library.
+
+    The library is named by `ks_cpp_build_key`, so an existing build is
+    reused without calling compiler. Building is protected by a lock
+    file, so that several processes importing this module at one time
+    compile only once; the library is written into a temporary file and
+    renamed, so a partial library is never loaded.
+
+    Raises `OSError` with compiler output if compilation fails.
+    """
+    command, key = ks_cpp_build_key(native, cc)
+    cache_dir = ks_cpp_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    lib_path = path.join(cache_dir, cpp_name + "-" + key + ".so")
+    if path.isfile(lib_path) and not force:
+        return lib_path
+    with _file_lock(lib_path + ".lock"):
+        if path.isfile(lib_path) and not force:
+            return lib_path
+        fd, tmp_path = tempfile.mkstemp(suffix=".so", dir=cache_dir)
+        os.close(fd)
+        try:
+            proc = subprocess.run(command + ["-o", tmp_path, path.join(prog_dir, cpp_name + ".c")],
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            if proc.returncode != 0:
+                raise OSError("Compilation of " + cpp_name + ".c failed:\n" + " ".join(proc.args) + "\n" + proc.stdout)
+            os.replace(tmp_path, lib_path)
+        finally:
+            if path.exists(tmp_path):
+                os.remove(tmp_path)
+    return lib_path
+
+
+class _KSLibrary:
+    """
+    C program `ks_cpp`, compiled and loaded at first use of a function.
+
+    `KS_CPP_LIB` environment variable could be set as path of a prebuilt
+    library, which skips compilation.
+    """
+    def __init__(self):
+        self._lib = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._lib is None and self._error is None:
+                try:
+                    lib_path = os.environ.get("KS_CPP_LIB") or build_ks_cpp()
+                    lib = np.ctypeslib.load_library(path.basename(lib_path), path.dirname(path.abspath(lib_path)))
+                    lib.kennard_stone_mem_update.restype = ctypes.c_float
+                    lib.farthest_pair.restype = ctypes.c_float
+                    lib.kennard_stone_mem_update_metric.restype = ctypes.c_float
+                    lib.farthest_pair_metric.restype = ctypes.c_float
+                    lib.farthest_pair_sparse.restype = ctypes.c_float
+                    self._lib = lib
+                except OSError as err:
+                    self._error = err
+        if self._error is not None:
+            raise self._error
+        return self._lib
+
+    def available(self):
+        try:
+            self.load()
+        except OSError:
+            return False
+        return True
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+ks_cpp = _KSLibrary()
+
+
+def ks_cpp_available():
+    """
+    ks_cpp_available()
+
+    Whether C program could be compiled and loaded. Sampling functions
+    fall back to Python backend (with a warning) if it is not available;
+    `ks_sampling_batch` and `KSState` on distance matrix are evaluated
+    by NumPy, while `KSState` on original data requires it.
+    """
+    return ks_cpp.available()
+
+
+def _backend(backend):
+    # C backend, or Python backend if C program is not available
+    if backend == "C" and not ks_cpp_available():
+        warnings.warn("C program ks_cpp is not available, Python backend is used instead: " + str(ks_cpp._error),
+                      RuntimeWarning, stacklevel=3)
+        return "Python"
+    return backend
+
+
+def _require_ks_cpp(what):
+    # Error for functions without Python backend, if C program is not available
+    if not ks_cpp_available():
+        raise OSError(what + " requires C program ks_cpp, which is not available: " + str(ks_cpp._error))
+
+
+class KSProgress(ctypes.Structure):
+    """
+    KSProgress()
+
+    Progress of Kennard-Stone sampling in C program, shared with C
+    kernels (`struct Progress` in `ks_cpp.c`) by `progress` argument
+    of sampling functions (C backend).
+
+    C kernels are called by ctypes, which releases the GIL, so another
+    Python thread could read progress and cancel sampling while the
+    kernel runs; see `run_monitored`. After cancellation, sampling
+    functions return the `n_selected` samples selected so far, and
+    `KSState.extend` leaves a state which could be extended again.
+
+    Attributes
+    ----------
+
+    n_selected: int
+        Number of selected samples.
+
+    sup_val: float
+        Current max-min distance, i.e. sampling distance of the next
+        selected sample.
+
+    cancel: int
+        Set as nonzero (by `stop`) to stop sampling.
+
+    phase: int
+        Current phase, index of `PHASES`.
+
+    phase_time: array of float
+        Elapsed seconds of seed search, initialization and main loop.
+    """
+    _fields_ = [
+        ("n_selected", ctypes.c_size_t),
+        ("sup_val", ctypes.c_float),
+        ("cancel", ctypes.c_int),
+        ("phase", ctypes.c_int),
+        ("phase_time", ctypes.c_double * 3),
+    ]
+    PHASES = ("seed", "init", "main", "done")
+
+    def stop(self):
+        self.cancel = 1
+
+    @property
+    def cancelled(self):
+        return bool(self.cancel)
+
+    @property
+    def phase_name(self):
+        return self.PHASES[self.phase]
+
+    @property
+    def times(self):
+        return dict(zip(self.PHASES[:3], self.phase_time))
+
+
+def _progress_ref(progress):
+    # Pointer argument of C kernels, NULL if no progress is requested
+    return None if progress is None else ctypes.byref(progress)
+
+
+def _progress_truncate(progress, result, v_dist):
+    # Selected samples of (possibly cancelled) sampling
+    if progress is None or not progress.cancelled:
+        return result, v_dist
+    return result[:progress.n_selected], v_dist[:progress.n_selected]
+
+
+def _progress_seed_cancelled(progress):
+    # Whether sampling is cancelled in seed search; then nothing is selected
+    if progress is None or not progress.cancelled:
+        return False
+    progress.n_selected = 0
+    progress.phase = KSProgress.PHASES.index("done")
+    return True
+
+
+def run_monitored(func, *args, callback=None, interval=1., progress=None, **kwargs):
+    """
+    run_monitored(func, *args, callback=None, interval=1., progress=None, **kwargs)
+
+    Run sampling function `func(*args, progress=progress, **kwargs)` in
+    a worker thread, and call `callback(progress)` every `interval`
+    seconds in the calling thread. Sampling is cancelled if `callback`
+    returns `False` (then `callback` is not called again), or on
+    `KeyboardInterrupt` (which is re-raised after the kernel stops).
+    Cancellation also stops the farthest pair search of seed.
+
+    Returns
+    -------
+
+    Return value of `func`.
+    """
+    progress = KSProgress() if progress is None else progress
+    output = {}
+
+    def target():
+        try:
+            output["value"] = func(*args, progress=progress, **kwargs)
+        except BaseException as err:
+            output["error"] = err
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(interval)
+            if thread.is_alive() and callback is not None and not progress.cancelled and callback(progress) is False:
+                progress.stop()
+    except KeyboardInterrupt:
+        progress.stop()
+        thread.join()
+        raise
+    if "error" in output:
+        raise output["error"]
+    return output["value"]
+
+
+def get_dist(X, out=None, n_tile=2048, n_thread=None):
+    """
+    get_dist(X, out=None, n_tile=2048, n_thread=None)
+
+    Full Euclidean distance matrix, shape (n_sample, n_sample), float32.
+
+    Distance is evaluated by square tiles of `n_tile` samples (upper
+    triangle tiles, mirrored) in a thread pool, and written directly
+    into `out`; peak memory is the output plus about one tile per thread.
+    See `_dist_tile` for accuracy treatment.
+
+    Parameters
+    ----------
+
+    X: np.ndarray, shape: (n_sample, n_feature)
+
+    out: np.ndarray or np.memmap or str or None, optional
+        Preallocated output. If path is given, output is created as
+        `.npy` memory-mapped file.
+
+    n_tile: int, optional
+
+    n_thread: int or None, optional
+        Number of threads of tiles. If set as `None`, `os.cpu_count()`
+        is used.
+    """
+    Xc, t = _centred(X)
+    n_sample = Xc.shape[0]
+    if out is None:
+        out = np.empty((n_sample, n_sample), dtype=np.float32)
+    elif isinstance(out, (str, os.PathLike)):
+        out = np.lib.format.open_memmap(out, mode="w+", dtype=np.float32, shape=(n_sample, n_sample))
+    assert(out.shape == (n_sample, n_sample))
+
+    def fill(tile_pair):
+        (i0, i1), (j0, j1) = tile_pair
+        tile = _dist_tile(Xc, t, i0, i1, j0, j1)
+        if i0 != j0:
+            out[i0:i1, j0:j1] = tile
+            _transpose_into(out[j0:j1, i0:i1], tile)
+        else:
+            # Diagonal tile is made exactly symmetric from its upper triangle
+            _transpose_into(tile, tile, upper=True)
+            out[i0:i1, j0:j1] = tile
+
+    bounds = [(i0, min(i0 + n_tile, n_sample)) for i0 in range(0, n_sample, n_tile)]
+    tile_pairs = [(bounds[a], bounds[b]) for a in range(len(bounds)) for b in range(a, len(bounds))]
+    with ThreadPoolExecutor(n_thread or os.cpu_count()) as executor:
+        list(executor.map(fill, tile_pairs))
+    return out
+
+
+def _transpose_into(dst, src, upper=False, n_block=128):
+    # dst = src.T by square blocks, much faster than one strided copy for large tiles;
+    # with `upper`, only the upper triangle of `src` is copied (dst is src, made symmetric)
+    for k0 in range(0, src.shape[0], n_block):
+        for l0 in range(k0 if upper else 0, src.shape[1], n_block):
+            block = src[k0:k0 + n_block, l0:l0 + n_block]
+            if upper and k0 == l0:
+                lower = np.tril_indices(block.shape[0], -1)
+                block[lower] = block.T[lower]
+            else:
+                dst[l0:l0 + n_block, k0:k0 + n_block] = block.T
+
+
+def get_dist_condensed(X, n_batch=1024):
+    """
+    get_dist_condensed(X, n_batch=1024)
+
+    Condensed (upper-triangle, scipy `pdist` style) Euclidean distance
+    of length n_sample * (n_sample - 1) / 2.
+
+    Distance is evaluated by row tiles of `n_batch` samples and filled
+    directly into condensed storage, so memory cost is half of `get_dist`
+    plus one (n_batch, n_sample) tile.
+    """
+    Xc, t = _centred(X)
+    n_sample = Xc.shape[0]
+    dist = np.empty(n_sample * (n_sample - 1) // 2, dtype=np.float32)
+    for i0 in range(0, n_sample, n_batch):
+        i1 = min(i0 + n_batch, n_sample)
+        tile = _dist_tile(Xc, t, i0, i1, i0, n_sample)
+        for i in range(i0, i1):
+            offset = condensed_offset(i, n_sample)
+            dist[offset:offset + n_sample - i - 1] = tile[i - i0, i - i0 + 1:]
+    return dist
+
+
+def get_dist_sparse(X, storage="full", n_batch=1024):
+    """
+    get_dist_sparse(X, storage="full", n_batch=1024)
+
+    Euclidean distance of `scipy.sparse` samples, in "full" or
+    "condensed" storage (see `get_dist` and `get_dist_condensed`).
+
+    Distance is evaluated by sparse products of row tiles of `n_batch`
+    samples with all samples and squared row norms (in float64), so
+    features are never made dense. Samples are not centred, so distances
+    much smaller than sample norms are less accurate than `get_dist`.
+    """
+    X, t = _sparse_csr(X)
+    X = X.astype(np.float64)
+    XT = X.T.tocsr()
+    n_sample = X.shape[0]
+    if storage == "full":
+        dist = np.empty((n_sample, n_sample), dtype=np.float32)
+    elif storage == "condensed":
+        dist = np.empty(n_sample * (n_sample - 1) // 2, dtype=np.float32)
+    else:
+        raise ValueError("`storage` should be either \"full\" or \"condensed\".")
+    for i0 in range(0, n_sample, n_batch):
+        i1 = min(i0 + n_batch, n_sample)
+        j0 = 0 if storage == "full" else i0
+        tile = t[i0:i1, None] + t[None, j0:] - 2 * (X[i0:i1] @ XT[:, j0:]).toarray()
+        tile = np.sqrt(np.maximum(tile, 0))
+        tile[np.arange(i1 - i0), np.arange(i0, i1) - j0] = 0
+        if storage == "full":
+            dist[i0:i1] = tile
+            continue
+        for i in range(i0, i1):
+            offset = condensed_offset(i, n_sample)
+            dist[offset:offset + n_sample - i - 1] = tile[i - i0, i - i0 + 1:]
+    return dist
+
+
+def _is_sparse(X):
+    # `scipy.sparse` input; scipy is an optional dependency, and a sparse
+    # matrix could only be passed in if scipy is already imported
+    sparse = sys.modules.get("scipy.sparse")
+    return sparse is not None and sparse.issparse(X)
+
+
+def _sparse_csr(X):
+    # Canonical float32 CSR matrix (sorted, no duplicate entries) and squared row norms in float64
+    X = X.tocsr().astype(np.float32)
+    if not X.has_canonical_format:
+        X = X.copy()
+        X.sum_duplicates()
+    t = np.asarray(X.multiply(X).sum(axis=1, dtype=np.float64)).ravel()
+    return X, t
+
+
+def _centred(X, n_block=None):
+    # Samples centred by mean (in float64) and their squared norms;
+    # centring makes norms small compared to distances, which reduces cancellation.
+    # Rows are centred by blocks, so no float64 copy of the whole `X` is made.
+    X = np.asarray(X)
+    Xc = np.empty(X.shape, dtype=np.float32)
+    for i0, i1, X_block in _mem_blocks(X, _mem_block_size(n_block, X.shape[1]), _mem_mean(X, n_block)):
+        Xc[i0:i1] = X_block
+    return Xc, np.einsum("ia, ia -> i", Xc, Xc, dtype=np.float64).astype(np.float32)
+
+
+def _dist_tile(Xc, t, i0, i1, j0, j1, rtol=1e-3, n_bytes=2**25):
+    # Distance tile of centred samples [i0, i1) x [j0, j1) by t_i + t_j - 2 x_i.x_j.
+    # Where the squared distance is smaller than `rtol` of t_i + t_j, float32 cancellation
+    # loses digits; rows and columns holding such elements are recomputed by float64 GEMM
+    # on sub-blocks, with float64 copies of at most `n_bytes` per side.
+    # Negative values are clamped to zero before sqrt.
+    tile = Xc[i0:i1] @ Xc[j0:j1].T
+    tile *= -2
+    tile += t[i0:i1, None]
+    tile += t[None, j0:j1]
+    mask = tile < rtol * (t[i0:i1, None] + t[None, j0:j1])
+    # Self distances are exactly zero
+    k = np.arange(max(i0, j0), min(i1, j1))
+    tile[k - i0, k - j0] = 0
+    mask[k - i0, k - j0] = False
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask[rows].any(axis=0))
+    n_chunk = max(1, n_bytes // (8 * Xc.shape[1]))
+    for c0 in range(0, cols.shape[0], n_chunk):
+        c = cols[c0:c0 + n_chunk]
+        XJ = Xc[j0 + c].astype(np.float64)
+        tJ = np.einsum("ia, ia -> i", XJ, XJ)
+        for r0 in range(0, rows.shape[0], n_chunk):
+            r = rows[r0:r0 + n_chunk]
+            XI = Xc[i0 + r].astype(np.float64)
+            sub = XI @ XJ.T
+            sub *= -2
+            sub += np.einsum("ia, ia -> i", XI, XI)[:, None]
+            sub += tJ[None, :]
+            block = np.ix_(r, c)
+            tile[block] = np.where(mask[block], sub, tile[block])
+    np.maximum(tile, 0, out=tile)
+    return np.sqrt(tile, out=tile)
+
+
+euclid_dist = {"full": get_dist, "condensed": get_dist_condensed}
+
+# Reduced-precision storage: code type of C program
+QUANTIZED = {"float16": 0, "uint16": 1, "uint8": 2}
+
+
+def quantize_dist(dist, storage="uint16", n_batch=1024):
+    """
+    quantize_dist(dist, storage="uint16", n_batch=1024)
+
+    Reduced-precision storage of full distance matrix, as tuple
+    `(codes, scale)`, where distance of row `i` is `scale[i] * codes[i]`.
+
+    - "float16": rows are normalized by their largest distance, so
+      relative precision is about 5e-4 in the whole range.
+    - "uint16", "uint8": rows are quantized uniformly in
+      [0, largest distance of row]; absolute error is half of
+      `scale[i]`, so small distances lose relative precision.
+
+    Rows (not columns) are scaled, as Kennard-Stone sampling only reads
+    rows of selected samples; stored matrix is not exactly symmetric.
+    """
+    n_sample = dist.shape[0]
+    codes = np.empty((n_sample, n_sample), dtype=storage)
+    scale = np.empty(n_sample, dtype=np.float32)
+    for i0 in range(0, n_sample, n_batch):
+        i1 = min(i0 + n_batch, n_sample)
+        codes[i0:i1], scale[i0:i1] = _quantize_rows(np.asarray(dist[i0:i1], dtype=np.float32), storage)
+    return codes, scale
+
+
+def get_dist_quantized(X, storage="uint16", n_batch=1024):
+    """
+    get_dist_quantized(X, storage="uint16", n_batch=1024)
+
+    Reduced-precision Euclidean distance (see `quantize_dist`),
+    evaluated by row tiles of `n_batch` samples, so that float32 matrix
+    is never allocated; memory cost is a half ("float16", "uint16") or
+    a quarter ("uint8") of `get_dist`, plus one (n_batch, n_sample) tile.
+    """
+    Xc, t = _centred(X)
+    n_sample = Xc.shape[0]
+    codes = np.empty((n_sample, n_sample), dtype=storage)
+    scale = np.empty(n_sample, dtype=np.float32)
+    for i0 in range(0, n_sample, n_batch):
+        i1 = min(i0 + n_batch, n_sample)
+        codes[i0:i1], scale[i0:i1] = _quantize_rows(_dist_tile(Xc, t, i0, i1, 0, n_sample), storage)
+    return codes, scale
 
-def get_dist(X):
-    dist = X @ X.T
-    t = dist.diagonal().copy()
-    dist *= -2
-    dist += t[:, None]
-    dist += t[None, :]
-    return np.sqrt(dist)
 
+def _quantize_rows(tile, storage):
+    # Codes and scales of rows of distance tile
+    if storage not in QUANTIZED:
+        raise ValueError("`storage` should be one of " + ", ".join(QUANTIZED) + ".")
+    row_max = tile.max(axis=1)
+    row_max[row_max <= 0] = 1
+    if storage == "float16":
+        return (tile / row_max[:, None]).astype(np.float16), row_max
+    scale = row_max / np.iinfo(storage).max
+    return np.rint(tile / scale[:, None]).astype(storage), scale
 
-def ks_sampling(X, seed=None, n_result=None, get_dist=get_dist, backend="C"):
+
+def condensed_offset(i, n_sample):
+    """
+    Position of element (i, i + 1) in condensed distance storage.
+    Element (i, j) with i < j is at `condensed_offset(i, n_sample) + j - i - 1`.
+    """
+    return i * n_sample - i * (i + 1) // 2
+
+
+def load_memmap(path, n_feature=None, dtype=np.float32):
     """
-    ks_sampling_general(X, seed=None, n_result=None, backend="Python")
+    load_memmap(path, n_feature=None, dtype=np.float32)
+
+    Open a feature matrix on disk as read-only `np.memmap`,
+    without reading it into memory.
+
+    Parameters
+    ----------
+
+    path: str
+        Path to `.npy` file, or raw binary file of C-ordered
+        matrix.
+
+    n_feature: int or None, optional
+        Number of features of raw binary file.
+        Not required for `.npy` file.
+
+    dtype: np.dtype, optional
+        Data type of raw binary file.
+        Not required for `.npy` file.
+    """
+    if str(path).endswith(".npy"):
+        X = np.load(path, mmap_mode="r")
+    elif n_feature is None:
+        raise ValueError("`n_feature` should be provided for raw binary file.")
+    else:
+        X = np.memmap(path, dtype=dtype, mode="r").reshape(-1, n_feature)
+    if X.ndim != 2:
+        raise ValueError("Feature matrix on disk should be 2-dimensional.")
+    return X
+
+
+def ks_sampling(X, seed=None, n_result=None, get_dist=None, backend="C", storage="full", metric="euclidean", y=None, VI=None, progress=None):
+    """
+    ks_sampling_general(X, seed=None, n_result=None, backend="Python", storage="full", metric="euclidean", y=None, VI=None, progress=None)
 
     Kennard-Stone Full Sampling Program
 
@@ -47,32 +619,115 @@ def ks_sampling(X, seed=None, n_result=None, get_dist=get_dist, backend="C"):
         If set as `None`, `n_sample` will be used instead, i.e.
         selectet all data.
 
-    get_dist: function
+    get_dist: function or None
         A function `get_dist(X)` that will read original data, and
         return distance.
-        Default Implementation is Euclidean distance.
+        If set as `None`, Euclidean distance (`get_dist` or
+        `get_dist_condensed`, depending on `storage`) will be used.
 
     backend: str, "Python" or "C"
         Specify Kennard-Stone sampling function backend in Python
         language or C language.
+
+    storage: str, "full", "condensed", "float16", "uint16" or "uint8"
+        Storage of distance matrix. "condensed" stores upper-triangle
+        only (scipy `pdist` style), which halves memory cost.
+        User's `get_dist` should then return condensed distance.
+        "float16", "uint16" and "uint8" are reduced-precision storage
+        (see `quantize_dist`), which halve or quarter memory cost and
+        bandwidth, but selection order may differ from float32 where
+        distances are close (see `validate_storage`); user's
+        `get_dist` should return full distance, which is quantized.
+
+    metric: str, optional
+        Metric of distance when `get_dist` is `None`:
+        "euclidean", "mahalanobis", "manhattan", "cosine" or "spxy".
+        See `ks_sampling_mem` for definitions.
+
+    y: np.ndarray or None, shape: (n_sample, ) or (n_sample, n_target)
+        Targets of samples, required for SPXY metric.
+
+    VI: np.ndarray or None, shape: (n_feature, n_feature)
+        Inverse covariance matrix of Mahalanobis metric.
+        If set as `None`, inverse of sample covariance is used.
+
+    progress: KSProgress or None
+        Progress of C backend, see `KSProgress` and `run_monitored`.
+
+    `X` could also be `scipy.sparse` matrix, with Euclidean metric;
+    distances are evaluated by `get_dist_sparse`.
     """
-    X = np.asarray(X, dtype=np.float32)
+    if not _is_sparse(X):
+        X = np.asarray(X, dtype=np.float32)
     if n_result is None:
         n_result = X.shape[0]
+    if storage not in euclid_dist and storage not in QUANTIZED:
+        raise ValueError("`storage` should be one of \"full\", \"condensed\", " + ", ".join(QUANTIZED) + ".")
+    if _is_sparse(X) and get_dist is None:
+        if metric != "euclidean":
+            raise NotImplementedError("Sparse samples only support Euclidean metric.")
+        get_dist = lambda X: get_dist_sparse(X, "full" if storage in QUANTIZED else storage)
+    if get_dist is None and metric == "mahalanobis":
+        X, metric = whiten(X, VI), "euclidean"
+    if storage in QUANTIZED and get_dist is None and metric == "euclidean":
+        get_dist = lambda X: get_dist_quantized(X, storage)
+    elif storage in QUANTIZED:
+        get_dist_full = get_dist if get_dist is not None else lambda X: get_dist_metric(X, metric, y, "full")
+        get_dist = lambda X: quantize_dist(get_dist_full(X), storage)
+    elif get_dist is None and metric == "euclidean":
+        get_dist = euclid_dist[storage]
+    elif get_dist is None:
+        get_dist = lambda X: get_dist_metric(X, metric, y, storage)
     dist = get_dist(X)
+    backend = _backend(backend)
     if backend == "Python":
-        if seed is None or len(seed) == 0:
-            seed = np.unravel_index(np.argmax(dist), dist.shape)
         return ks_sampling_core(dist, seed, n_result)
     elif backend == "C":
-        return ks_sampling_core_cpp(dist, seed, n_result)
+        return ks_sampling_core_cpp(dist, seed, n_result, progress)
     else:
-        raise NotImplemented("Other backends are not implemented!")
+        raise NotImplementedError("Other backends are not implemented!")
 
 
-def ks_sampling_mem(X, seed=None, n_result=None, get_dist=get_dist, backend="C", n_proc=4, n_batch=1000):
+def validate_storage(X, storages=("float16", "uint16", "uint8"), n_result=None, get_dist=None):
     """
-    ks_sampling_mem(X, seed=None, n_result=None, backend="Python", n_proc=4, n_batch=1000)
+    validate_storage(X, storages=("float16", "uint16", "uint8"), n_result=None, get_dist=None)
+
+    Compare selection on reduced-precision storages with float32 full
+    distance matrix, from the same seed.
+
+    Returns
+    -------
+
+    report: list of dict
+        For each storage: "nbytes" of storage, "agreement" (fraction of
+        positions with the same selection), "first_difference" (first
+        position where selection differs, or `None`), "overlap"
+        (fraction of common selected samples regardless of order) and
+        "v_dist_error" (largest relative error of sampling distances).
+    """
+    X = np.asarray(X, dtype=np.float32)
+    dist = get_dist(X) if get_dist is not None else euclid_dist["full"](X)
+    ref, ref_v = ks_sampling_core_cpp(dist, None, n_result)
+    report = []
+    for storage in storages:
+        dist_q = quantize_dist(dist, storage) if get_dist is not None else get_dist_quantized(X, storage)
+        result, v_dist = ks_sampling_core_cpp(dist_q, ref[:2], n_result)
+        differ = np.flatnonzero(result != ref)
+        report.append({
+            "storage": storage,
+            "nbytes": dist_q[0].nbytes + dist_q[1].nbytes,
+            "agreement": float(np.mean(result == ref)),
+            "first_difference": int(differ[0]) if differ.shape[0] else None,
+            "overlap": len(np.intersect1d(result, ref)) / len(ref),
+            "v_dist_error": float(np.max(np.abs(v_dist[:-1] - ref_v[:-1]) / np.maximum(ref_v[:-1], 1e-30), initial=0)),
+        })
+        del dist_q
+    return report
+
+
+def ks_sampling_mem(X, seed=None, n_result=None, get_dist=get_dist, backend="C", n_proc=None, n_batch=None, n_block=None, pruned_seed=False, metric="euclidean", y=None, VI=None, progress=None):
+    """
+    ks_sampling_mem(X, seed=None, n_result=None, backend="Python", n_proc=None, n_batch=None, n_block=None, pruned_seed=False, metric="euclidean", y=None, VI=None, progress=None)
 
     Kennard-Stone Full Sampling Program
         (with limited memory)
@@ -81,16 +736,21 @@ def ks_sampling_mem(X, seed=None, n_result=None, get_dist=get_dist, backend="C",
     instead of `ks_sampling_mem` is strongly recommended.
     
     This program could possibly handle very large dataset.
-    To make memory cost as low as possible, `n_batch` could
-    be set to about sqrt(X.shape[0]) manually.
-    However, to make efficiency as the first priority,
-    `n_batch` could be set to as large as possible.
+    Farthest pair (default seed) search and sampling are both
+    performed in C program with OpenMP; sampling works on a
+    centred float32 copy of `X`, so that data with large offset
+    do not lose precision.
+    User need to use OMP_NUM_THREADS in environment to specify
+    C program's paralleling behavior.
 
     Parameters
     ----------
 
-    X: np.ndarray, shape: (n_sample, n_feature)
+    X: np.ndarray or np.memmap or str, shape: (n_sample, n_feature)
         Original data, need to be generated by user.
+        If `np.memmap` or path to `.npy` file is given, sampling is
+        performed out-of-core (see `ks_sampling_mem_core_ooc`).
+        Raw binary file should be opened by `load_memmap` first.
 
     seed: np.ndarray or list or None, shape: (n_seed, ), optional
         Initial selected seed.
@@ -111,90 +771,830 @@ def ks_sampling_mem(X, seed=None, n_result=None, get_dist=get_dist, backend="C",
         Specify Kennard-Stone sampling function backend in Python
         language or C language.
     
-    n_proc: int, optional
-        Number of Python's multiprocessing processors.
-        NOTE! This variable only controls Python's code.
-        User need to use OMP_NUM_THREADS in environment to specify
-        C program's paralleling behavior.
+    n_proc: None
+        Not used. Kept for compatibility; farthest pair search is
+        parallelized by OpenMP instead of Python's multiprocessing.
     
-    n_batch: int, optional
-        The dimension of distance matrix evaluation in one processor.
+    n_batch: int or None, optional
+        Number of rows of blocks in farthest pair search.
+        Only used for out-of-core `X`, see `find_farthest_pair`.
+
+    n_block: int or None, optional
+        Number of rows streamed to C program at one time in
+        out-of-core sampling.
+        If set, out-of-core sampling is also used for in-memory `X`.
+
+    pruned_seed: bool, optional
+        Use bound-pruned exact farthest pair search, see
+        `find_farthest_pair`.
+
+    metric: str, optional
+        Metric of distance, evaluated in C program:
+
+        - "euclidean": Euclidean distance.
+        - "mahalanobis": Euclidean distance of whitened data
+          `(X - mean) @ L`, where `VI = L @ L.T` (see `whiten`).
+        - "manhattan": L1 (city block) distance.
+        - "cosine": `1 - x.y / (|x| |y|)`; zero vectors have distance 1
+          to all other samples.
+        - "spxy": SPXY distance `|x1 - x2| / scale_x + |y1 - y2| / scale_y`,
+          where scales are largest Euclidean distances of `X` and `y`.
+
+        Other metrics than Euclidean are only available for C backend,
+        and are sampled by streaming `X` (see `KSState`).
+
+    y: np.ndarray or None, shape: (n_sample, ) or (n_sample, n_target)
+        Targets of samples, required for SPXY metric.
+
+    VI: np.ndarray or None, shape: (n_feature, n_feature)
+        Inverse covariance matrix of Mahalanobis metric.
+        If set as `None`, inverse of sample covariance is used.
+
+    progress: KSProgress or None
+        Progress of C backend, see `KSProgress` and `run_monitored`.
+        Farthest pair search is timed as seed phase, and could also be
+        cancelled (then no sample is returned).
+
+    `X` could also be `scipy.sparse` matrix, with Euclidean metric;
+    see `ks_sampling_sparse_core_cpp`. `n_batch`, `n_block` and
+    `pruned_seed` are not used for sparse samples.
     """
-    X = np.asarray(X, dtype=np.float32)
+    if _is_sparse(X):
+        if metric != "euclidean":
+            raise NotImplementedError("Sparse samples only support Euclidean metric.")
+        if _backend(backend) == "Python":
+            return ks_sampling_sparse_core(X, seed, n_result)
+        return ks_sampling_sparse_core_cpp(X, seed, n_result, progress)
+    if isinstance(X, (str, os.PathLike)):
+        X = load_memmap(X)
+    out_of_core = isinstance(X, np.memmap) or n_block is not None
+    if not out_of_core:
+        X = np.asarray(X, dtype=np.float32)
+    backend = _backend(backend)
+    if metric == "mahalanobis":
+        X, metric = whiten(X, VI, n_batch), "euclidean"
     n_sample = X.shape[0]
     if n_result is None:
         n_result = X.shape[0]
+    t_start = time.perf_counter()
+    if metric == "spxy":
+        scale = spxy_scale(X, y, n_batch if out_of_core else None, progress)
+    else:
+        scale = None
     # Find most distant sample indexes if no seed provided
-    if seed is None or len(seed) == 0:
-        t = np.einsum("ia, ia -> i", X, X)
-        
-        def get_dist_slice(sliceA, sliceB):
-            distAB = t[sliceA, None] - 2 * X[sliceA] @ X[sliceB].T + t[None, sliceB]
-            if sliceA == sliceB:
-                np.fill_diagonal(distAB, 0)
-            return np.sqrt(distAB)
-        
-        def get_maxloc_slice(slice_pair):
-            dist_slice = get_dist_slice(slice_pair[0], slice_pair[1])
-            max_indexes = np.unravel_index(np.argmax(dist_slice), dist_slice.shape)
-            return (dist_slice[max_indexes], max_indexes[0] + slice_pair[0].start, max_indexes[1] + slice_pair[1].start)
-        
-        p = list(np.arange(0, n_sample, n_batch)) + [n_sample]
-        slices = [slice(p[i], p[i+1]) for i in range(len(p) - 1)]
-        slice_pairs = [(slices[i], slices[j]) for i in range(len(slices)) for j in range(len(slices)) if i <= j]
-        
-        with Pool(n_proc) as p:
-            maxloc_slice_list = p.map(get_maxloc_slice, slice_pairs)
-        max_indexes = maxloc_slice_list[np.argmax([v[0] for v in maxloc_slice_list])][1:]
-        seed = max_indexes
+    if (seed is None or len(seed) == 0) and not _progress_seed_cancelled(progress):
+        seed = find_farthest_pair(X, n_batch if out_of_core else None, pruned_seed, metric, y, scale, progress)
+    if progress is not None:
+        progress.phase_time[0] += time.perf_counter() - t_start
+    if _progress_seed_cancelled(progress):
+        return np.zeros(0, dtype=int), np.zeros(0)
     seed = np.asarray(seed, dtype=np.uintp)
     
-    if backend == "Python":
-        return ks_sampling_mem_core(X, seed, n_result)
+    if backend == "Python" and metric != "euclidean":
+        raise NotImplementedError("Python backend only supports Euclidean metric.")
+    elif backend == "Python":
+        return ks_sampling_core_mem(np.asarray(X, dtype=np.float32), seed, n_result)
+    elif backend == "C" and metric != "euclidean":
+        state = KSState.from_X(X, seed, n_block, metric, y, scale)
+        state.extend(X, n_result, n_block, y, progress)
+        return state.result, state.v_dist
+    elif backend == "C" and out_of_core:
+        return ks_sampling_mem_core_ooc(X, seed, n_result, n_block, progress)
     elif backend == "C":
-        return ks_sampling_mem_core_cpp(X, seed, n_result)
+        return ks_sampling_mem_core_cpp(X, seed, n_result, progress)
     else:
-        raise NotImplemented("Other backends are not implemented!")
+        raise NotImplementedError("Other backends are not implemented!")
+
+
+def ks_sampling_pruned(X, seed=None, n_result=None, n_group=None, tol=0., n_block=None, random_state=0, return_stats=False, progress=None):
+    """
+    ks_sampling_pruned(X, seed=None, n_result=None, n_group=None, tol=0., n_block=None, random_state=0, return_stats=False, progress=None)
+
+    Kennard-Stone Sampling Program
+        (triangle-inequality pruned, for very large `n_sample`)
+
+    Samples are grouped into `n_group` balls (see `ks_groups`), and
+    rows of `X` are reordered by group. In every iteration, a group is
+    skipped if the distance from its center to the new selected sample,
+    minus its radius, is not smaller than the largest minimum distance
+    in the group, so that most samples are not touched once selected
+    samples cover the dataset; single samples are skipped similarly.
+    See `kennard_stone_pruned` in `ks_cpp.c`.
+
+    Parameters
+    ----------
+
+    X: np.ndarray or np.memmap, shape: (n_sample, n_feature)
+        Original data. A reordered float32 copy is kept in memory.
+
+    seed: np.ndarray or list or None, shape: (n_seed, ), optional
+        Initial selected seed. If set as `None`, the two most distant
+        samples (by pruned search of `find_farthest_pair`) are used.
+
+    n_result: int or None, optional
+
+    n_group: int or None, optional
+        Number of groups. If set as `None`, `sqrt(n_sample)` (at most
+        4096) is used.
+
+    tol: float, optional
+        With `tol=0`, selection is exact, i.e. same to `ks_sampling_mem`
+        up to rounding of ties. With `tol > 0`, bounds are relaxed by
+        factor `1 + tol`: more samples are skipped, and minimum
+        distances (so `v_dist`) could be overestimated by that factor.
+
+    n_block: int or None, optional
+        Rows per block when grouping samples.
+
+    random_state: int, optional
+        Seed of the subsample for group centers.
+
+    return_stats: bool, optional
+        Also return dict with "n_eval" (number of sample distances
+        evaluated in iterations) and "n_full" (number without pruning).
+
+    progress: KSProgress or None
+        See `KSProgress`. Farthest pair search and grouping are timed
+        as seed and initialization phases.
+
+    If C program is not available, samples are selected without
+    pruning by `ks_sampling_mem` (Python backend), with a warning.
+    """
+    n_sample, n_feature = X.shape
+    if n_result is None:
+        n_result = n_sample
+    if _backend("C") == "Python":
+        result, v_dist = ks_sampling_mem(X, seed, n_result, backend="Python", n_block=n_block, progress=progress)
+        if return_stats:
+            n_full = sum(n_sample - n for n in range(1, n_result))
+            return result, v_dist, {"n_eval": n_full, "n_full": n_full}
+        return result, v_dist
+    t_start = time.perf_counter()
+    if seed is None or len(seed) == 0:
+        seed = find_farthest_pair(X, n_block, pruned=True, progress=progress)
+    if _progress_seed_cancelled(progress):
+        progress.phase_time[0] += time.perf_counter() - t_start
+        empty = (np.zeros(0, dtype=int), np.zeros(0))
+        return empty + ({"n_eval": 0, "n_full": 0}, ) if return_stats else empty
+    seed = np.asarray(seed, dtype=int)
+    t_seed = time.perf_counter()
+    order, group_ptr, centers, r_center, radius = ks_groups(X, n_group, n_block, random_state)
+    # Squared distances are t_i + t_j - 2 x_i.x_j in float32, so samples (and centers,
+    # in the same frame) are centred; bounds are distances, which do not change
+    center = _mem_mean(X, n_block)
+    X_g = np.empty((n_sample, n_feature), dtype=np.float32)
+    n_block = _mem_block_size(n_block, n_feature)
+    for i0 in range(0, n_sample, n_block):
+        X_g[i0:i0 + n_block] = np.asarray(X[order[i0:i0 + n_block]]) - center
+    t = np.einsum("ia, ia -> i", X_g, X_g, dtype=np.float64).astype(np.float32)
+    centers = np.ascontiguousarray(centers - center, dtype=np.float32)
+    rank = np.empty(n_sample, dtype=np.uintp)
+    rank[order] = np.arange(n_sample)
+    result = np.zeros(n_result, dtype=np.uintp)
+    result[:len(seed)] = rank[seed]
+    v_dist = np.zeros(n_result, dtype=np.float32)
+    if len(seed) == 2:
+        v_dist[0] = np.linalg.norm(X_g[result[0]] - X_g[result[1]])
+    min_vals = np.zeros(n_sample, dtype=np.float32)
+    selected = np.zeros(n_sample, dtype=bool)
+    n_eval = ctypes.c_size_t(0)
+    if progress is not None:
+        progress.phase_time[0] += t_seed - t_start
+        progress.phase_time[1] += time.perf_counter() - t_seed
+    ks_cpp.kennard_stone_pruned(
+        X_g.ctypes.data_as(ctypes.c_void_p),
+        t.ctypes.data_as(ctypes.c_void_p),
+        centers.ctypes.data_as(ctypes.c_void_p),
+        group_ptr.ctypes.data_as(ctypes.c_void_p),
+        r_center.ctypes.data_as(ctypes.c_void_p),
+        radius.ctypes.data_as(ctypes.c_void_p),
+        order.ctypes.data_as(ctypes.c_void_p),
+        result.ctypes.data_as(ctypes.c_void_p),
+        v_dist.ctypes.data_as(ctypes.c_void_p),
+        min_vals.ctypes.data_as(ctypes.c_void_p),
+        selected.ctypes.data_as(ctypes.c_void_p),
+        ctypes.c_size_t(n_sample),
+        ctypes.c_size_t(n_feature),
+        ctypes.c_size_t(len(radius)),
+        ctypes.c_size_t(len(seed)),
+        ctypes.c_size_t(n_result),
+        ctypes.c_float(tol),
+        ctypes.byref(n_eval),
+        _progress_ref(progress),
+    )
+    result, v_dist = _progress_truncate(progress, order[result].astype(int), v_dist)
+    if return_stats:
+        n_full = sum(n_sample - n for n in range(1, n_result))
+        return result, v_dist.astype(float), {"n_eval": n_eval.value, "n_full": n_full}
+    return result, v_dist.astype(float)
+
+
+def ks_groups(X, n_group=None, n_block=None, random_state=0):
+    """
+    ks_groups(X, n_group=None, n_block=None, random_state=0)
+
+    Group samples into balls for `ks_sampling_pruned`.
+
+    Centers are chosen by farthest-point traversal (i.e. Kennard-Stone
+    sampling, which is 2-approximation of the k-center problem) on a
+    random subsample, and every sample is assigned to its nearest
+    center by row blocks.
+
+    Returns
+    -------
+
+    order: np.ndarray, shape: (n_sample, )
+        Sample indexes sorted by group (then by index).
+
+    group_ptr: np.ndarray, shape: (n_group + 1, )
+        Samples of group `g` are `order[group_ptr[g]:group_ptr[g + 1]]`.
+
+    centers: np.ndarray, shape: (n_group, n_feature)
+
+    r_center: np.ndarray, shape: (n_sample, )
+        Distance of `order` samples to their centers.
+
+    radius: np.ndarray, shape: (n_group, )
+    """
+    n_sample, n_feature = X.shape
+    if n_group is None:
+        n_group = int(min(max(np.sqrt(n_sample), 1), 4096))
+    n_group = min(n_group, n_sample)
+    n_block = _mem_block_size(n_block, n_feature)
+    rng = np.random.default_rng(random_state)
+    sub = np.sort(rng.choice(n_sample, min(n_sample, 16 * n_group), replace=False))
+    X_sub = np.ascontiguousarray(X[sub], dtype=np.float32)
+    centers = X_sub[ks_sampling_mem(X_sub, n_result=n_group)[0]] if n_group > 1 else X_sub[:1]
+    centers = np.ascontiguousarray(centers, dtype=np.float32)
+    # Nearest centers by |c|^2 - 2 x.c, on centred samples and centers to avoid cancellation
+    center = _mem_mean(X, n_block)
+    centers_c = np.ascontiguousarray(centers - center, dtype=np.float32)
+    t_c = (centers_c.astype(np.float64)**2).sum(axis=1)
+    labels = np.zeros(n_sample, dtype=int)
+    r = np.zeros(n_sample, dtype=np.float32)
+    for i0, i1, X_block in _mem_blocks(X, n_block, center):
+        labels[i0:i1] = (t_c[None, :] - 2 * (X_block @ centers_c.T)).argmin(axis=1)
+        # Distances to centers are evaluated directly, since bounds rely on them
+        r[i0:i1] = np.linalg.norm(X_block.astype(np.float64) - centers_c[labels[i0:i1]], axis=1)
+    order = np.argsort(labels, kind="stable").astype(np.uintp)
+    group_ptr = np.zeros(n_group + 1, dtype=np.uintp)
+    group_ptr[1:] = np.cumsum(np.bincount(labels, minlength=n_group))
+    radius = np.zeros(n_group, dtype=np.float32)
+    np.maximum.at(radius, labels, r)
+    return order, group_ptr, centers, np.ascontiguousarray(r[order]), radius
+
+
+def ks_sampling_batch(X, queries, mem=True, get_dist=None, storage="full", n_block=None):
+    """
+    ks_sampling_batch(X, queries, mem=True, get_dist=None, storage="full", n_block=None)
+
+    Kennard-Stone Sampling of Several Selection Queries on One Dataset
+
+    With `mem=True`, all queries are advanced together: in every
+    iteration, each unfinished query selects one sample, and minimum
+    distances of all queries are updated in one pass over `X` in C
+    program (Euclidean distance), so that reading `X` is shared by
+    queries. `X` could be `np.memmap` (streamed by blocks of `n_block`).
+    Memory cost is `n_query * n_sample` minimum distances and flags.
+
+    With `mem=False`, distance matrix is generated once by `get_dist`
+    (see `ks_sampling`), and every query is sampled on it.
+
+    Both are evaluated by NumPy if C program is not available.
+
+    Parameters
+    ----------
+
+    X: np.ndarray or np.memmap, shape: (n_sample, n_feature)
+
+    queries: list of dict or None
+        Each query could have keys (all optional)
+        "seed" (initial selected samples, default the two most distant
+        samples of the subset), "n_result" (default size of the subset)
+        and "subset" (indexes of candidate samples, default all).
+        `None` is the default query.
+
+    Returns
+    -------
+
+    results: list of tuple
+        `(result, v_dist)` of each query; `result` is index of `X`.
+    """
+    n_sample = X.shape[0]
+    queries = [_batch_query(query, n_sample) for query in queries]
+    if mem:
+        return _ks_sampling_batch_mem(X, queries, n_block)
+    if storage not in euclid_dist:
+        raise ValueError("`storage` should be either \"full\" or \"condensed\".")
+    dist = (euclid_dist[storage] if get_dist is None else get_dist)(np.asarray(X, dtype=np.float32))
+    pairs = {}
+    results = []
+    for subset, seed, n_result in queries:
+        if seed is None:
+            key = None if subset is None else subset.tobytes()
+            if key not in pairs:
+                pairs[key] = _dist_farthest_pair(dist) if subset is None else _dist_subset_farthest_pair(dist, subset)
+            seed = np.asarray(pairs[key], dtype=int)
+        selected = np.zeros(n_sample, dtype=bool) if subset is None else ~np.isin(np.arange(n_sample), subset)
+        selected[seed] = True
+        v_dist = np.zeros(len(seed))
+        if len(seed) == 2:
+            v_dist[0] = _dist_row(dist, seed[0])[seed[1]]
+        state = KSState(seed, v_dist, np.full(n_sample, np.inf), selected)
+        for idx in seed:
+            np.minimum(state.min_vals, _dist_row(dist, idx), out=state.min_vals)
+        state.extend(dist, n_result)
+        results.append((state.result, state.v_dist))
+    return results
 
 
-def ks_sampling_core(dist, seed, n_result):
+def _batch_query(query, n_sample):
+    # Normalized query as (subset or None, seed or None, n_result)
+    query = {} if query is None else query
+    subset = query.get("subset")
+    seed = query.get("seed")
+    if subset is not None:
+        subset = np.unique(np.asarray(subset, dtype=int))
+    if seed is not None and len(seed) == 0:
+        seed = None
+    if seed is not None:
+        seed = np.asarray(seed, dtype=int)
+    n_result = query.get("n_result")
+    n_result = (n_sample if subset is None else len(subset)) if n_result is None else n_result
+    return subset, seed, n_result
+
+
+def _dist_subset_farthest_pair(dist, subset):
+    # Most distant pair of samples in `subset`, by rows of full or condensed distance matrix
+    sup = (-1., 0, 0)
+    for i in subset:
+        row = _dist_row(dist, i)[subset]
+        j = row.argmax()
+        if row[j] > sup[0]:
+            sup = (row[j], i, subset[j])
+    return tuple(sorted(sup[1:]))
+
+
+def _ks_sampling_batch_mem(X, queries, n_block=None):
+    n_sample, n_feature = X.shape
+    n_query = len(queries)
+    n_block = n_sample if n_block is None and not isinstance(X, np.memmap) else _mem_block_size(n_block, n_feature)
+    min_vals = np.full((n_query, n_sample), np.inf, dtype=np.float32)
+    selected = np.zeros((n_query, n_sample), dtype=bool)
+    sup_val = np.full(n_query, -1, dtype=np.float32)
+    sup_index = np.zeros(n_query, dtype=np.uintp)
+    use_c = ks_cpp_available()
+    # Squared distances are t_i + t_j - 2 x_i.x_j in float32, so samples are centred:
+    # in-memory `X` once, and out-of-core blocks as they are streamed
+    if isinstance(X, np.memmap):
+        center = _mem_mean(X, n_block)
+    else:
+        X, center = _centred(X)[0], None
+    t = np.concatenate([np.einsum("ia, ia -> i", X_block, X_block, dtype=np.float64)
+                        for i0, i1, X_block in _mem_blocks(X, n_block, center)]).astype(np.float32)
+
+    def update(qs, refs):
+        # Update queries `qs` by reference samples `refs`, in one pass over `X`
+        X_ref = X[np.asarray(refs)]
+        X_ref = np.ascontiguousarray(X_ref if center is None else X_ref - center, dtype=np.float32)
+        t_ref = np.ascontiguousarray(t[refs])
+        query = np.asarray(qs, dtype=np.uintp)
+        block_val = np.zeros(len(qs), dtype=np.float32)
+        block_index = np.zeros(len(qs), dtype=np.uintp)
+        sup_val[qs] = -1
+        for i0, i1, X_block in _mem_blocks(X, n_block, center):
+            if use_c:
+                ks_cpp.kennard_stone_mem_batch_update(
+                    X_block.ctypes.data_as(ctypes.c_void_p),
+                    t[i0:].ctypes.data_as(ctypes.c_void_p),
+                    X_ref.ctypes.data_as(ctypes.c_void_p),
+                    t_ref.ctypes.data_as(ctypes.c_void_p),
+                    query.ctypes.data_as(ctypes.c_void_p),
+                    min_vals[:, i0:].ctypes.data_as(ctypes.c_void_p),
+                    selected[:, i0:].ctypes.data_as(ctypes.c_void_p),
+                    ctypes.c_size_t(i1 - i0),
+                    ctypes.c_size_t(n_sample),
+                    ctypes.c_size_t(n_feature),
+                    ctypes.c_size_t(len(qs)),
+                    block_val.ctypes.data_as(ctypes.c_void_p),
+                    block_index.ctypes.data_as(ctypes.c_void_p),
+                )
+            else:
+                # Same update by NumPy, one reference sample per row of `d2`
+                d2 = np.maximum(t_ref[:, None] + t[i0:i1] - 2 * (X_ref @ X_block.T), 0)
+                skip = selected[query, i0:i1]
+                vals = np.where(skip, min_vals[query, i0:i1], np.minimum(min_vals[query, i0:i1], d2))
+                min_vals[query, i0:i1] = vals
+                vals[skip] = -1
+                block_index[:] = vals.argmax(axis=1)
+                block_val[:] = vals[np.arange(len(qs)), block_index]
+            better = block_val > sup_val[qs]
+            sup_val[np.asarray(qs)[better]] = block_val[better]
+            sup_index[np.asarray(qs)[better]] = block_index[better] + i0
+
+    # --- Initialization ---
+    pairs = {}
+    seeds, results, v_dists = [], [], []
+    for q, (subset, seed, n_result) in enumerate(queries):
+        if seed is None:
+            key = None if subset is None else subset.tobytes()
+            if key not in pairs and subset is None:
+                pairs[key] = find_farthest_pair(X, n_block)
+            elif key not in pairs:
+                pair = find_farthest_pair(np.ascontiguousarray(X[subset], dtype=np.float32))
+                pairs[key] = tuple(subset[list(pair)])
+            seed = np.asarray(pairs[key], dtype=int)
+        if subset is not None:
+            selected[q] = True
+            selected[q, subset] = False
+        selected[q, seed] = True
+        seeds.append(seed)
+        results.append(np.zeros(n_result, dtype=int))
+        results[q][:len(seed)] = seed
+        v_dists.append(np.zeros(n_result, dtype=float))
+        if len(seed) == 2:
+            v_dists[q][0] = np.linalg.norm(np.asarray(X[seed[0]], dtype=np.float64) - np.asarray(X[seed[1]], dtype=np.float64))
+    for k in range(max(len(seed) for seed in seeds)):
+        qs = [q for q in range(n_query) if len(seeds[q]) > k]
+        update(qs, [seeds[q][k] for q in qs])
+    # --- Loop argmax minimum, all unfinished queries at once ---
+    n_selected = [len(seed) for seed in seeds]
+    while True:
+        qs = [q for q in range(n_query) if n_selected[q] < len(results[q])]
+        if not qs:
+            break
+        for q in qs:
+            n, idx = n_selected[q], int(sup_index[q])
+            v_dists[q][n - 1] = np.sqrt(sup_val[q])
+            results[q][n] = idx
+            selected[q, idx] = True
+            n_selected[q] += 1
+        qs = [q for q in qs if n_selected[q] < len(results[q])]
+        if qs:
+            update(qs, [results[q][n_selected[q] - 1] for q in qs])
+    return list(zip(results, v_dists))
+
+
+def whiten(X, VI=None, n_block=None):
+    """
+    whiten(X, VI=None, n_block=None)
+
+    Whitened data `(X - mean) @ L`, where `VI = L @ L.T` is Cholesky
+    decomposition of inverse covariance matrix; Euclidean distance of
+    whitened data is Mahalanobis distance of `X`.
+
+    Mean and covariance are accumulated by row blocks of `n_block`.
+    For `np.memmap` input, whitened data is written to temporary
+    `np.memmap` file, otherwise in memory.
+
+    Parameters
+    ----------
+
+    X: np.ndarray or np.memmap, shape: (n_sample, n_feature)
+
+    VI: np.ndarray or None, shape: (n_feature, n_feature)
+        Inverse covariance matrix. If set as `None`, inverse of sample
+        covariance of `X` is used.
+
+    n_block: int or None, optional
+        If set as `None`, blocks of about 64 MB float32 are used.
+    """
+    n_sample, n_feature = X.shape
+    n_block = _mem_block_size(n_block, n_feature)
+    mean = np.zeros(n_feature)
+    for i0, i1, X_block in _mem_blocks(X, n_block):
+        mean += X_block.sum(axis=0, dtype=np.float64)
+    mean /= n_sample
+    if VI is None:
+        cov = np.zeros((n_feature, n_feature))
+        for i0, i1, X_block in _mem_blocks(X, n_block):
+            X_block = X_block - mean
+            cov += X_block.T @ X_block
+        VI = np.linalg.inv(cov / (n_sample - 1))
+    L = np.linalg.cholesky(VI).astype(np.float32)
+    if isinstance(X, np.memmap):
+        X_w = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode="w+", shape=X.shape)
+    else:
+        X_w = np.empty(X.shape, dtype=np.float32)
+    for i0, i1, X_block in _mem_blocks(X, n_block):
+        X_w[i0:i1] = (X_block - mean.astype(np.float32)) @ L
+    return X_w
+
+
+def get_dist_metric(X, metric="euclidean", y=None, storage="full", scale=None):
+    """
+    get_dist_metric(X, metric="euclidean", y=None, storage="full", scale=None)
+
+    Distance matrix of metric `metric` (see `ks_sampling_mem`),
+    evaluated row by row in C program.
+
+    Parameters
+    ----------
+
+    X: np.ndarray, shape: (n_sample, n_feature)
+
+    y: np.ndarray or None, shape: (n_sample, ) or (n_sample, n_target)
+        Targets of samples, required for SPXY metric.
+
+    storage: str, "full" or "condensed"
+
+    scale: tuple of float or None
+        Normalization of SPXY metric. If set as `None`, `spxy_scale`
+        is used.
+    """
+    if metric == "mahalanobis":
+        X, metric = whiten(X), "euclidean"
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    n_sample = X.shape[0]
+    if metric == "spxy" and scale is None:
+        scale = spxy_scale(X, y)
+    mm = _MemMetric(X, n_sample, metric, y, scale)
+    if storage == "full":
+        dist = np.empty((n_sample, n_sample), dtype=np.float32)
+        for i in range(n_sample):
+            mm.row(i, dist[i])
+        return dist
+    dist = np.empty(n_sample * (n_sample - 1) // 2, dtype=np.float32)
+    row = np.empty(n_sample, dtype=np.float32)
+    for i in range(n_sample - 1):
+        offset = condensed_offset(i, n_sample)
+        dist[offset:offset + n_sample - i - 1] = mm.row(i, row)[i + 1:]
+    return dist
+
+
+def condensed_row(dist, idx, n_sample):
+    """
+    Row `idx` of condensed distance matrix, as vector of length `n_sample`.
+    """
+    i = np.arange(idx)
+    row = np.empty(n_sample, dtype=dist.dtype)
+    row[:idx] = dist[i * n_sample - i * (i + 1) // 2 + idx - i - 1]
+    row[idx] = 0
+    offset = condensed_offset(idx, n_sample)
+    row[idx + 1:] = dist[offset:offset + n_sample - idx - 1]
+    return row
+
+
+def condensed_unravel(k, n_sample):
+    """
+    Index (i, j) with i < j of position `k` in condensed distance storage.
+    """
+    i = np.searchsorted(condensed_offset(np.arange(n_sample), n_sample), k, side="right") - 1
+    return i, k - condensed_offset(i, n_sample) + i + 1
+
+
+def find_farthest_pair(X, n_batch=None, pruned=False, metric="euclidean", y=None, scale=None, progress=None):
+    """
+    find_farthest_pair(X, n_batch=None, pruned=False, metric="euclidean", y=None, scale=None, progress=None)
+
+    Find indexes of the two samples with largest distance.
+
+    Distances are evaluated by tiles in C program with OpenMP, and only
+    the location of the maximum is kept. For Euclidean and SPXY metrics,
+    samples are centred first (a float32 copy of in-memory `X`, or
+    streamed blocks of `np.memmap`), since squared distances are
+    evaluated as t_i + t_j - 2 x_i.x_j.
+
+    Parameters
+    ----------
+
+    X: np.ndarray or np.memmap, shape: (n_sample, n_feature)
+
+    n_batch: int or None, optional
+        If set, or if `X` is `np.memmap`, `X` is read by row blocks of
+        `n_batch` samples, and every pair of blocks is passed to C
+        program; so only two blocks are in memory at one time.
+        If set as `None` for `np.memmap`, blocks of about 64 MB
+        float32 are used.
+
+    pruned: bool, optional
+        Eliminate samples that can not be in the farthest pair before
+        the pairwise search, and the result is still exact.
+        A lower bound `L` of the largest distance is obtained by a few
+        farthest-point sweeps; sample `i` is kept only if both its
+        centroid bound `r_i + max(r)` (`r` for distance to centroid)
+        and its bounding-box bound (distance to the farthest box corner)
+        are not smaller than `L`.
+        Effective when the largest distances are attained by a few
+        outlying samples, which is usual for low to moderate `n_feature`.
+        Only Euclidean metric is supported.
+
+    metric, y, scale:
+        Metric on original data, see `ks_sampling_mem`.
+        `scale` of SPXY metric is evaluated by `spxy_scale` if not given.
+
+    progress: KSProgress or None
+        Search is in seed phase of `progress`, and stops early once
+        `progress` is cancelled; the returned pair is then meaningless,
+        and callers should check `progress.cancelled`.
+    """
+    if progress is not None:
+        progress.n_selected = 0
+        progress.phase = KSProgress.PHASES.index("seed")
+    if _is_sparse(X):
+        return _farthest_pair_sparse(X, metric, progress=progress)
+    if n_batch is None:
+        n_batch = _mem_block_size(None, X.shape[1]) if isinstance(X, np.memmap) else X.shape[0]
+    if metric == "spxy" and scale is None:
+        scale = spxy_scale(X, y, n_batch, progress)
+    if metric == "euclidean" and not ks_cpp_available():
+        candidates = _farthest_pair_candidates(X, n_batch)
+        i, j = _farthest_pair_numpy(np.asarray(X[candidates], dtype=np.float32), progress=progress)
+        return tuple(sorted([int(candidates[i]), int(candidates[j])]))
+    if pruned:
+        if metric != "euclidean":
+            raise ValueError("Pruned farthest pair search is only available for Euclidean metric.")
+        candidates = _farthest_pair_candidates(X, n_batch)
+        i, j = _MemMetric(np.ascontiguousarray(X[candidates], dtype=np.float32), len(candidates)).farthest_pair(progress)
+        return tuple(sorted([int(candidates[i]), int(candidates[j])]))
+    return _MemMetric(X, n_batch, metric, y, scale).farthest_pair(progress)
+
+
+def spxy_scale(X, y, n_batch=None, progress=None):
+    """
+    spxy_scale(X, y, n_batch=None, progress=None)
+
+    Normalization of SPXY metric: largest Euclidean distances of
+    samples `X` and of targets `y`. See `find_farthest_pair` for
+    `progress`.
+    """
+    x_pair = find_farthest_pair(X, n_batch, progress=progress)
+    y = np.ascontiguousarray(np.reshape(y, (X.shape[0], -1)), dtype=np.float32)
+    y_pair = find_farthest_pair(y, progress=progress)
+    scale_x = np.linalg.norm(np.asarray(X[x_pair[0]], dtype=np.float64) - np.asarray(X[x_pair[1]], dtype=np.float64))
+    scale_y = np.linalg.norm(y[y_pair[0]].astype(np.float64) - y[y_pair[1]].astype(np.float64))
+    return scale_x if scale_x > 0 else 1., scale_y if scale_y > 0 else 1.
+
+
+def _farthest_pair_sparse(X, metric="euclidean", n_batch=1024, progress=None):
+    # Farthest pair of `scipy.sparse` samples, by C program or by sparse products of row tiles
+    if metric != "euclidean":
+        raise NotImplementedError("Sparse samples only support Euclidean metric.")
+    X, t = _sparse_csr(X)
+    if ks_cpp_available():
+        idx = np.zeros(2, dtype=np.uintp)
+        ks_cpp.farthest_pair_sparse(
+            *_sparse_args(X, t),
+            ctypes.c_size_t(X.shape[0]),
+            ctypes.c_size_t(X.shape[1]),
+            idx.ctypes.data_as(ctypes.c_void_p),
+            _progress_ref(progress),
+        )
+        return tuple(sorted(int(i) for i in idx))
+    X = X.astype(np.float64)
+    XT = X.T.tocsr()
+    sup, idx = -1., (0, 1)
+    for i0 in range(0, X.shape[0], n_batch):
+        if progress is not None and progress.cancelled:
+            break
+        i1 = min(i0 + n_batch, X.shape[0])
+        tile = t[i0:i1, None] + t[None, :] - 2 * (X[i0:i1] @ XT).toarray()
+        tile[np.arange(X.shape[0])[None, :] <= np.arange(i0, i1)[:, None]] = -1
+        i, j = np.unravel_index(np.argmax(tile), tile.shape)
+        if tile[i, j] > sup:
+            sup, idx = tile[i, j], (i0 + i, j)
+    return idx
+
+
+def _farthest_pair_numpy(X, n_tile=2048, progress=None):
+    # Farthest pair by NumPy tiles, if C program is not available
+    Xc, t = _centred(X)
+    sup, idx = -1., (0, 1)
+    for i0 in range(0, X.shape[0], n_tile):
+        if progress is not None and progress.cancelled:
+            break
+        i1 = min(i0 + n_tile, X.shape[0])
+        for j0 in range(i0, X.shape[0], n_tile):
+            j1 = min(j0 + n_tile, X.shape[0])
+            tile = t[i0:i1, None] + t[None, j0:j1] - 2 * Xc[i0:i1] @ Xc[j0:j1].T
+            i, j = np.unravel_index(np.argmax(tile), tile.shape)
+            if tile[i, j] > sup:
+                sup, idx = tile[i, j], (i0 + i, j0 + j)
+    return idx
+
+
+def _farthest_pair_candidates(X, n_block):
+    # Samples that could be in the farthest pair, by centroid and bounding-box bounds
+    n_sample = X.shape[0]
+    x_sum = np.zeros(X.shape[1])
+    x_min = np.full(X.shape[1], np.inf)
+    x_max = np.full(X.shape[1], -np.inf)
+    for i0, i1, X_block in _mem_blocks(X, n_block):
+        x_sum += X_block.sum(axis=0, dtype=np.float64)
+        np.minimum(x_min, X_block.min(axis=0), out=x_min)
+        np.maximum(x_max, X_block.max(axis=0), out=x_max)
+    centroid = x_sum / n_sample
+    r = np.zeros(n_sample)
+    ub = np.zeros(n_sample)
+    for i0, i1, X_block in _mem_blocks(X, n_block):
+        r[i0:i1] = np.sqrt(((X_block - centroid)**2).sum(axis=1))
+        ub[i0:i1] = np.sqrt(np.maximum((X_block - x_min)**2, (x_max - X_block)**2).sum(axis=1))
+
+    def dist_to(idx):
+        x_ref = np.asarray(X[idx], dtype=np.float64)
+        d = np.zeros(n_sample)
+        for i0, i1, X_block in _mem_blocks(X, n_block):
+            d[i0:i1] = np.sqrt(((X_block - x_ref)**2).sum(axis=1))
+        return d
+
+    # Lower bound by farthest-point sweeps from the most outlying sample
+    lower = 0
+    idx = np.argmax(r)
+    for _ in range(3):
+        d = dist_to(idx)
+        idx = np.argmax(d)
+        if d[idx] <= lower:
+            break
+        lower = d[idx]
+    bound = np.minimum(r + r.max(), ub)
+    return np.flatnonzero(bound >= lower * (1 - 1e-5))
+
+
+def _dist_n_sample(dist):
+    # Number of samples of full, condensed or quantized distance matrix
+    if isinstance(dist, tuple):
+        return dist[0].shape[0]
+    if dist.ndim == 1:
+        n_sample = int(round((1 + np.sqrt(1 + 8 * dist.shape[0])) / 2))
+        assert(n_sample * (n_sample - 1) // 2 == dist.shape[0])
+        return n_sample
+    assert(dist.shape[0] == dist.shape[1])
+    return dist.shape[0]
+
+
+def _dist_row(dist, idx):
+    # Row `idx` of full, condensed or quantized distance matrix
+    if isinstance(dist, tuple):
+        return dist[0][idx].astype(np.float32) * dist[1][idx]
+    return condensed_row(dist, idx, _dist_n_sample(dist)) if dist.ndim == 1 else dist[idx]
+
+
+def _dist_farthest_pair(dist):
+    # Indexes of the largest element of full, condensed or quantized distance matrix
+    if isinstance(dist, tuple):
+        # Codes are monotonic in distance within each row
+        i = (dist[0].max(axis=1).astype(np.float32) * dist[1]).argmax()
+        return i, dist[0][i].argmax()
+    if dist.ndim == 1:
+        return condensed_unravel(np.argmax(dist), _dist_n_sample(dist))
+    return np.unravel_index(np.argmax(dist), dist.shape)
+
+
+def ks_sampling_core(dist, seed=None, n_result=None):
+    """
+    ks_sampling_core(dist, seed=None, n_result=None)
+
+    Kennard-Stone Sampling Program (NumPy backend)
+
+    Same to `ks_sampling_core_cpp`, but requires no compiler.
+    Minimum distance vector is updated in-place, and selected samples
+    are masked by `-inf` in the minimum distance vector.
+    """
+    # Definition: Input Variables
+    n_sample = _dist_n_sample(dist)
+    if n_result is None:
+        n_result = n_sample
+    if seed is None or len(seed) == 0:
+        seed = _dist_farthest_pair(dist)
+    seed = np.asarray(seed, dtype=int)
     # Definition: Output Variables
     result = np.zeros(n_result, dtype=int)
     v_dist = np.zeros(n_result, dtype=float)
     # Definition: Intermediate Variables
     n_seed = len(seed)
-    selected = np.zeros(n_sample, dtype=bool)
-    min_vals = np.zeros(n_sample, dtype=float)
+    min_vals = np.full(n_sample, np.inf, dtype=np.float32 if isinstance(dist, tuple) else dist.dtype)
     # --- Initialization ---
-    result[:n_seed] = seed                   # - 1
+    result[:n_seed] = seed                        # - 1
     if n_seed == 2:
-        v_dist[0] = dist[seed[0], seed[1]]   # - 2
-    min_vals[:] = dist[seed[0]]              # - 3
-    upper_bound = min_vals.max()             # - 4
-    for n in seed:                           # - 5
-        np.min(np.array([min_vals, dist[n]]), axis=0, initial=upper_bound, where=np.logical_not(selected), out=min_vals)
+        v_dist[0] = _dist_row(dist, seed[0])[seed[1]]  # - 2
+    for n in seed:                                # - 3
+        np.minimum(min_vals, _dist_row(dist, n), out=min_vals)
+    min_vals[seed] = -np.inf                      # - 4
     # --- Loop argmax minimum ---
     for n in range(n_seed, n_result):
-        sup_index = ma.array(min_vals, mask=selected).argmax()  # - 1
-        result[n] = sup_index                                   # - 2
-        v_dist[n - 1] = min_vals[sup_index]                     # - 3
-        selected[sup_index] = True                              # - 4     # | 5
-        np.min(np.array([min_vals, dist[sup_index]]), axis=0, initial=upper_bound, where=np.logical_not(selected), out=min_vals)
+        sup_index = min_vals.argmax()             # - 1
+        result[n] = sup_index                     # - 2
+        v_dist[n - 1] = min_vals[sup_index]       # - 3
+        min_vals[sup_index] = -np.inf             # - 4
+        np.minimum(min_vals, _dist_row(dist, sup_index), out=min_vals)  # - 5
     return result, v_dist
 
 
-def ks_sampling_core_cpp(dist, seed=None, n_result=None):
+def ks_sampling_core_cpp(dist, seed=None, n_result=None, progress=None):
     """
-    ks_sampling_core_cpp(dist, seed=None, x_sel=None)
+    ks_sampling_core_cpp(dist, seed=None, x_sel=None, progress=None)
     
     Kennard-Stone Sampling Program
     
     Parameters
     ----------
     
-    dist: np.ndarray
-        shape: (n_sample, n_sample)
+    dist: np.ndarray or tuple
+        shape: (n_sample, n_sample) or (n_sample * (n_sample - 1) / 2, )
         Distances of samples, need to be generated by user.
+        1-dimensional `dist` is regarded as condensed distance matrix.
+        Tuple `(codes, scale)` is regarded as reduced-precision
+        distance matrix, see `quantize_dist`.
         
     seed: np.ndarray or list or None, optional
         shape: (n_seed, )
@@ -205,9 +1605,15 @@ def ks_sampling_core_cpp(dist, seed=None, n_result=None):
     n_result: int or None, optional
         Number of samples that should be selected.
         If set as `None`, `n_sample` will be used instead.
+
+    progress: KSProgress or None
+        See `KSProgress`.
     """
-    assert(dist.shape[0] == dist.shape[1])
-    n_sample = dist.shape[0]
+    n_sample = _dist_n_sample(dist)
+    if isinstance(dist, tuple):
+        return _ks_sampling_core_quantized(dist, seed, n_result, progress)
+    kernel = ks_cpp.kennard_stone_condensed if dist.ndim == 1 else ks_cpp.kennard_stone
+    dist = np.ascontiguousarray(dist, dtype=np.float32)
     if n_result is None:
         n_result = n_sample
     n_seed = None
@@ -219,16 +1625,41 @@ def ks_sampling_core_cpp(dist, seed=None, n_result=None):
         n_seed = seed.shape[0]
     vdist = np.zeros(n_result, dtype=np.float32)
     result = np.zeros(n_result, dtype=np.uintp)
-    ks_cpp.kennard_stone(
-        dist.astype(np.float32).ctypes.data_as(ctypes.c_void_p),
+    kernel(
+        dist.ctypes.data_as(ctypes.c_void_p),
         seed.ctypes.data_as(ctypes.c_void_p),
         result.ctypes.data_as(ctypes.c_void_p),
         vdist.ctypes.data_as(ctypes.c_void_p),
         ctypes.c_size_t(n_sample),
         ctypes.c_size_t(n_seed),
         ctypes.c_size_t(n_result),
+        _progress_ref(progress),
     )
-    return result.astype(int), vdist.astype(float)
+    return _progress_truncate(progress, result.astype(int), vdist.astype(float))
+
+
+def _ks_sampling_core_quantized(dist, seed=None, n_result=None, progress=None):
+    codes, scale = dist
+    n_sample = codes.shape[0]
+    if n_result is None:
+        n_result = n_sample
+    n_seed = 0 if seed is None else len(seed)
+    seed = np.zeros(2, dtype=np.uintp) if seed is None else np.asarray(seed, dtype=np.uintp)
+    vdist = np.zeros(n_result, dtype=np.float32)
+    result = np.zeros(n_result, dtype=np.uintp)
+    ks_cpp.kennard_stone_quantized(
+        np.ascontiguousarray(codes).ctypes.data_as(ctypes.c_void_p),
+        ctypes.c_int(QUANTIZED[codes.dtype.name]),
+        np.ascontiguousarray(scale, dtype=np.float32).ctypes.data_as(ctypes.c_void_p),
+        seed.ctypes.data_as(ctypes.c_void_p),
+        result.ctypes.data_as(ctypes.c_void_p),
+        vdist.ctypes.data_as(ctypes.c_void_p),
+        ctypes.c_size_t(n_sample),
+        ctypes.c_size_t(n_seed),
+        ctypes.c_size_t(n_result),
+        _progress_ref(progress),
+    )
+    return _progress_truncate(progress, result.astype(int), vdist.astype(float))
 
 
 def ks_sampling_core_mem(X, seed, n_result):
@@ -242,35 +1673,143 @@ def ks_sampling_core_mem(X, seed, n_result):
     min_vals = remains = None
     
     # --- Initialization ---
+    # `remains` and `min_vals` are the active set of unselected samples, and selected
+    # samples are swap-removed, so every iteration only walks `n_remain` entries.
     def sliced_dist(idx):
-        tmp_X = X[remains] - X[idx]
+        tmp_X = X[remains[:n_remain]] - X[idx]
         return np.sqrt(np.einsum("ia, ia -> i", tmp_X, tmp_X))
 
-    selected = [False] * n_sample
-    remains = []
-    for i in range(n_sample):
-        if i not in seed:
-            remains.append(i)
+    remains = np.setdiff1d(np.arange(n_sample), seed)
+    n_remain = remains.shape[0]
     result[:n_seed] = seed
     if n_seed == 2:
         v_dist[0] = np.linalg.norm(X[seed[0]] - X[seed[1]])
     min_vals = sliced_dist(seed[0])
     
     for n in seed:
-        np.min(np.array([min_vals, sliced_dist(n)]), axis=0, out=min_vals)
+        np.minimum(min_vals, sliced_dist(n), out=min_vals)
     # --- Loop argmax minimum ---
     for n in range(n_seed, n_result):
-        sup_index = min_vals.argmax()
+        active = min_vals[:n_remain]
+        sup_index = active.argmax()
+        # Ties are broken by the smallest sample index, as order of active set is shuffled
+        ties = np.flatnonzero(active == active[sup_index])
+        if ties.shape[0] > 1:
+            sup_index = ties[remains[ties].argmin()]
         result[n] = remains[sup_index]
         v_dist[n - 1] = min_vals[sup_index]
-        remains.pop(sup_index)
-        min_vals[sup_index:-1] = min_vals[sup_index+1:]
-        min_vals = min_vals[:-1]
-        np.min(np.array([min_vals, sliced_dist(result[n])]), axis=0, out=min_vals)
+        n_remain -= 1
+        remains[sup_index] = remains[n_remain]
+        min_vals[sup_index] = min_vals[n_remain]
+        np.minimum(min_vals[:n_remain], sliced_dist(result[n]), out=min_vals[:n_remain])
     return result, v_dist
 
 
-def ks_sampling_mem_core_cpp(X, seed, n_result=None):
+def _sparse_args(X, t):
+    # CSR arrays and squared norms as C arguments; `X` and `t` should be kept alive by caller
+    X.indptr = X.indptr.astype(np.int64, copy=False)
+    X.indices = X.indices.astype(np.int32, copy=False)
+    return (X.indptr.ctypes.data_as(ctypes.c_void_p),
+            X.indices.ctypes.data_as(ctypes.c_void_p),
+            X.data.ctypes.data_as(ctypes.c_void_p),
+            t.ctypes.data_as(ctypes.c_void_p))
+
+
+def ks_sampling_sparse_core_cpp(X, seed=None, n_result=None, progress=None):
+    """
+    ks_sampling_sparse_core_cpp(X, seed=None, n_result=None, progress=None)
+
+    Kennard-Stone Sampling Program
+        (for `scipy.sparse` samples, Euclidean metric)
+
+    Squared distances are evaluated as t_i + t_j - 2 x_i.x_j, by dot
+    products over non-zeros of samples with a dense reference sample,
+    and squared norms `t` in float64. Memory cost is proportional to
+    non-zeros of `X` and `n_sample`, plus dense vectors of `n_feature`
+    (one per thread for seed search).
+
+    Parameters
+    ----------
+
+    X: scipy.sparse matrix, shape: (n_sample, n_feature)
+        Converted to CSR in float32.
+
+    seed: np.ndarray or list or None, shape: (n_seed, )
+        Initial selected seed.
+        If set as `None`, the C program will find the two samples
+        which have largest distance as seed.
+
+    n_result: int or None, optional
+        Number of samples that should be selected.
+        If set as `None`, `n_sample` will be used instead.
+
+    progress: KSProgress or None
+        See `KSProgress`.
+    """
+    X, t = _sparse_csr(X)
+    n_sample, n_feature = X.shape
+    if n_result is None:
+        n_result = n_sample
+    n_seed = 0 if seed is None else len(seed)
+    seed = np.zeros(2, dtype=np.uintp) if seed is None else np.asarray(seed, dtype=np.uintp)
+    vdist = np.zeros(n_result, dtype=np.float32)
+    result = np.zeros(n_result, dtype=np.uintp)
+    ks_cpp.kennard_stone_sparse(
+        *_sparse_args(X, t)[:3],
+        seed.ctypes.data_as(ctypes.c_void_p),
+        result.ctypes.data_as(ctypes.c_void_p),
+        vdist.ctypes.data_as(ctypes.c_void_p),
+        ctypes.c_size_t(n_sample),
+        ctypes.c_size_t(n_feature),
+        ctypes.c_size_t(n_seed),
+        ctypes.c_size_t(n_result),
+        _progress_ref(progress),
+    )
+    return _progress_truncate(progress, result.astype(int), vdist.astype(float))
+
+
+def ks_sampling_sparse_core(X, seed=None, n_result=None):
+    # Python version of `ks_sampling_sparse_core_cpp`, with the active set of `ks_sampling_core_mem`
+    X, t = _sparse_csr(X)
+    X = X.astype(np.float64)
+    n_sample = X.shape[0]
+    if n_result is None:
+        n_result = n_sample
+    if seed is None or len(seed) == 0:
+        seed = _farthest_pair_sparse(X)
+    result = np.zeros(n_result, dtype=int)
+    v_dist = np.zeros(n_result, dtype=float)
+    n_seed = len(seed)
+
+    def sliced_dist(idx):
+        x_ref = X[idx].toarray().ravel()
+        d2 = t[remains[:n_remain]] + t[idx] - 2 * (X[remains[:n_remain]] @ x_ref)
+        return np.sqrt(np.maximum(d2, 0))
+
+    remains = np.setdiff1d(np.arange(n_sample), seed)
+    n_remain = remains.shape[0]
+    result[:n_seed] = seed
+    if n_seed == 2:
+        v_dist[0] = np.sqrt(max(t[seed[0]] + t[seed[1]] - 2 * X[seed[0]].multiply(X[seed[1]]).sum(), 0))
+    min_vals = np.full(n_remain, np.inf)
+    for n in seed:
+        np.minimum(min_vals, sliced_dist(n), out=min_vals)
+    for n in range(n_seed, n_result):
+        active = min_vals[:n_remain]
+        sup_index = active.argmax()
+        ties = np.flatnonzero(active == active[sup_index])
+        if ties.shape[0] > 1:
+            sup_index = ties[remains[ties].argmin()]
+        result[n] = remains[sup_index]
+        v_dist[n - 1] = min_vals[sup_index]
+        n_remain -= 1
+        remains[sup_index] = remains[n_remain]
+        min_vals[sup_index] = min_vals[n_remain]
+        np.minimum(min_vals[:n_remain], sliced_dist(result[n]), out=min_vals[:n_remain])
+    return result, v_dist
+
+
+def ks_sampling_mem_core_cpp(X, seed, n_result=None, progress=None):
     """
     ks_sampling_mem_core_cpp(X, seed=None, x_sel=None)
     
@@ -282,6 +1821,8 @@ def ks_sampling_mem_core_cpp(X, seed, n_result=None):
     
     X: np.ndarray, shape: (n_sample, n_feature)
         Original data, need to be provided by user.
+        C program works on a centred float32 copy, since squared
+        distances are evaluated as t_i + t_j - 2 x_i.x_j.
         
     seed: np.ndarray or list or None, shape: (n_seed, )
         **THIS IS NOT OPTIONAL**
@@ -301,8 +1842,10 @@ def ks_sampling_mem_core_cpp(X, seed, n_result=None):
     n_seed = seed.shape[0]
     vdist = np.zeros(n_result, dtype=np.float32)
     result = np.zeros(n_result, dtype=np.uintp)
+    # Squared distances are t_i + t_j - 2 x_i.x_j in float32, so `X` is centred first
+    X = _centred(X)[0]
     ks_cpp.kennard_stone_mem(
-        X.astype(np.float32).ctypes.data_as(ctypes.c_void_p),
+        X.ctypes.data_as(ctypes.c_void_p),
         seed.ctypes.data_as(ctypes.c_void_p),
         result.ctypes.data_as(ctypes.c_void_p),
         vdist.ctypes.data_as(ctypes.c_void_p),
@@ -310,5 +1853,492 @@ def ks_sampling_mem_core_cpp(X, seed, n_result=None):
         ctypes.c_size_t(n_feature),
         ctypes.c_size_t(n_seed),
         ctypes.c_size_t(n_result),
+        _progress_ref(progress),
     )
-    return result.astype(int), vdist.astype(float)
+    return _progress_truncate(progress, result.astype(int), vdist.astype(float))
+
+
+def ks_sampling_mem_core_ooc(X, seed, n_result=None, n_block=None, progress=None):
+    """
+    ks_sampling_mem_core_ooc(X, seed, n_result=None, n_block=None, progress=None)
+
+    Kennard-Stone Sampling Program
+        (out-of-core, no need of distance matrix or in-memory `X`)
+
+    Rows of `X` are streamed to C program block by block in every
+    iteration, so `X` could be `np.memmap` larger than physical
+    memory. Only squared norm, minimum distance and selection flag
+    vectors, all of size `n_sample`, are resident in memory.
+    Blocks are centred by the column mean as they are streamed.
+
+    Parameters
+    ----------
+
+    X: np.ndarray or np.memmap, shape: (n_sample, n_feature)
+        Original data, need to be provided by user.
+
+    seed: np.ndarray or list, shape: (n_seed, )
+        **THIS IS NOT OPTIONAL**
+        Initial selected seed.
+
+    n_result: int or None, optional
+        Number of samples that should be selected.
+        If set as `None`, `n_sample` will be used instead.
+
+    n_block: int or None, optional
+        Number of rows streamed to C program at one time.
+        If set as `None`, blocks of about 64 MB float32 are used.
+    """
+    if n_result is None:
+        n_result = X.shape[0]
+    state = KSState.from_X(X, seed, n_block)
+    state.extend(X, n_result, n_block, progress=progress)
+    return state.result, state.v_dist
+
+
+def _mem_block_size(n_block, n_feature):
+    # Default: blocks of about 64 MB float32
+    return max(1, 2**24 // n_feature) if n_block is None else n_block
+
+
+def _mem_blocks(X, n_block, center=None):
+    # Row blocks of `X` in float32, minus `center` (in float64) if given
+    for i0 in range(0, X.shape[0], n_block):
+        i1 = min(i0 + n_block, X.shape[0])
+        if center is None:
+            yield i0, i1, np.ascontiguousarray(X[i0:i1], dtype=np.float32)
+        else:
+            yield i0, i1, np.ascontiguousarray(np.asarray(X[i0:i1]) - center, dtype=np.float32)
+
+
+def _mem_mean(X, n_block=None):
+    # Column mean of `X` in float64, by row blocks
+    n_block = _mem_block_size(n_block, X.shape[1])
+    x_sum = np.zeros(X.shape[1])
+    for i0 in range(0, X.shape[0], n_block):
+        x_sum += np.asarray(X[i0:i0 + n_block]).sum(axis=0, dtype=np.float64)
+    return x_sum / max(X.shape[0], 1)
+
+
+METRICS = {"euclidean": 0, "manhattan": 1, "cosine": 2, "spxy": 3}
+
+
+class _MemMetric:
+    # Metric on rows of original data `X` from `i_start`, streamed to C program by blocks.
+    # Per-sample auxiliary values (squared norm for Euclidean and SPXY, norm for cosine)
+    # are evaluated once at construction; SPXY targets `y` are kept in memory.
+    # Euclidean and SPXY distances are t_i + t_j - 2 x_i.x_j in float32, so `X` is centred
+    # by its column mean: in-memory `X` once (a float32 copy), `np.memmap` by streamed blocks.
+
+    def __init__(self, X, n_block, metric="euclidean", y=None, scale=None, i_start=0):
+        if metric not in METRICS:
+            raise ValueError("`metric` should be one of " + ", ".join(METRICS) + ".")
+        if metric == "spxy" and (y is None or scale is None):
+            raise ValueError("`y` and `scale` should be provided for SPXY metric.")
+        self.X = X
+        self.center = None
+        if metric in ("euclidean", "spxy") and isinstance(X, np.memmap):
+            self.center = _mem_mean(X, n_block)
+        elif metric in ("euclidean", "spxy"):
+            self.X = _centred(X, n_block)[0]
+        self.n_block = n_block
+        self.metric = metric
+        self.i_start = i_start
+        self.scale = (1., 1.) if scale is None else tuple(scale)
+        if metric == "spxy":
+            self.Y = np.ascontiguousarray(np.reshape(y, (X.shape[0], -1)), dtype=np.float32)
+        else:
+            self.Y = np.zeros((X.shape[0], 0), dtype=np.float32)
+        self.aux = np.zeros(X.shape[0] - i_start, dtype=np.float32)
+        if metric != "manhattan":
+            for i0, i1, X_block in self.blocks():
+                ks_cpp.squared_norm_vector(
+                    X_block.ctypes.data_as(ctypes.c_void_p),
+                    self.aux[i0:].ctypes.data_as(ctypes.c_void_p),
+                    ctypes.c_size_t(i1 - i0),
+                    ctypes.c_size_t(X.shape[1]),
+                )
+        if metric == "cosine":
+            np.sqrt(self.aux, out=self.aux)
+
+    def blocks(self, i_start=None):
+        # Row blocks from `i_start` (default `self.i_start`), indexed relative to `i_start`
+        return _mem_blocks(self.X[self.i_start if i_start is None else i_start:], self.n_block, self.center)
+
+    def ref(self, idx):
+        # Reference sample `idx` as C arguments (x_ref, aux_ref, y_ref)
+        x_ref = self.X[idx] if self.center is None else self.X[idx] - self.center
+        x_ref = np.ascontiguousarray(x_ref, dtype=np.float32)
+        aux_ref = np.dot(x_ref, x_ref) if self.metric != "manhattan" else 0.
+        aux_ref = np.sqrt(aux_ref) if self.metric == "cosine" else aux_ref
+        return x_ref, aux_ref, self.Y[idx]
+
+    def args(self, i0, i1, X_block):
+        # C arguments of samples in block [i0, i1) relative to `self.i_start`
+        return [
+            X_block.ctypes.data_as(ctypes.c_void_p),
+            self.aux[i0:].ctypes.data_as(ctypes.c_void_p),
+            self.Y[self.i_start + i0:].ctypes.data_as(ctypes.c_void_p),
+        ]
+
+    def update(self, idx, min_vals, selected):
+        # Update `min_vals` of rows from `i_start` by sample `idx`, return (sup_val, sup_index)
+        x_ref, aux_ref, y_ref = self.ref(idx)
+        sup = (-1., 0)
+        sup_index = ctypes.c_size_t(0)
+        for i0, i1, X_block in self.blocks():
+            sup_val = ks_cpp.kennard_stone_mem_update_metric(
+                ctypes.c_int(METRICS[self.metric]),
+                *self.args(i0, i1, X_block),
+                x_ref.ctypes.data_as(ctypes.c_void_p),
+                ctypes.c_float(aux_ref),
+                y_ref.ctypes.data_as(ctypes.c_void_p),
+                min_vals[i0:].ctypes.data_as(ctypes.c_void_p),
+                selected[i0:].ctypes.data_as(ctypes.c_void_p),
+                ctypes.c_size_t(i1 - i0),
+                ctypes.c_size_t(self.X.shape[1]),
+                ctypes.c_size_t(self.Y.shape[1]),
+                ctypes.c_float(self.scale[0]),
+                ctypes.c_float(self.scale[1]),
+                ctypes.byref(sup_index),
+            )
+            if sup_val > sup[0]:
+                sup = (sup_val, i0 + sup_index.value)
+        return sup
+
+    def row(self, idx, out):
+        # Distances from sample `idx` to rows from `i_start`, written into `out`
+        x_ref, aux_ref, y_ref = self.ref(idx)
+        for i0, i1, X_block in self.blocks():
+            ks_cpp.metric_distance_row(
+                ctypes.c_int(METRICS[self.metric]),
+                *self.args(i0, i1, X_block),
+                x_ref.ctypes.data_as(ctypes.c_void_p),
+                ctypes.c_float(aux_ref),
+                y_ref.ctypes.data_as(ctypes.c_void_p),
+                out[i0:].ctypes.data_as(ctypes.c_void_p),
+                ctypes.c_size_t(i1 - i0),
+                ctypes.c_size_t(self.X.shape[1]),
+                ctypes.c_size_t(self.Y.shape[1]),
+                ctypes.c_float(self.scale[0]),
+                ctypes.c_float(self.scale[1]),
+            )
+        return out
+
+    def farthest_pair(self, progress=None):
+        # Farthest pair of rows from `i_start`, on every pair of row blocks; stops once `progress` is cancelled
+        idx = np.zeros(2, dtype=np.uintp)
+        sup = (-1., 0, 0)
+        for iA0, iA1, XA in self.blocks():
+            for iB0, iB1, XB in self.blocks(self.i_start + iA0):
+                if progress is not None and progress.cancelled:
+                    return sup[1], sup[2]
+                iB0, iB1 = iB0 + iA0, iB1 + iA0
+                sup_val = ks_cpp.farthest_pair_metric(
+                    ctypes.c_int(METRICS[self.metric]),
+                    *self.args(iA0, iA1, XA),
+                    ctypes.c_size_t(iA1 - iA0),
+                    *self.args(iB0, iB1, XB),
+                    ctypes.c_size_t(iB1 - iB0),
+                    ctypes.c_size_t(self.X.shape[1]),
+                    ctypes.c_size_t(self.Y.shape[1]),
+                    ctypes.c_float(self.scale[0]),
+                    ctypes.c_float(self.scale[1]),
+                    ctypes.c_bool(iA0 == iB0),
+                    idx.ctypes.data_as(ctypes.c_void_p),
+                    _progress_ref(progress),
+                )
+                if sup_val > sup[0]:
+                    sup = (sup_val, iA0 + int(idx[0]), iB0 + int(idx[1]))
+        return sup[1], sup[2]
+
+    def to_dist(self, val):
+        # Minimum distance values to distances
+        return np.sqrt(val) if self.metric == "euclidean" else val
+
+
+class _DistRows:
+    # Rows of full, condensed or quantized distance matrix, with the interface of
+    # `_MemMetric`, for resuming states by NumPy if C program is not available.
+
+    def __init__(self, dist):
+        self.dist = dist
+
+    def update(self, idx, min_vals, selected):
+        # Update `min_vals` by sample `idx`, return (sup_val, sup_index) of unselected samples
+        np.minimum(min_vals, _dist_row(self.dist, int(idx)), out=min_vals)
+        masked = np.where(selected, -1., min_vals)
+        sup_index = masked.argmax()
+        return masked[sup_index], sup_index
+
+    def to_dist(self, val):
+        return val
+
+
+class KSState:
+    """
+    KSState(result, v_dist, min_vals, selected, metric=None, scale=(1., 1.))
+
+    Resumable Kennard-Stone Sampling State
+
+    Selection could be extended to larger `n_result` by `extend`,
+    and new samples could be appended by `add_samples`, both reusing
+    previously evaluated minimum distances. State could be
+    checkpointed by `save` and `load`.
+
+    A state is built either on distance matrix (`from_dist`, full or
+    condensed), or on original data (`from_X`, with limited memory or
+    out-of-core); later calls should be given the same kind of data.
+    States on distance matrix are extended by NumPy if C program
+    `ks_cpp` is not available; states on original data require it.
+
+    Attributes
+    ----------
+
+    result: np.ndarray, shape: (n_selected, )
+        Selected sample indexes, in order of selection.
+
+    v_dist: np.ndarray, shape: (n_selected, )
+        Sampling distances. The last value is not determined until
+        the next sample is selected.
+
+    min_vals: np.ndarray, shape: (n_sample, )
+        Minimum distances from every sample to selected samples.
+        Values of selected samples are not meaningful.
+        Squared for Euclidean metric on original data.
+
+    selected: np.ndarray, shape: (n_sample, )
+        Whether samples are selected.
+
+    metric: str or None
+        Metric on original data (states built by `from_X`), or `None`
+        for states built on distance matrix.
+
+    scale: tuple of float
+        Normalization of SPXY metric, see `spxy_scale`.
+    """
+
+    def __init__(self, result, v_dist, min_vals, selected, metric=None, scale=(1., 1.)):
+        self.result = np.asarray(result, dtype=int)
+        self.v_dist = np.asarray(v_dist, dtype=float)
+        self.min_vals = np.ascontiguousarray(min_vals, dtype=np.float32)
+        self.selected = np.ascontiguousarray(selected, dtype=bool)
+        self.metric = None if metric is None else str(metric)
+        self.scale = tuple(float(v) for v in scale)
+
+    @property
+    def n_sample(self):
+        return self.min_vals.shape[0]
+
+    @property
+    def n_selected(self):
+        return self.result.shape[0]
+
+    @classmethod
+    def from_dist(cls, dist, seed=None):
+        """
+        Initialize state by seed on distance matrix (full or condensed).
+        If `seed` is `None`, the two most distant samples are used.
+        """
+        if seed is None or len(seed) == 0:
+            seed = _dist_farthest_pair(dist)
+        seed = np.asarray(seed, dtype=int)
+        n_sample = _dist_n_sample(dist)
+        v_dist = np.zeros(len(seed))
+        if len(seed) == 2:
+            v_dist[0] = _dist_row(dist, seed[0])[seed[1]]
+        state = cls(seed, v_dist, np.full(n_sample, np.inf), np.zeros(n_sample, dtype=bool))
+        for idx in seed:
+            np.minimum(state.min_vals, _dist_row(dist, idx), out=state.min_vals)
+        state.selected[seed] = True
+        return state
+
+    @classmethod
+    def from_X(cls, X, seed=None, n_block=None, metric="euclidean", y=None, scale=None):
+        """
+        Initialize state by seed on original data `X`.
+        If `seed` is `None`, the two most distant samples are used.
+        For `metric`, `y` and `scale`, see `ks_sampling_mem`.
+        Requires C program `ks_cpp`.
+        """
+        _require_ks_cpp("States on original data")
+        if metric == "spxy" and scale is None:
+            scale = spxy_scale(X, y, n_block)
+        if seed is None or len(seed) == 0:
+            seed = find_farthest_pair(X, n_block, metric=metric, y=y, scale=scale)
+        seed = np.asarray(seed, dtype=int)
+        n_sample = X.shape[0]
+        n_block = _mem_block_size(n_block, X.shape[1])
+        mm = _MemMetric(X, n_block, metric, y, scale)
+        state = cls(seed, np.zeros(len(seed)), np.full(n_sample, np.inf), np.zeros(n_sample, dtype=bool),
+                    metric, mm.scale)
+        # Distance of seed pair is read from minimum distances before the second seed is selected
+        state.selected[seed[0]] = True
+        mm.update(seed[0], state.min_vals, state.selected)
+        if len(seed) == 2:
+            state.v_dist[0] = mm.to_dist(state.min_vals[seed[1]])
+        state.selected[seed] = True
+        for idx in seed[1:]:
+            mm.update(idx, state.min_vals, state.selected)
+        return state
+
+    def _resize(self, n_result):
+        n_selected = self.n_selected
+        result = np.zeros(n_result, dtype=np.uintp)
+        v_dist = np.zeros(n_result, dtype=np.float32)
+        result[:n_selected] = self.result
+        v_dist[:n_selected] = self.v_dist
+        return n_selected, result, v_dist
+
+    def extend(self, data, n_result, n_block=None, y=None, progress=None):
+        """
+        extend(data, n_result, n_block=None, y=None, progress=None)
+
+        Continue selection until `n_result` samples are selected.
+
+        Parameters
+        ----------
+
+        data: np.ndarray
+            Distance matrix for states from `from_dist`, or original
+            data for states from `from_X`.
+
+        n_result: int
+            Total number of samples that should be selected.
+
+        n_block: int or None, optional
+            Number of rows streamed to C program at one time, for
+            out-of-core states. If `data` is not `np.memmap` and
+            `n_block` is `None`, `data` is passed to C program as a whole.
+
+        y: np.ndarray or None, optional
+            Targets of samples, required for SPXY metric.
+
+        progress: KSProgress or None
+            See `KSProgress`. If cancelled, state has the samples
+            selected so far, and could be extended again.
+        """
+        assert(self.n_sample == (_dist_n_sample(data) if self.metric is None else data.shape[0]))
+        assert(n_result <= self.n_sample)
+        if n_result <= self.n_selected:
+            if progress is not None:
+                progress.n_selected = self.n_selected
+                progress.phase = KSProgress.PHASES.index("done")
+            return self
+        n_selected, result, v_dist = self._resize(n_result)
+        args = [
+            result.ctypes.data_as(ctypes.c_void_p),
+            v_dist.ctypes.data_as(ctypes.c_void_p),
+            self.min_vals.ctypes.data_as(ctypes.c_void_p),
+            self.selected.ctypes.data_as(ctypes.c_void_p),
+        ]
+        if self.metric is not None:
+            _require_ks_cpp("Extending states on original data")
+        if self.metric is None and isinstance(data, tuple) and ks_cpp_available():
+            codes, scale = np.ascontiguousarray(data[0]), np.ascontiguousarray(data[1], dtype=np.float32)
+            ks_cpp.kennard_stone_quantized_resume(
+                codes.ctypes.data_as(ctypes.c_void_p), ctypes.c_int(QUANTIZED[codes.dtype.name]),
+                scale.ctypes.data_as(ctypes.c_void_p), *args,
+                ctypes.c_size_t(self.n_sample), ctypes.c_size_t(n_selected), ctypes.c_size_t(n_result),
+                _progress_ref(progress))
+        elif self.metric is None and ks_cpp_available():
+            dist = np.ascontiguousarray(data, dtype=np.float32)
+            kernel = ks_cpp.kennard_stone_condensed_resume if dist.ndim == 1 else ks_cpp.kennard_stone_resume
+            kernel(dist.ctypes.data_as(ctypes.c_void_p), *args,
+                   ctypes.c_size_t(self.n_sample), ctypes.c_size_t(n_selected), ctypes.c_size_t(n_result),
+                   _progress_ref(progress))
+        elif self.metric is None or isinstance(data, np.memmap) or n_block is not None or self.metric != "euclidean":
+            if self.metric is None:
+                # NumPy loop on rows of distance matrix
+                mm = _DistRows(data)
+            else:
+                if not isinstance(data, np.memmap) and n_block is None:
+                    data = np.ascontiguousarray(data, dtype=np.float32)
+                    n_block = data.shape[0]
+                n_block = _mem_block_size(n_block, data.shape[1])
+                mm = _MemMetric(data, n_block, self.metric, y, self.scale)
+            masked = np.where(self.selected, -np.inf, self.min_vals)
+            sup = (masked.max(), masked.argmax())
+            del masked
+            t_start = time.perf_counter()
+            if progress is not None:
+                progress.phase = 2
+            for n in range(n_selected, n_result):
+                if progress is not None:
+                    progress.n_selected, progress.sup_val = n, mm.to_dist(sup[0])
+                    if progress.cancelled:
+                        break
+                v_dist[n - 1], result[n] = mm.to_dist(sup[0]), sup[1]
+                self.selected[result[n]] = True
+                sup = mm.update(result[n], self.min_vals, self.selected)
+            else:
+                if progress is not None:
+                    progress.n_selected, progress.sup_val = n_result, mm.to_dist(sup[0])
+            if progress is not None:
+                progress.phase_time[2] += time.perf_counter() - t_start
+                progress.phase = 3
+        else:
+            # Squared distances are t_i + t_j - 2 x_i.x_j in float32, on centred copy of `data`
+            X, t = _centred(data)
+            ks_cpp.kennard_stone_mem_resume(
+                X.ctypes.data_as(ctypes.c_void_p), t.ctypes.data_as(ctypes.c_void_p), *args,
+                ctypes.c_size_t(self.n_sample), ctypes.c_size_t(X.shape[1]),
+                ctypes.c_size_t(n_selected), ctypes.c_size_t(n_result), _progress_ref(progress))
+        self.result, self.v_dist = _progress_truncate(progress, result.astype(int), v_dist.astype(float))
+        return self
+
+    def add_samples(self, data, n_block=None, y=None):
+        """
+        add_samples(data, n_block=None, y=None)
+
+        Append new samples to the candidates of selection.
+        Selected samples are kept; minimum distances of new samples to
+        selected samples are evaluated.
+
+        Parameters
+        ----------
+
+        data: np.ndarray
+            Distance matrix (for states from `from_dist`) or original
+            data (for states from `from_X`) of all samples, where the
+            first `n_sample` samples are the same to previous samples,
+            and new samples are appended afterwards.
+
+        y: np.ndarray or None, optional
+            Targets of all samples, required for SPXY metric.
+            `scale` of state is not changed by new samples.
+        """
+        n_old = self.n_sample
+        n_new = _dist_n_sample(data) if self.metric is None else data.shape[0]
+        assert(n_new >= n_old)
+        min_vals = np.full(n_new - n_old, np.inf, dtype=np.float32)
+        selected = np.zeros(n_new - n_old, dtype=bool)
+        if self.metric is None:
+            for idx in self.result:
+                np.minimum(min_vals, _dist_row(data, idx)[n_old:], out=min_vals)
+        else:
+            _require_ks_cpp("States on original data")
+            n_block = _mem_block_size(n_block, data.shape[1])
+            mm = _MemMetric(data, n_block, self.metric, y, self.scale, n_old)
+            for idx in self.result:
+                mm.update(idx, min_vals, selected)
+        self.min_vals = np.concatenate([self.min_vals, min_vals])
+        self.selected = np.concatenate([self.selected, selected])
+        return self
+
+    def save(self, path):
+        """
+        Checkpoint state to `.npz` file.
+        """
+        np.savez(path, result=self.result, v_dist=self.v_dist, min_vals=self.min_vals,
+                 selected=self.selected, metric="" if self.metric is None else self.metric,
+                 scale=self.scale)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load state checkpointed by `save`.
+        """
+        with np.load(path) as f:
+            metric = str(f["metric"]) or None
+            return cls(f["result"], f["v_dist"], f["min_vals"], f["selected"], metric, f["scale"])
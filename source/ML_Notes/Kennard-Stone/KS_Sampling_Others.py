@@ -124,3 +124,202 @@ def ks_from_XiaqiongFan(X, Num):
         CalInd[i] = vNotSelected[nIndexvMinDistance]
     ValInd = np.array(list(set(vAll)-set(CalInd)))
     return CalInd, ValInd
+
+
+def ks_from_hxhc_fast(spectra, test_size=0.25, metric='euclidean', *args, **kwargs):
+    """
+    Same to `ks_from_hxhc`, with `max_min_distance_split_fast`.
+    """
+    if test_size < 1:
+        train_size = round(spectra.shape[0] * (1 - test_size))
+    else:
+        train_size = spectra.shape[0] - round(test_size)
+
+    if train_size > 2:
+        distance = cdist(spectra, spectra, metric=metric, *args, **kwargs)
+        select_pts, remaining_pts = max_min_distance_split_fast(distance, train_size)
+    else:
+        raise ValueError("train sample size should be at least 2")
+
+    return select_pts, remaining_pts
+
+
+def _value_hash(values):
+    """
+    32-bit hashes of float values; equal values have equal hashes.
+    """
+    # +0. maps -0. to 0., which compares equal
+    bits = (np.asarray(values, dtype=float) + 0.).view(np.uint64)
+    return (bits ^ (bits >> np.uint64(32))).astype(np.uint32)
+
+
+def _value_keys(distance, n_row=256):
+    """
+    Sorted `_value_hash` of the values of `distance`, of the upper triangle
+    (with diagonal) only if `distance` is symmetric, and whether it is.
+
+    The count of the hash of a value bounds its occurrences from above.
+    """
+    n = distance.shape[0]
+    symmetric = distance.shape == (n, n) and all(
+        np.array_equal(distance[i0:i0 + n_row], distance[:, i0:i0 + n_row].T)
+        for i0 in range(0, n, n_row))
+    if symmetric:
+        keys = np.empty(n * (n + 1) // 2, dtype=np.uint32)
+        offset = 0
+        for i in range(n):
+            keys[offset:offset + n - i] = _value_hash(distance[i, i:])
+            offset += n - i
+    else:
+        keys = np.empty(distance.size, dtype=np.uint32)
+        for i0 in range(0, n, n_row):
+            keys[i0 * distance.shape[1]:(i0 + n_row) * distance.shape[1]] = _value_hash(distance[i0:i0 + n_row]).ravel()
+    keys.sort()
+    return keys, symmetric
+
+
+def max_min_distance_split_fast(distance, train_size):
+    """
+    Same selection and output to `max_min_distance_split`, with minimum
+    distances to selected points updated incrementally, O(n) per iteration.
+
+    The reference selects the first unselected column (rows in selection
+    order) of any selected row at exactly the max-min distance, which is
+    not always a point attaining the max-min distance if the same
+    distance value occurs elsewhere. So the point attaining the max-min
+    distance is taken directly only if its distance value is unique in
+    `distance`; otherwise the selected rows are scanned as the reference.
+    Uniqueness is checked on sorted 32-bit hashes of the (upper triangle,
+    if symmetric) values, a quarter of `distance` in memory; hash
+    collisions only cause an unneeded scan.
+    """
+    n = distance.shape[0]
+    remaining_pts = [x for x in range(n)]
+
+    first_2pts = np.unravel_index(np.argmax(distance), distance.shape)
+    select_pts = [first_2pts[0], first_2pts[1]]
+    remaining_pts.remove(first_2pts[0])
+    remaining_pts.remove(first_2pts[1])
+
+    keys, symmetric = _value_keys(distance)
+    selected = np.zeros(n, dtype=bool)
+    selected[select_pts] = True
+    # minimum distance to selected rows, and position of the first selected row attaining it
+    min_vals = np.array(distance[select_pts[0]], dtype=float)
+    min_pos = np.zeros(n, dtype=int)
+
+    def add_row(point):
+        row = distance[point]
+        closer = row < min_vals
+        min_vals[closer] = row[closer]
+        min_pos[closer] = len(select_pts) - 1
+
+    add_row(select_pts[1])
+    for i in range(train_size - 2):
+        masked = np.where(selected, -np.inf, min_vals)
+        max_min_distance = masked.max()
+        ties = np.flatnonzero(masked == max_min_distance)
+        point = ties[np.lexsort((ties, min_pos[ties]))[0]]
+        key = _value_hash(max_min_distance)
+        # upper bound of the occurrences of max-min distance in `distance`
+        n_same = np.searchsorted(keys, key, "right") - np.searchsorted(keys, key, "left")
+        if symmetric:
+            n_same *= 2
+        n_known = 1 + (distance[point, select_pts[min_pos[point]]] == max_min_distance)
+        if ties.shape[0] > 1 or n_same > n_known:
+            # rows after the one attaining max-min distance of `point` could not be earlier
+            rows = select_pts[:min_pos[point] + 1]
+            block = distance[rows] == max_min_distance
+            block[:, selected] = False
+            point = np.argmax(block.ravel()) % n
+        select_pts.append(int(point))
+        selected[point] = True
+        add_row(point)
+    remaining_pts = [x for x in remaining_pts if not selected[x]]
+    return select_pts, remaining_pts
+
+
+def ks_from_karoka_fast(X, k):
+    """
+    Same selection to `ks_from_karoka`, with minimum distances to selected
+    samples updated incrementally, O(n) per iteration.
+
+    Ties are broken by the smallest index as the reference; when all
+    remaining samples have zero minimum distance (duplicates of selected
+    samples), the reference appends the previously selected sample again
+    until `k` samples are returned, which is reproduced.
+    """
+    n = len(X) # number of samples
+    assert n >= 2 and n >= k and k >= 2, "Error: number of rows must >= 2, k must >= 2 and k must > number of rows"
+    # pair-wise distance matrix
+    dist = metrics.pairwise_distances(X, metric='euclidean', n_jobs=-1)
+
+    # get the first two samples
+    i0, i1 = np.unravel_index(np.argmax(dist, axis=None), dist.shape)
+    selected = np.zeros(n, dtype=bool)
+    selected[[i0, i1]] = True
+    selected_list = [i0, i1]
+    k -= 2
+    # minimum of dist[j][i] over selected i, for every j
+    min_vals = np.minimum(dist[:, i0], dist[:, i1])
+    n_selected = selected.sum()
+    minj = i0
+    while k > 0 and n_selected < n:
+        masked = np.where(selected, 0., min_vals)
+        j = int(np.argmax(masked))
+        if masked[j] > 0.:
+            minj = j
+        else:
+            # no sample is farther than 0, `minj` is not changed until the end
+            selected_list += [minj] * k
+            break
+        selected[minj] = True
+        n_selected += 1
+        np.minimum(min_vals, dist[:, minj], out=min_vals)
+        selected_list.append(minj)
+        k -= 1
+    # return selected samples
+    return selected_list
+
+
+def ks_from_XiaqiongFan_fast(X, Num):
+    """
+    Same selection and output to `ks_from_XiaqiongFan`, with vectorized
+    distance matrix and minimum distances updated incrementally,
+    O(n) per iteration.
+
+    The reference assigns `np.where` results into `CalInd`, which numpy
+    only accepts (before numpy 2) for a single element, so it has no
+    selection for exactly tied maximum distances; these raise `ValueError`
+    here, use `ks_from_karoka_fast` (smallest index) for such data. For one
+    maximum, the index is taken explicitly, which also runs on numpy 2.
+    """
+    nrow = X.shape[0]
+    CalInd = np.zeros((Num), dtype=int)-1
+    vAll = np.arange(0, nrow)
+    X = np.asarray(X, dtype=float)
+    D = np.zeros((nrow, nrow))
+    for i in range(nrow-1):
+        diff = X[i] - X[i+1:]
+        D[i, i+1:] = np.sqrt(np.einsum("ij, ij -> i", diff, diff))
+    ind = np.where(D == D.max())
+    if ind[0].shape[0] > 1:
+        raise ValueError("{} pairs of samples are tied at the maximum distance, "
+                         "which `ks_from_XiaqiongFan` cannot select from".format(ind[0].shape[0]))
+    CalInd[0] = ind[1][0]
+    CalInd[1] = ind[0][0]
+    D += D.T
+    selected = np.zeros(nrow, dtype=bool)
+    selected[CalInd[:2]] = True
+    min_vals = np.minimum(D[CalInd[0]], D[CalInd[1]])
+    for i in range(2, Num):
+        masked = np.where(selected, -np.inf, min_vals)
+        ties = np.flatnonzero(masked == masked.max())
+        if ties.shape[0] > 1:
+            raise ValueError("{} samples are tied at the max-min distance for sample {}, "
+                             "which `ks_from_XiaqiongFan` cannot select from".format(ties.shape[0], i))
+        CalInd[i] = ties[0]
+        selected[ties[0]] = True
+        np.minimum(min_vals, D[ties[0]], out=min_vals)
+    ValInd = np.array(list(set(vAll)-set(CalInd)))
+    return CalInd, ValInd
@@ -1,152 +1,1098 @@
-#include <stdio.h>
-#include <malloc.h>
-#include <assert.h>
-#include <memory.h>
-#include <math.h>
-
-
-// C bool
-typedef enum {
-    true=1, false=0
-} bool;
-
-inline void update_min(float* p1, float v2) {
-    if (v2 < *p1) *p1 = v2;
-}
-
-// https://stackoverflow.com/questions/28258590/using-openmp-to-get-the-index-of-minimum-element-parallelly
-struct Compare { float val; size_t index; };
-#pragma omp declare reduction(maximum : struct Compare : omp_out = omp_in.val > omp_out.val ? omp_in : omp_out)
-
-void kennard_stone(float* cdist, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_seed, size_t n_result) {
-    // 00. Assertions and Result Vector Initialization
-    struct Compare sup;
-    if (n_seed == 2) v_dist[0] = cdist[seed[0] * n_sample + seed[1]];
-    if (n_seed == 0) {
-        size_t n_sample_2 = n_sample * n_sample;
-        sup.val = -1.;
-        sup.index = 0;
-        #pragma omp parallel for reduction(maximum:sup)
-        for (size_t i = 0; i < n_sample_2; ++i) {
-            if (cdist[i] > sup.val) {
-                sup.val = cdist[i];
-                sup.index = i;
-            }
-        }
-        seed[0] = sup.index / n_sample;
-        seed[1] = sup.index % n_sample;
-        n_seed = 2;
-        v_dist[0] = sup.val;
-    }
-    n_result = n_result == 0 ? n_sample : n_result;
-    assert(n_result <= n_sample);
-    assert(n_seed <= n_sample);
-    memcpy(result, seed, n_seed * sizeof(size_t));
-    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
-    // 01. Scratch Area Initialization
-    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
-    memset(selected, false, n_sample * sizeof(bool));
-    for (size_t i = 0; i < n_seed; ++i)
-        selected[result[i]] = true;
-    // 02. Minimum Out-of-Group Initialization
-    float* min_vals = (float*)malloc(n_sample * sizeof(float));
-    memcpy(min_vals, cdist + n_sample * result[0], n_sample * sizeof(float));
-    for (size_t n = 1; n < n_seed; ++n) {
-        size_t idx_starting = result[n] * n_sample;
-    	#pragma omp parallel for
-        for (size_t i = 0; i < n_sample; ++i) {
-            if (selected[i]) continue;
-            update_min(&min_vals[i], cdist[idx_starting + i]);
-        }
-    }
-    // 03. Main Algorithm
-    for (size_t n = n_seed; n < n_result; ++n) {
-        // Find sup of the minimum
-        sup.val = -1.;
-        sup.index = 0;
-        #pragma omp parallel for reduction(maximum:sup)
-        for (size_t i = 0; i < n_sample; ++i) {
-            if (selected[i]) continue;
-            if (min_vals[i] > sup.val) {
-                sup.index = i;
-                sup.val = min_vals[i];
-            }
-        }
-        v_dist[n - 1] = sup.val;
-        selected[sup.index] = true;
-        result[n] = sup.index;
-        size_t idx_starting = sup.index * n_sample;
-        #pragma omp parallel for
-        for (size_t i = 0; i < n_sample; ++i) {
-            if (selected[i]) continue;
-            update_min(&min_vals[i], cdist[idx_starting + i]);
-        }
-    }
-    free(selected);
-    free(min_vals);
-}
-
-float euclid_distance_vector(float* x1, float* x2, size_t n_feature) {
-    float res = 0.;
-    do {
-    	res += (*x1 - *x2) * (*x1 - *x2);
-        ++x1, ++x2;
-    } while (--n_feature);
-    return sqrtf(res);
-}
-
-void kennard_stone_mem(float* X, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_feature, size_t n_seed, size_t n_result) {
-    // 00. Assertions and Result Vector Initialization
-    struct Compare sup;
-    if (n_seed == 2) v_dist[0] = euclid_distance_vector(X + n_feature * seed[0], X + n_feature * seed[1], n_feature);
-    assert(n_seed != 0);           // Seed should be supplied from outer program.
-    assert(n_result <= n_sample);
-    assert(n_seed <= n_sample);
-    memcpy(result, seed, n_seed * sizeof(size_t));
-    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
-    // 01. Scratch Area Initialization
-    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
-    memset(selected, false, n_sample * sizeof(bool));
-    for (size_t i = 0; i < n_seed; ++i)
-        selected[result[i]] = true;
-    // 02. Minimum Out-of-Group Initialization
-    float* min_vals = (float*)malloc(n_sample * sizeof(float));
-    #pragma omp parallel for
-    for (size_t i = 0; i < n_sample; ++i) {
-        if (selected[i]) continue;
-        min_vals[i] = euclid_distance_vector(X + n_feature * result[0], X + n_feature * i, n_feature);
-    }
-    for (size_t n = 1; n < n_seed; ++n) {
-        float* p_starting = X + result[n] * n_feature;
-    	#pragma omp parallel for
-        for (size_t i = 0; i < n_sample; ++i) {
-            if (selected[i]) continue;
-            update_min(&min_vals[i], euclid_distance_vector(p_starting, X + n_feature * i, n_feature));
-        }
-    }
-    // 03. Main Algorithm
-    for (size_t n = n_seed; n < n_result; ++n) {
-        // Find sup of the minimum
-        sup.val = -1.;
-        sup.index = 0;
-        #pragma omp parallel for reduction(maximum:sup)
-        for (size_t i = 0; i < n_sample; ++i) {
-            if (selected[i]) continue;
-            if (min_vals[i] > sup.val) {
-                sup.index = i;
-                sup.val = min_vals[i];
-            }
-        }
-        v_dist[n - 1] = sup.val;
-        selected[sup.index] = true;
-        result[n] = sup.index;
-        float* p_starting = X + sup.index * n_feature;
-        #pragma omp parallel for
-        for (size_t i = 0; i < n_sample; ++i) {
-            if (selected[i]) continue;
-            update_min(&min_vals[i], euclid_distance_vector(p_starting, X + n_feature * i, n_feature));
-        }
-    }
-    free(selected);
-    free(min_vals);
-}
+#include <stdio.h>
+#include <malloc.h>
+#include <assert.h>
+#include <memory.h>
+#include <math.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <omp.h>
+
+
+static inline void update_min(float* p1, float v2) {
+    if (v2 < *p1) *p1 = v2;
+}
+
+// https://stackoverflow.com/questions/28258590/using-openmp-to-get-the-index-of-minimum-element-parallelly
+// Ties are broken by the smallest index, so that results do not depend on thread scheduling.
+struct Compare { float val; size_t index; };
+#pragma omp declare reduction(maximum : struct Compare : omp_out = \
+    (omp_in.val > omp_out.val || (omp_in.val == omp_out.val && omp_in.index < omp_out.index)) ? omp_in : omp_out)
+
+// Active set: compact array `active` of unselected sample indexes, with their minimum distances
+// `active_min` at the same positions. Selected samples are swap-removed, so loops only walk
+// `n_active` entries sequentially. `pos` is position of `index` in the active set.
+struct ActiveCompare { float val; size_t index; size_t pos; };
+#pragma omp declare reduction(active_maximum : struct ActiveCompare : omp_out = \
+    (omp_in.val > omp_out.val || (omp_in.val == omp_out.val && omp_in.index < omp_out.index)) ? omp_in : omp_out) \
+    initializer(omp_priv = {-1., 0, 0})
+
+// Progress of sampling, shared with a monitoring thread (ctypes releases the GIL).
+// Kernels write `n_selected`, `sup_val` (current max-min distance) and `phase`, and accumulate
+// `phase_time` (seconds of seed search, initialization and main loop). The monitor sets `cancel`
+// to stop the main loop; then `n_selected` samples are selected, and minimum distances are
+// consistent, so that sampling could be resumed. `progress` could be NULL.
+enum { PHASE_SEED = 0, PHASE_INIT = 1, PHASE_MAIN = 2, PHASE_DONE = 3 };
+struct Progress { size_t n_selected; float sup_val; int cancel; int phase; double phase_time[3]; };
+
+bool progress_update(struct Progress* progress, size_t n_selected, float sup_val) {
+    // Report progress, and return whether sampling is cancelled
+    if (!progress) return false;
+    progress->n_selected = n_selected;
+    progress->sup_val = sup_val;
+    return ((volatile struct Progress*)progress)->cancel != 0;
+}
+
+bool progress_cancelled(struct Progress* progress) {
+    // Cancellation check of seed search, without reporting progress
+    return progress && ((volatile struct Progress*)progress)->cancel != 0;
+}
+
+double progress_start(struct Progress* progress, int phase) {
+    if (progress) progress->phase = phase;
+    return omp_get_wtime();
+}
+
+void progress_stop(struct Progress* progress, int phase, double t_start) {
+    if (progress) progress->phase_time[phase] += omp_get_wtime() - t_start;
+}
+
+static inline void update_active_sup(struct ActiveCompare* sup, float val, size_t index, size_t pos) {
+    if (val > sup->val || (val == sup->val && index < sup->index)) {
+        sup->val = val;
+        sup->index = index;
+        sup->pos = pos;
+    }
+}
+
+size_t active_gather(float* min_vals, bool* selected, size_t n_sample, size_t* active, float* active_min) {
+    // Build active set from selection flags, return number of unselected samples.
+    size_t n_active = 0;
+    for (size_t i = 0; i < n_sample; ++i) {
+        if (selected[i]) continue;
+        active[n_active] = i;
+        active_min[n_active] = min_vals[i];
+        ++n_active;
+    }
+    return n_active;
+}
+
+void active_scatter(float* min_vals, size_t* active, float* active_min, size_t n_active) {
+    // Write minimum distances of active set back, so that sampling could be resumed.
+    for (size_t k = 0; k < n_active; ++k)
+        min_vals[active[k]] = active_min[k];
+}
+
+struct ActiveCompare active_argmax(float* active_min, size_t* active, size_t n_active) {
+    struct ActiveCompare sup = {-1., 0, 0};
+    #pragma omp parallel for reduction(active_maximum:sup) schedule(static)
+    for (size_t k = 0; k < n_active; ++k)
+        update_active_sup(&sup, active_min[k], active[k], k);
+    return sup;
+}
+
+static inline void active_remove(size_t* active, float* active_min, size_t* n_active, size_t pos) {
+    // Swap-remove position `pos` from active set
+    --*n_active;
+    active[pos] = active[*n_active];
+    active_min[pos] = active_min[*n_active];
+}
+
+void full_update_min(float* cdist, size_t idx, float* min_vals, bool* selected, size_t n_sample) {
+    // Update minimum distances by row `idx` of distance matrix.
+    float* p_starting = cdist + idx * n_sample;
+    #pragma omp parallel for
+    for (size_t i = 0; i < n_sample; ++i) {
+        if (selected[i]) continue;
+        update_min(&min_vals[i], p_starting[i]);
+    }
+}
+
+void kennard_stone_resume(float* cdist, size_t* result, float* v_dist, float* min_vals, bool* selected, size_t n_sample, size_t n_start, size_t n_result, struct Progress* progress) {
+    // Continue sampling from `n_start` samples already selected in `result`,
+    // with their minimum distances `min_vals` and selection flags `selected`.
+    // Iterations only walk the active set of unselected samples.
+    double t_main = progress_start(progress, PHASE_MAIN);
+    if (n_start >= n_result) {
+        progress_update(progress, n_start, 0.);
+        progress_stop(progress, PHASE_MAIN, t_main);
+        progress_start(progress, PHASE_DONE);
+        return;
+    }
+    size_t* active = (size_t*)malloc(n_sample * sizeof(size_t));
+    float* active_min = (float*)malloc(n_sample * sizeof(float));
+    size_t n_active = active_gather(min_vals, selected, n_sample, active, active_min);
+    struct ActiveCompare sup = active_argmax(active_min, active, n_active);
+    size_t n = n_start;
+    for (; n < n_result; ++n) {
+        if (progress_update(progress, n, sup.val)) break;
+        v_dist[n - 1] = sup.val;
+        selected[sup.index] = true;
+        result[n] = sup.index;
+        active_remove(active, active_min, &n_active, sup.pos);
+        // Update minimum and find sup of the minimum
+        float* p_starting = cdist + sup.index * n_sample;
+        sup.val = -1., sup.index = 0, sup.pos = 0;
+        #pragma omp parallel for reduction(active_maximum:sup) schedule(static)
+        for (size_t k = 0; k < n_active; ++k) {
+            update_min(&active_min[k], p_starting[active[k]]);
+            update_active_sup(&sup, active_min[k], active[k], k);
+        }
+    }
+    progress_update(progress, n, sup.val);
+    progress_stop(progress, PHASE_MAIN, t_main);
+    progress_start(progress, PHASE_DONE);
+    active_scatter(min_vals, active, active_min, n_active);
+    free(active);
+    free(active_min);
+}
+
+void kennard_stone(float* cdist, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_seed, size_t n_result, struct Progress* progress) {
+    // 00. Assertions and Result Vector Initialization
+    double t_phase = progress_start(progress, PHASE_SEED);
+    struct Compare sup;
+    if (n_seed == 2) v_dist[0] = cdist[seed[0] * n_sample + seed[1]];
+    if (n_seed == 0) {
+        size_t n_sample_2 = n_sample * n_sample;
+        sup.val = -1.;
+        sup.index = 0;
+        #pragma omp parallel for reduction(maximum:sup)
+        for (size_t i = 0; i < n_sample_2; ++i) {
+            if (cdist[i] > sup.val) {
+                sup.val = cdist[i];
+                sup.index = i;
+            }
+        }
+        seed[0] = sup.index / n_sample;
+        seed[1] = sup.index % n_sample;
+        n_seed = 2;
+        v_dist[0] = sup.val;
+    }
+    n_result = n_result == 0 ? n_sample : n_result;
+    assert(n_result <= n_sample);
+    assert(n_seed <= n_sample);
+    memcpy(result, seed, n_seed * sizeof(size_t));
+    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
+    progress_stop(progress, PHASE_SEED, t_phase);
+    t_phase = progress_start(progress, PHASE_INIT);
+    // 01. Scratch Area Initialization
+    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
+    memset(selected, false, n_sample * sizeof(bool));
+    for (size_t i = 0; i < n_seed; ++i)
+        selected[result[i]] = true;
+    // 02. Minimum Out-of-Group Initialization
+    float* min_vals = (float*)malloc(n_sample * sizeof(float));
+    for (size_t i = 0; i < n_sample; ++i)
+        min_vals[i] = INFINITY;
+    for (size_t n = 0; n < n_seed; ++n)
+        full_update_min(cdist, result[n], min_vals, selected, n_sample);
+    progress_stop(progress, PHASE_INIT, t_phase);
+    // 03. Main Algorithm
+    kennard_stone_resume(cdist, result, v_dist, min_vals, selected, n_sample, n_seed, n_result, progress);
+    free(selected);
+    free(min_vals);
+}
+
+size_t condensed_offset(size_t i, size_t n_sample) {
+    // Position of element (i, i + 1) in condensed (upper-triangle, scipy `pdist`) storage
+    return i * n_sample - i * (i + 1) / 2;
+}
+
+void condensed_update_min(float* cdist, size_t idx, float* min_vals, bool* selected, size_t n_sample) {
+    // Update minimum distances by row `idx` of condensed distance matrix.
+    // Elements (i, idx) for i < idx are strided in condensed storage; (idx, i) for i > idx are contiguous.
+    #pragma omp parallel for
+    for (size_t i = 0; i < idx; ++i) {
+        if (selected[i]) continue;
+        update_min(&min_vals[i], cdist[condensed_offset(i, n_sample) + idx - i - 1]);
+    }
+    float* p_starting = cdist + condensed_offset(idx, n_sample);
+    #pragma omp parallel for
+    for (size_t i = idx + 1; i < n_sample; ++i) {
+        if (selected[i]) continue;
+        update_min(&min_vals[i], p_starting[i - idx - 1]);
+    }
+}
+
+void kennard_stone_condensed_resume(float* cdist, size_t* result, float* v_dist, float* min_vals, bool* selected, size_t n_sample, size_t n_start, size_t n_result, struct Progress* progress) {
+    // Same to `kennard_stone_resume`, on condensed distance matrix.
+    double t_main = progress_start(progress, PHASE_MAIN);
+    if (n_start >= n_result) {
+        progress_update(progress, n_start, 0.);
+        progress_stop(progress, PHASE_MAIN, t_main);
+        progress_start(progress, PHASE_DONE);
+        return;
+    }
+    size_t* active = (size_t*)malloc(n_sample * sizeof(size_t));
+    float* active_min = (float*)malloc(n_sample * sizeof(float));
+    size_t n_active = active_gather(min_vals, selected, n_sample, active, active_min);
+    struct ActiveCompare sup = active_argmax(active_min, active, n_active);
+    size_t n = n_start;
+    for (; n < n_result; ++n) {
+        if (progress_update(progress, n, sup.val)) break;
+        v_dist[n - 1] = sup.val;
+        selected[sup.index] = true;
+        result[n] = sup.index;
+        active_remove(active, active_min, &n_active, sup.pos);
+        size_t idx = sup.index;
+        size_t offset = condensed_offset(idx, n_sample);
+        sup.val = -1., sup.index = 0, sup.pos = 0;
+        #pragma omp parallel for reduction(active_maximum:sup) schedule(static)
+        for (size_t k = 0; k < n_active; ++k) {
+            size_t i = active[k];
+            update_min(&active_min[k], i < idx ? cdist[condensed_offset(i, n_sample) + idx - i - 1] : cdist[offset + i - idx - 1]);
+            update_active_sup(&sup, active_min[k], i, k);
+        }
+    }
+    progress_update(progress, n, sup.val);
+    progress_stop(progress, PHASE_MAIN, t_main);
+    progress_start(progress, PHASE_DONE);
+    active_scatter(min_vals, active, active_min, n_active);
+    free(active);
+    free(active_min);
+}
+
+void kennard_stone_condensed(float* cdist, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_seed, size_t n_result, struct Progress* progress) {
+    // Same to `kennard_stone`, but `cdist` is condensed distance matrix of
+    // length n_sample * (n_sample - 1) / 2, which halves memory cost.
+    // 00. Assertions and Result Vector Initialization
+    double t_phase = progress_start(progress, PHASE_SEED);
+    struct Compare sup;
+    if (n_seed == 2) {
+        size_t i = seed[0] < seed[1] ? seed[0] : seed[1], j = seed[0] < seed[1] ? seed[1] : seed[0];
+        v_dist[0] = cdist[condensed_offset(i, n_sample) + j - i - 1];
+    }
+    if (n_seed == 0) {
+        size_t n_condensed = n_sample * (n_sample - 1) / 2;
+        sup.val = -1.;
+        sup.index = 0;
+        #pragma omp parallel for reduction(maximum:sup)
+        for (size_t i = 0; i < n_condensed; ++i) {
+            if (cdist[i] > sup.val) {
+                sup.val = cdist[i];
+                sup.index = i;
+            }
+        }
+        size_t i = 0;
+        while (condensed_offset(i + 1, n_sample) <= sup.index) ++i;
+        seed[0] = i;
+        seed[1] = sup.index - condensed_offset(i, n_sample) + i + 1;
+        n_seed = 2;
+        v_dist[0] = sup.val;
+    }
+    n_result = n_result == 0 ? n_sample : n_result;
+    assert(n_result <= n_sample);
+    assert(n_seed <= n_sample);
+    memcpy(result, seed, n_seed * sizeof(size_t));
+    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
+    progress_stop(progress, PHASE_SEED, t_phase);
+    t_phase = progress_start(progress, PHASE_INIT);
+    // 01. Scratch Area Initialization
+    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
+    memset(selected, false, n_sample * sizeof(bool));
+    for (size_t i = 0; i < n_seed; ++i)
+        selected[result[i]] = true;
+    // 02. Minimum Out-of-Group Initialization
+    float* min_vals = (float*)malloc(n_sample * sizeof(float));
+    for (size_t i = 0; i < n_sample; ++i)
+        min_vals[i] = INFINITY;
+    for (size_t n = 0; n < n_seed; ++n)
+        condensed_update_min(cdist, result[n], min_vals, selected, n_sample);
+    progress_stop(progress, PHASE_INIT, t_phase);
+    // 03. Main Algorithm
+    kennard_stone_condensed_resume(cdist, result, v_dist, min_vals, selected, n_sample, n_seed, n_result, progress);
+    free(selected);
+    free(min_vals);
+}
+
+// Reduced-precision distance storage: row `i` of distance matrix is stored as codes
+// (float16 bits, uint16 or uint8), and distance is scale[i] * value of code.
+enum { STORAGE_FLOAT16 = 0, STORAGE_UINT16 = 1, STORAGE_UINT8 = 2 };
+
+static float half_table[65536];
+static bool half_table_ready = false;
+
+float half_to_float(uint16_t h) {
+    uint32_t exponent = (h >> 10) & 0x1f, mantissa = h & 0x3ff;
+    float v;
+    if (exponent == 0) v = ldexpf((float)mantissa, -24);
+    else if (exponent == 31) v = mantissa ? NAN : INFINITY;
+    else v = ldexpf((float)(mantissa + 1024), (int)exponent - 25);
+    return (h & 0x8000) ? -v : v;
+}
+
+void half_table_init() {
+    // Decoding table of float16, called before parallel regions
+    if (half_table_ready) return;
+    for (size_t h = 0; h < 65536; ++h)
+        half_table[h] = half_to_float((uint16_t)h);
+    half_table_ready = true;
+}
+
+static inline float quantized_value(void* cdist, int storage, float* scale, size_t idx, size_t i, size_t n_sample) {
+    size_t k = idx * n_sample + i;
+    switch (storage) {
+    case STORAGE_FLOAT16: return scale[idx] * half_table[((uint16_t*)cdist)[k]];
+    case STORAGE_UINT16: return scale[idx] * ((uint16_t*)cdist)[k];
+    default: return scale[idx] * ((uint8_t*)cdist)[k];
+    }
+}
+
+void kennard_stone_quantized_resume(void* cdist, int storage, float* scale, size_t* result, float* v_dist, float* min_vals, bool* selected, size_t n_sample, size_t n_start, size_t n_result, struct Progress* progress) {
+    // Same to `kennard_stone_resume`, on reduced-precision distance storage.
+    // Bandwidth of reading a row is halved (float16, uint16) or quartered (uint8).
+    double t_main = progress_start(progress, PHASE_MAIN);
+    if (n_start >= n_result) {
+        progress_update(progress, n_start, 0.);
+        progress_stop(progress, PHASE_MAIN, t_main);
+        progress_start(progress, PHASE_DONE);
+        return;
+    }
+    half_table_init();
+    size_t* active = (size_t*)malloc(n_sample * sizeof(size_t));
+    float* active_min = (float*)malloc(n_sample * sizeof(float));
+    size_t n_active = active_gather(min_vals, selected, n_sample, active, active_min);
+    struct ActiveCompare sup = active_argmax(active_min, active, n_active);
+    size_t n = n_start;
+    for (; n < n_result; ++n) {
+        if (progress_update(progress, n, sup.val)) break;
+        v_dist[n - 1] = sup.val;
+        selected[sup.index] = true;
+        result[n] = sup.index;
+        active_remove(active, active_min, &n_active, sup.pos);
+        size_t idx = sup.index;
+        sup.val = -1., sup.index = 0, sup.pos = 0;
+        #pragma omp parallel for reduction(active_maximum:sup) schedule(static)
+        for (size_t k = 0; k < n_active; ++k) {
+            update_min(&active_min[k], quantized_value(cdist, storage, scale, idx, active[k], n_sample));
+            update_active_sup(&sup, active_min[k], active[k], k);
+        }
+    }
+    progress_update(progress, n, sup.val);
+    progress_stop(progress, PHASE_MAIN, t_main);
+    progress_start(progress, PHASE_DONE);
+    active_scatter(min_vals, active, active_min, n_active);
+    free(active);
+    free(active_min);
+}
+
+void kennard_stone_quantized(void* cdist, int storage, float* scale, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_seed, size_t n_result, struct Progress* progress) {
+    // Same to `kennard_stone`, on reduced-precision distance storage.
+    // 00. Assertions and Result Vector Initialization
+    double t_phase = progress_start(progress, PHASE_SEED);
+    half_table_init();
+    if (n_seed == 2) v_dist[0] = quantized_value(cdist, storage, scale, seed[0], seed[1], n_sample);
+    if (n_seed == 0) {
+        struct Compare sup;
+        sup.val = -1.;
+        sup.index = 0;
+        #pragma omp parallel for reduction(maximum:sup)
+        for (size_t i = 0; i < n_sample; ++i) {
+            for (size_t j = 0; j < n_sample; ++j) {
+                float v = quantized_value(cdist, storage, scale, i, j, n_sample);
+                if (v > sup.val) {
+                    sup.val = v;
+                    sup.index = i * n_sample + j;
+                }
+            }
+        }
+        seed[0] = sup.index / n_sample;
+        seed[1] = sup.index % n_sample;
+        n_seed = 2;
+        v_dist[0] = sup.val;
+    }
+    n_result = n_result == 0 ? n_sample : n_result;
+    assert(n_result <= n_sample);
+    assert(n_seed <= n_sample);
+    memcpy(result, seed, n_seed * sizeof(size_t));
+    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
+    progress_stop(progress, PHASE_SEED, t_phase);
+    t_phase = progress_start(progress, PHASE_INIT);
+    // 01. Scratch Area Initialization
+    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
+    memset(selected, false, n_sample * sizeof(bool));
+    for (size_t i = 0; i < n_seed; ++i)
+        selected[result[i]] = true;
+    // 02. Minimum Out-of-Group Initialization
+    float* min_vals = (float*)malloc(n_sample * sizeof(float));
+    for (size_t i = 0; i < n_sample; ++i)
+        min_vals[i] = INFINITY;
+    for (size_t n = 0; n < n_seed; ++n) {
+        #pragma omp parallel for
+        for (size_t i = 0; i < n_sample; ++i) {
+            if (selected[i]) continue;
+            update_min(&min_vals[i], quantized_value(cdist, storage, scale, result[n], i, n_sample));
+        }
+    }
+    progress_stop(progress, PHASE_INIT, t_phase);
+    // 03. Main Algorithm
+    kennard_stone_quantized_resume(cdist, storage, scale, result, v_dist, min_vals, selected, n_sample, n_seed, n_result, progress);
+    free(selected);
+    free(min_vals);
+}
+
+float euclid_distance_vector(float* x1, float* x2, size_t n_feature) {
+    float res = 0.;
+    do {
+    	res += (*x1 - *x2) * (*x1 - *x2);
+        ++x1, ++x2;
+    } while (--n_feature);
+    return sqrtf(res);
+}
+
+float dot_vector(const float* x1, const float* x2, size_t n_feature) {
+    float res = 0.;
+    #pragma omp simd reduction(+:res)
+    for (size_t a = 0; a < n_feature; ++a)
+        res += x1[a] * x2[a];
+    return res;
+}
+
+void dot_vector_x4(const float* x_ref, const float* x0, const float* x1, const float* x2, const float* x3, size_t n_feature, float* res) {
+    // Dot products of one reference sample with four samples;
+    // `x_ref` is loaded once for four rows, and every row is streamed sequentially.
+    float r0 = 0., r1 = 0., r2 = 0., r3 = 0.;
+    #pragma omp simd reduction(+:r0,r1,r2,r3)
+    for (size_t a = 0; a < n_feature; ++a) {
+        r0 += x_ref[a] * x0[a];
+        r1 += x_ref[a] * x1[a];
+        r2 += x_ref[a] * x2[a];
+        r3 += x_ref[a] * x3[a];
+    }
+    res[0] = r0, res[1] = r1, res[2] = r2, res[3] = r3;
+}
+
+void squared_norm_vector(float* X, float* t, size_t n_sample, size_t n_feature) {
+    #pragma omp parallel for
+    for (size_t i = 0; i < n_sample; ++i)
+        t[i] = dot_vector(X + n_feature * i, X + n_feature * i, n_feature);
+}
+
+float kennard_stone_mem_update(float* X, float* t, float* x_ref, float t_ref, float* min_vals, bool* selected, size_t n_sample, size_t n_feature, size_t* sup_index) {
+    // Update minimum squared distances of samples `X` (with squared norms `t`)
+    // by reference sample `x_ref`, and return the largest minimum squared distance
+    // of unselected samples.
+    // Squared distance is evaluated as t_ref + t_i - 2 x_ref.x_i, four samples at a time.
+    // Called on the whole dataset by `kennard_stone_mem`, and on row blocks for
+    // out-of-core sampling, where only `min_vals`, `selected` and `t` of the
+    // whole dataset need to be kept in memory.
+    struct Compare sup;
+    sup.val = -1.;
+    sup.index = 0;
+    #pragma omp parallel for reduction(maximum:sup) schedule(static)
+    for (size_t ib = 0; ib < n_sample; ib += 4) {
+        size_t nb = n_sample - ib < 4 ? n_sample - ib : 4;
+        float dots[4];
+        if (nb == 4) {
+            float* p = X + n_feature * ib;
+            dot_vector_x4(x_ref, p, p + n_feature, p + 2 * n_feature, p + 3 * n_feature, n_feature, dots);
+        } else {
+            for (size_t k = 0; k < nb; ++k)
+                dots[k] = dot_vector(x_ref, X + n_feature * (ib + k), n_feature);
+        }
+        for (size_t k = 0; k < nb; ++k) {
+            size_t i = ib + k;
+            if (selected[i]) continue;
+            float d2 = t_ref + t[i] - 2 * dots[k];
+            update_min(&min_vals[i], d2 > 0 ? d2 : 0);
+            if (min_vals[i] > sup.val) {
+                sup.index = i;
+                sup.val = min_vals[i];
+            }
+        }
+    }
+    *sup_index = sup.index;
+    return sup.val;
+}
+
+float farthest_pair(float* XA, float* tA, size_t nA, float* XB, float* tB, size_t nB, size_t n_feature, bool same, size_t* idx, struct Progress* progress) {
+    // Find the largest squared distance between samples `XA` and `XB` (with squared norms `tA`, `tB`),
+    // and store its location (i in XA, j in XB) in `idx`.
+    // If `same` is true, `XA` and `XB` are the same block and only j > i is evaluated.
+    // Tiles of `XB` are kept in cache while rows of `XA` tile are swept over them.
+    // Remaining tiles are skipped once `progress` is cancelled (result is then incomplete).
+    size_t tile_A = 16;
+    size_t tile_B = (1 << 16) / (n_feature + 1);
+    tile_B = tile_B < 4 ? 4 : tile_B - tile_B % 4;
+    struct Compare sup;
+    sup.val = -1.;
+    sup.index = 0;
+    #pragma omp parallel for reduction(maximum:sup) schedule(dynamic)
+    for (size_t iA = 0; iA < nA; iA += tile_A) {
+        if (progress_cancelled(progress)) continue;
+        size_t iA_end = iA + tile_A < nA ? iA + tile_A : nA;
+        for (size_t jB = same ? iA : 0; jB < nB; jB += tile_B) {
+            size_t jB_end = jB + tile_B < nB ? jB + tile_B : nB;
+            for (size_t i = iA; i < iA_end; ++i) {
+                float* x_ref = XA + i * n_feature;
+                size_t j0 = same && i + 1 > jB ? i + 1 : jB;
+                for (size_t j = j0; j < jB_end; j += 4) {
+                    size_t nb = jB_end - j < 4 ? jB_end - j : 4;
+                    float dots[4];
+                    if (nb == 4) {
+                        float* p = XB + j * n_feature;
+                        dot_vector_x4(x_ref, p, p + n_feature, p + 2 * n_feature, p + 3 * n_feature, n_feature, dots);
+                    } else {
+                        for (size_t k = 0; k < nb; ++k)
+                            dots[k] = dot_vector(x_ref, XB + (j + k) * n_feature, n_feature);
+                    }
+                    for (size_t k = 0; k < nb; ++k) {
+                        float d2 = tA[i] + tB[j + k] - 2 * dots[k];
+                        if (d2 > sup.val) {
+                            sup.val = d2;
+                            sup.index = i * nB + j + k;
+                        }
+                    }
+                }
+            }
+        }
+    }
+    idx[0] = sup.index / nB;
+    idx[1] = sup.index % nB;
+    return sup.val;
+}
+
+// Metrics on original data.
+// Minimum distances are stored in squared distance for Euclidean metric, and distance otherwise.
+// Auxiliary per-sample value `aux` is squared norm for Euclidean and SPXY, and norm for cosine.
+// SPXY distance is |x1 - x2| / scale_x + |y1 - y2| / scale_y, with targets `Y` of shape (n_sample, n_target).
+enum { METRIC_EUCLIDEAN = 0, METRIC_MANHATTAN = 1, METRIC_COSINE = 2, METRIC_SPXY = 3 };
+
+float metric_distance(int metric, float* x1, float aux1, float* y1, float* x2, float aux2, float* y2, size_t n_feature, size_t n_target, float scale_x, float scale_y) {
+    float res = 0.;
+    switch (metric) {
+    case METRIC_EUCLIDEAN:
+        res = aux1 + aux2 - 2 * dot_vector(x1, x2, n_feature);
+        return res > 0 ? res : 0;
+    case METRIC_MANHATTAN:
+        #pragma omp simd reduction(+:res)
+        for (size_t a = 0; a < n_feature; ++a)
+            res += fabsf(x1[a] - x2[a]);
+        return res;
+    case METRIC_COSINE:
+        if (aux1 == 0 || aux2 == 0) return 1.;
+        return 1 - dot_vector(x1, x2, n_feature) / (aux1 * aux2);
+    case METRIC_SPXY:
+        res = aux1 + aux2 - 2 * dot_vector(x1, x2, n_feature);
+        res = res > 0 ? sqrtf(res) / scale_x : 0;
+        float res_y = 0.;
+        for (size_t a = 0; a < n_target; ++a)
+            res_y += (y1[a] - y2[a]) * (y1[a] - y2[a]);
+        return res + sqrtf(res_y) / scale_y;
+    }
+    return NAN;
+}
+
+float kennard_stone_mem_update_metric(int metric, float* X, float* aux, float* Y, float* x_ref, float aux_ref, float* y_ref, float* min_vals, bool* selected, size_t n_sample, size_t n_feature, size_t n_target, float scale_x, float scale_y, size_t* sup_index) {
+    // Same to `kennard_stone_mem_update`, for metric `metric`.
+    if (metric == METRIC_EUCLIDEAN)
+        return kennard_stone_mem_update(X, aux, x_ref, aux_ref, min_vals, selected, n_sample, n_feature, sup_index);
+    struct Compare sup;
+    sup.val = -1.;
+    sup.index = 0;
+    #pragma omp parallel for reduction(maximum:sup) schedule(static)
+    for (size_t i = 0; i < n_sample; ++i) {
+        if (selected[i]) continue;
+        update_min(&min_vals[i], metric_distance(metric, x_ref, aux_ref, y_ref, X + i * n_feature, aux[i], Y + i * n_target, n_feature, n_target, scale_x, scale_y));
+        if (min_vals[i] > sup.val) {
+            sup.index = i;
+            sup.val = min_vals[i];
+        }
+    }
+    *sup_index = sup.index;
+    return sup.val;
+}
+
+void metric_distance_row(int metric, float* X, float* aux, float* Y, float* x_ref, float aux_ref, float* y_ref, float* out, size_t n_sample, size_t n_feature, size_t n_target, float scale_x, float scale_y) {
+    // Distances (not squared for Euclidean) from reference sample to samples `X`.
+    #pragma omp parallel for schedule(static)
+    for (size_t i = 0; i < n_sample; ++i) {
+        out[i] = metric_distance(metric, x_ref, aux_ref, y_ref, X + i * n_feature, aux[i], Y + i * n_target, n_feature, n_target, scale_x, scale_y);
+        if (metric == METRIC_EUCLIDEAN) out[i] = sqrtf(out[i]);
+    }
+}
+
+float farthest_pair_metric(int metric, float* XA, float* auxA, float* YA, size_t nA, float* XB, float* auxB, float* YB, size_t nB, size_t n_feature, size_t n_target, float scale_x, float scale_y, bool same, size_t* idx, struct Progress* progress) {
+    // Same to `farthest_pair`, for metric `metric`.
+    if (metric == METRIC_EUCLIDEAN)
+        return farthest_pair(XA, auxA, nA, XB, auxB, nB, n_feature, same, idx, progress);
+    size_t tile_B = (1 << 16) / (n_feature + 1);
+    tile_B = tile_B < 4 ? 4 : tile_B;
+    struct Compare sup;
+    sup.val = -1.;
+    sup.index = 0;
+    #pragma omp parallel for reduction(maximum:sup) schedule(dynamic)
+    for (size_t i = 0; i < nA; ++i) {
+        if (progress_cancelled(progress)) continue;
+        for (size_t jB = same ? i + 1 : 0; jB < nB; jB += tile_B) {
+            size_t jB_end = jB + tile_B < nB ? jB + tile_B : nB;
+            for (size_t j = jB; j < jB_end; ++j) {
+                float d = metric_distance(metric, XA + i * n_feature, auxA[i], YA + i * n_target, XB + j * n_feature, auxB[j], YB + j * n_target, n_feature, n_target, scale_x, scale_y);
+                if (d > sup.val) {
+                    sup.val = d;
+                    sup.index = i * nB + j;
+                }
+            }
+        }
+    }
+    idx[0] = sup.index / nB;
+    idx[1] = sup.index % nB;
+    return sup.val;
+}
+
+struct ActiveCompare kennard_stone_mem_active_update(float* X, float* t, float* x_ref, float t_ref, size_t* active, float* active_min, size_t n_active, size_t n_feature) {
+    // Same to `kennard_stone_mem_update`, on active set of unselected samples;
+    // rows of four active samples are gathered for the dot product microkernel.
+    struct ActiveCompare sup = {-1., 0, 0};
+    #pragma omp parallel for reduction(active_maximum:sup) schedule(static)
+    for (size_t kb = 0; kb < n_active; kb += 4) {
+        size_t nb = n_active - kb < 4 ? n_active - kb : 4;
+        float dots[4];
+        if (nb == 4) {
+            dot_vector_x4(x_ref, X + n_feature * active[kb], X + n_feature * active[kb + 1],
+                          X + n_feature * active[kb + 2], X + n_feature * active[kb + 3], n_feature, dots);
+        } else {
+            for (size_t k = 0; k < nb; ++k)
+                dots[k] = dot_vector(x_ref, X + n_feature * active[kb + k], n_feature);
+        }
+        for (size_t k = kb; k < kb + nb; ++k) {
+            float d2 = t_ref + t[active[k]] - 2 * dots[k - kb];
+            update_min(&active_min[k], d2 > 0 ? d2 : 0);
+            update_active_sup(&sup, active_min[k], active[k], k);
+        }
+    }
+    return sup;
+}
+
+void kennard_stone_mem_resume(float* X, float* t, size_t* result, float* v_dist, float* min_vals, bool* selected, size_t n_sample, size_t n_feature, size_t n_start, size_t n_result, struct Progress* progress) {
+    // Continue sampling from `n_start` samples already selected in `result`,
+    // with their minimum squared distances `min_vals` and selection flags `selected`.
+    // Iterations only walk the active set of unselected samples.
+    double t_main = progress_start(progress, PHASE_MAIN);
+    if (n_start >= n_result) {
+        progress_update(progress, n_start, 0.);
+        progress_stop(progress, PHASE_MAIN, t_main);
+        progress_start(progress, PHASE_DONE);
+        return;
+    }
+    size_t* active = (size_t*)malloc(n_sample * sizeof(size_t));
+    float* active_min = (float*)malloc(n_sample * sizeof(float));
+    size_t n_active = active_gather(min_vals, selected, n_sample, active, active_min);
+    struct ActiveCompare sup = active_argmax(active_min, active, n_active);
+    size_t n = n_start;
+    for (; n < n_result; ++n) {
+        if (progress_update(progress, n, sqrtf(sup.val))) break;
+        v_dist[n - 1] = sqrtf(sup.val);
+        selected[sup.index] = true;
+        result[n] = sup.index;
+        active_remove(active, active_min, &n_active, sup.pos);
+        // Update minimum and find sup of the minimum
+        // (also after the last selection, so that `min_vals` could be resumed)
+        sup = kennard_stone_mem_active_update(X, t, X + sup.index * n_feature, t[sup.index], active, active_min, n_active, n_feature);
+    }
+    progress_update(progress, n, sqrtf(sup.val));
+    progress_stop(progress, PHASE_MAIN, t_main);
+    progress_start(progress, PHASE_DONE);
+    active_scatter(min_vals, active, active_min, n_active);
+    free(active);
+    free(active_min);
+}
+
+void kennard_stone_mem_batch_update(float* X, float* t, float* X_ref, float* t_ref, size_t* query, float* min_vals, bool* selected, size_t n_sample, size_t ld, size_t n_feature, size_t n_ref, float* sup_val, size_t* sup_index) {
+    // Batched `kennard_stone_mem_update` of several selection queries in one pass over `X`.
+    // Query `query[q]` has reference sample `X_ref[q]` (squared norm `t_ref[q]`), minimum
+    // squared distances `min_vals + query[q] * ld` and flags `selected + query[q] * ld`;
+    // samples not in the subset of a query are flagged as selected.
+    // Every row of `X` is loaded once for four references at a time.
+    for (size_t q = 0; q < n_ref; ++q) {
+        sup_val[q] = -1.;
+        sup_index[q] = 0;
+    }
+    #pragma omp parallel
+    {
+        struct Compare* sup = (struct Compare*)malloc(n_ref * sizeof(struct Compare));
+        float* dots = (float*)malloc((n_ref + 3) * sizeof(float));
+        for (size_t q = 0; q < n_ref; ++q) {
+            sup[q].val = -1.;
+            sup[q].index = 0;
+        }
+        #pragma omp for schedule(static)
+        for (size_t i = 0; i < n_sample; ++i) {
+            float* x = X + n_feature * i;
+            for (size_t q = 0; q + 4 <= n_ref; q += 4) {
+                float* p = X_ref + n_feature * q;
+                dot_vector_x4(x, p, p + n_feature, p + 2 * n_feature, p + 3 * n_feature, n_feature, dots + q);
+            }
+            for (size_t q = n_ref - n_ref % 4; q < n_ref; ++q)
+                dots[q] = dot_vector(x, X_ref + n_feature * q, n_feature);
+            for (size_t q = 0; q < n_ref; ++q) {
+                size_t offset = query[q] * ld + i;
+                if (selected[offset]) continue;
+                float d2 = t_ref[q] + t[i] - 2 * dots[q];
+                update_min(&min_vals[offset], d2 > 0 ? d2 : 0);
+                if (min_vals[offset] > sup[q].val) {
+                    sup[q].val = min_vals[offset];
+                    sup[q].index = i;
+                }
+            }
+        }
+        #pragma omp critical
+        for (size_t q = 0; q < n_ref; ++q) {
+            if (sup[q].val > sup_val[q] || (sup[q].val == sup_val[q] && sup[q].index < sup_index[q])) {
+                sup_val[q] = sup[q].val;
+                sup_index[q] = sup[q].index;
+            }
+        }
+        free(sup);
+        free(dots);
+    }
+}
+
+void kennard_stone_mem(float* X, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_feature, size_t n_seed, size_t n_result, struct Progress* progress) {
+    // 00. Assertions and Result Vector Initialization
+    double t_phase = progress_start(progress, PHASE_SEED);
+    size_t sup_index;
+    assert(n_seed != 0);           // Seed should be supplied from outer program.
+    assert(n_result <= n_sample);
+    assert(n_seed <= n_sample);
+    memcpy(result, seed, n_seed * sizeof(size_t));
+    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
+    progress_stop(progress, PHASE_SEED, t_phase);
+    t_phase = progress_start(progress, PHASE_INIT);
+    // 01. Scratch Area Initialization
+    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
+    memset(selected, false, n_sample * sizeof(bool));
+    for (size_t i = 0; i < n_seed; ++i)
+        selected[result[i]] = true;
+    float* t = (float*)malloc(n_sample * sizeof(float));
+    squared_norm_vector(X, t, n_sample, n_feature);
+    if (n_seed == 2) v_dist[0] = euclid_distance_vector(X + n_feature * seed[0], X + n_feature * seed[1], n_feature);
+    // 02. Minimum Out-of-Group Initialization (squared distances)
+    float* min_vals = (float*)malloc(n_sample * sizeof(float));
+    for (size_t i = 0; i < n_sample; ++i)
+        min_vals[i] = INFINITY;
+    for (size_t n = 0; n < n_seed; ++n)
+        kennard_stone_mem_update(X, t, X + result[n] * n_feature, t[result[n]], min_vals, selected, n_sample, n_feature, &sup_index);
+    progress_stop(progress, PHASE_INIT, t_phase);
+    // 03. Main Algorithm
+    kennard_stone_mem_resume(X, t, result, v_dist, min_vals, selected, n_sample, n_feature, n_seed, n_result, progress);
+    free(selected);
+    free(min_vals);
+    free(t);
+}
+
+#define PRUNE_MARGIN 1e-5f
+
+void kennard_stone_pruned(float* X, float* t, float* centers, size_t* group_ptr, float* r_center, float* radius, size_t* order, size_t* result, float* v_dist, float* min_vals, bool* selected, size_t n_sample, size_t n_feature, size_t n_group, size_t n_seed, size_t n_result, float tol, size_t* n_eval, struct Progress* progress) {
+    // Kennard-Stone sampling with samples grouped into balls; samples of group `g` are rows
+    // group_ptr[g] to group_ptr[g + 1] of `X`, with center `centers[g]` and radius `radius[g]`,
+    // and `r_center[i]` is distance of sample `i` to its center.
+    // `min_vals` are (not squared) distances. By triangle inequality, the distance from the new
+    // selected sample `s` to `i` is at least |c - s| - |c - i|, so a whole group is skipped if
+    // this bound of the group is not smaller than the largest minimum `gmax[g]` in the group,
+    // and a single sample is skipped if the bound is not smaller than its minimum.
+    // With `tol > 0`, bounds are relaxed by factor (1 + tol), so minimum distances could be
+    // overestimated by that factor (approximate sampling).
+    // `order` is original index of samples, used for ties; seeds are given in `result`.
+    // 00. Scratch Area Initialization
+    float* gmax = (float*)malloc(n_group * sizeof(float));
+    size_t* gidx = (size_t*)malloc(n_group * sizeof(size_t));
+    for (size_t g = 0; g < n_group; ++g) {
+        gmax[g] = INFINITY;
+        gidx[g] = group_ptr[g];
+    }
+    for (size_t i = 0; i < n_sample; ++i) {
+        min_vals[i] = INFINITY;
+        selected[i] = false;
+    }
+    for (size_t n = 0; n < n_seed; ++n)
+        selected[result[n]] = true;
+    size_t count = 0;
+    size_t n_done = n_result;
+    float sup_val = 0.;
+    // 01. Main Algorithm
+    double t_main = progress_start(progress, PHASE_MAIN);
+    for (size_t n = 0; n < n_result; ++n) {
+        if (n >= n_seed) {
+            // Find sup of the minimum by group maxima
+            struct Compare sup;
+            sup.val = -1.;
+            sup.index = 0;
+            for (size_t g = 0; g < n_group; ++g) {
+                if (group_ptr[g] == group_ptr[g + 1]) continue;  // empty group (duplicate centers)
+                if (gmax[g] > sup.val || (gmax[g] == sup.val && order[gidx[g]] < order[sup.index])) {
+                    sup.val = gmax[g];
+                    sup.index = gidx[g];
+                }
+            }
+            sup_val = sup.val;
+            if (progress_update(progress, n, sup_val)) {
+                n_done = n;
+                break;
+            }
+            v_dist[n - 1] = sup.val;
+            selected[sup.index] = true;
+            result[n] = sup.index;
+        }
+        if (n + 1 == n_result) break;
+        // Update minimum of groups that could be changed by sample `s`
+        size_t s = result[n];
+        float* x_s = X + s * n_feature;
+        #pragma omp parallel for schedule(dynamic) reduction(+:count)
+        for (size_t g = 0; g < n_group; ++g) {
+            size_t i0 = group_ptr[g], i1 = group_ptr[g + 1];
+            if (i0 == i1) continue;
+            float d_cs = euclid_distance_vector(centers + g * n_feature, x_s, n_feature);
+            bool own = i0 <= s && s < i1;
+            if (!own && (d_cs - radius[g]) * (1 + tol) >= gmax[g] * (1 + PRUNE_MARGIN)) continue;
+            float m = -1.;
+            size_t mi = i0;
+            for (size_t i = i0; i < i1; ++i) {
+                if (selected[i]) continue;
+                if ((d_cs - r_center[i]) * (1 + tol) < min_vals[i] * (1 + PRUNE_MARGIN)) {
+                    float d2 = t[s] + t[i] - 2 * dot_vector(x_s, X + i * n_feature, n_feature);
+                    update_min(&min_vals[i], sqrtf(d2 > 0 ? d2 : 0));
+                    ++count;
+                }
+                if (min_vals[i] > m) {
+                    m = min_vals[i];
+                    mi = i;
+                }
+            }
+            gmax[g] = m;
+            gidx[g] = mi;
+        }
+    }
+    *n_eval = count;
+    progress_update(progress, n_done, sup_val);
+    progress_stop(progress, PHASE_MAIN, t_main);
+    progress_start(progress, PHASE_DONE);
+    free(gmax);
+    free(gidx);
+}
+
+// Element-wise distance reference implementation of `kennard_stone_mem`,
+// kept for benchmark and validation only.
+void kennard_stone_mem_naive(float* X, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_feature, size_t n_seed, size_t n_result, struct Progress* progress) {
+    // 00. Assertions and Result Vector Initialization
+    struct Compare sup;
+    if (n_seed == 2) v_dist[0] = euclid_distance_vector(X + n_feature * seed[0], X + n_feature * seed[1], n_feature);
+    assert(n_seed != 0);           // Seed should be supplied from outer program.
+    assert(n_result <= n_sample);
+    assert(n_seed <= n_sample);
+    memcpy(result, seed, n_seed * sizeof(size_t));
+    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
+    // 01. Scratch Area Initialization
+    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
+    memset(selected, false, n_sample * sizeof(bool));
+    for (size_t i = 0; i < n_seed; ++i)
+        selected[result[i]] = true;
+    // 02. Minimum Out-of-Group Initialization
+    float* min_vals = (float*)malloc(n_sample * sizeof(float));
+    #pragma omp parallel for
+    for (size_t i = 0; i < n_sample; ++i) {
+        if (selected[i]) continue;
+        min_vals[i] = euclid_distance_vector(X + n_feature * result[0], X + n_feature * i, n_feature);
+    }
+    for (size_t n = 1; n < n_seed; ++n) {
+        float* p_starting = X + result[n] * n_feature;
+    	#pragma omp parallel for
+        for (size_t i = 0; i < n_sample; ++i) {
+            if (selected[i]) continue;
+            update_min(&min_vals[i], euclid_distance_vector(p_starting, X + n_feature * i, n_feature));
+        }
+    }
+    // 03. Main Algorithm
+    for (size_t n = n_seed; n < n_result; ++n) {
+        // Find sup of the minimum
+        sup.val = -1.;
+        sup.index = 0;
+        #pragma omp parallel for reduction(maximum:sup)
+        for (size_t i = 0; i < n_sample; ++i) {
+            if (selected[i]) continue;
+            if (min_vals[i] > sup.val) {
+                sup.index = i;
+                sup.val = min_vals[i];
+            }
+        }
+        if (progress_update(progress, n, sup.val)) break;
+        v_dist[n - 1] = sup.val;
+        selected[sup.index] = true;
+        result[n] = sup.index;
+        float* p_starting = X + sup.index * n_feature;
+        #pragma omp parallel for
+        for (size_t i = 0; i < n_sample; ++i) {
+            if (selected[i]) continue;
+            update_min(&min_vals[i], euclid_distance_vector(p_starting, X + n_feature * i, n_feature));
+        }
+    }
+    free(selected);
+    free(min_vals);
+}
+
+double sparse_dot_row(int64_t* indptr, int32_t* indices, float* data, float* x_ref, size_t i) {
+    // Dot product of CSR row `i` with dense vector `x_ref` (accumulated in double)
+    double s = 0.;
+    for (int64_t k = indptr[i]; k < indptr[i + 1]; ++k)
+        s += (double)data[k] * x_ref[indices[k]];
+    return s;
+}
+
+void sparse_scatter_row(int64_t* indptr, int32_t* indices, float* data, float* x_dense, size_t i, bool clear) {
+    // Write CSR row `i` into dense vector `x_dense` of zeros, or reset these entries to zero
+    for (int64_t k = indptr[i]; k < indptr[i + 1]; ++k)
+        x_dense[indices[k]] = clear ? 0.f : data[k];
+}
+
+void squared_norm_sparse(int64_t* indptr, float* data, double* t, size_t n_sample) {
+    #pragma omp parallel for schedule(static)
+    for (size_t i = 0; i < n_sample; ++i) {
+        double s = 0.;
+        for (int64_t k = indptr[i]; k < indptr[i + 1]; ++k)
+            s += (double)data[k] * data[k];
+        t[i] = s;
+    }
+}
+
+struct ActiveCompare kennard_stone_sparse_update(int64_t* indptr, int32_t* indices, float* data, double* t, float* x_ref, double t_ref, size_t* active, float* active_min, size_t n_active) {
+    // Same to `kennard_stone_mem_active_update` for CSR samples; reference sample is
+    // scattered into dense `x_ref`, so a dot product only walks non-zeros of the sample.
+    // Norms and dot products are in double, since sparse samples are not centred.
+    struct ActiveCompare sup = {-1., 0, 0};
+    #pragma omp parallel for reduction(active_maximum:sup) schedule(guided)
+    for (size_t k = 0; k < n_active; ++k) {
+        size_t i = active[k];
+        double d2 = t_ref + t[i] - 2 * sparse_dot_row(indptr, indices, data, x_ref, i);
+        update_min(&active_min[k], d2 > 0 ? (float)d2 : 0);
+        update_active_sup(&sup, active_min[k], i, k);
+    }
+    return sup;
+}
+
+void kennard_stone_sparse_resume(int64_t* indptr, int32_t* indices, float* data, double* t, size_t* result, float* v_dist, float* min_vals, bool* selected, size_t n_sample, size_t n_feature, size_t n_start, size_t n_result, struct Progress* progress) {
+    // Same to `kennard_stone_mem_resume` for CSR samples; only one dense row of
+    // `n_feature` is allocated besides the per-sample vectors.
+    double t_main = progress_start(progress, PHASE_MAIN);
+    if (n_start >= n_result) {
+        progress_update(progress, n_start, 0.);
+        progress_stop(progress, PHASE_MAIN, t_main);
+        progress_start(progress, PHASE_DONE);
+        return;
+    }
+    size_t* active = (size_t*)malloc(n_sample * sizeof(size_t));
+    float* active_min = (float*)malloc(n_sample * sizeof(float));
+    float* x_ref = (float*)calloc(n_feature, sizeof(float));
+    size_t n_active = active_gather(min_vals, selected, n_sample, active, active_min);
+    struct ActiveCompare sup = active_argmax(active_min, active, n_active);
+    size_t n = n_start;
+    for (; n < n_result; ++n) {
+        if (progress_update(progress, n, sqrtf(sup.val))) break;
+        v_dist[n - 1] = sqrtf(sup.val);
+        selected[sup.index] = true;
+        result[n] = sup.index;
+        active_remove(active, active_min, &n_active, sup.pos);
+        size_t s = sup.index;
+        sparse_scatter_row(indptr, indices, data, x_ref, s, false);
+        sup = kennard_stone_sparse_update(indptr, indices, data, t, x_ref, t[s], active, active_min, n_active);
+        sparse_scatter_row(indptr, indices, data, x_ref, s, true);
+    }
+    progress_update(progress, n, sqrtf(sup.val));
+    progress_stop(progress, PHASE_MAIN, t_main);
+    progress_start(progress, PHASE_DONE);
+    active_scatter(min_vals, active, active_min, n_active);
+    free(active);
+    free(active_min);
+    free(x_ref);
+}
+
+float farthest_pair_sparse(int64_t* indptr, int32_t* indices, float* data, double* t, size_t n_sample, size_t n_feature, size_t* idx, struct Progress* progress) {
+    // Find the largest squared distance of CSR samples and store its location in `idx`.
+    // Every thread scatters row `i` into its own dense vector and sweeps rows j > i.
+    // Remaining rows are skipped once `progress` is cancelled.
+    struct Compare sup;
+    sup.val = -1.;
+    sup.index = 0;
+    #pragma omp parallel reduction(maximum:sup)
+    {
+        float* x_ref = (float*)calloc(n_feature, sizeof(float));
+        #pragma omp for schedule(dynamic, 16)
+        for (size_t i = 0; i < n_sample; ++i) {
+            if (progress_cancelled(progress)) continue;
+            sparse_scatter_row(indptr, indices, data, x_ref, i, false);
+            for (size_t j = i + 1; j < n_sample; ++j) {
+                double d2 = t[i] + t[j] - 2 * sparse_dot_row(indptr, indices, data, x_ref, j);
+                if ((float)d2 > sup.val) {
+                    sup.val = (float)d2;
+                    sup.index = i * n_sample + j;
+                }
+            }
+            sparse_scatter_row(indptr, indices, data, x_ref, i, true);
+        }
+        free(x_ref);
+    }
+    idx[0] = sup.index / n_sample;
+    idx[1] = sup.index % n_sample;
+    return sup.val;
+}
+
+void kennard_stone_sparse(int64_t* indptr, int32_t* indices, float* data, size_t* seed, size_t* result, float* v_dist, size_t n_sample, size_t n_feature, size_t n_seed, size_t n_result, struct Progress* progress) {
+    // Kennard-Stone sampling of CSR samples `indptr`, `indices`, `data` (Euclidean metric);
+    // memory is proportional to non-zeros and `n_sample`, and one dense row of `n_feature`.
+    // 00. Assertions, Seed Search and Result Vector Initialization
+    double t_phase = progress_start(progress, PHASE_SEED);
+    size_t seed_pair[2];
+    assert(n_result <= n_sample);
+    assert(n_seed <= n_sample);
+    double* t = (double*)malloc(n_sample * sizeof(double));
+    squared_norm_sparse(indptr, data, t, n_sample);
+    if (n_seed == 0) {
+        farthest_pair_sparse(indptr, indices, data, t, n_sample, n_feature, seed_pair, progress);
+        if (progress_cancelled(progress)) {
+            // Cancelled in seed search: nothing is selected
+            progress_update(progress, 0, 0.);
+            progress_stop(progress, PHASE_SEED, t_phase);
+            progress_start(progress, PHASE_DONE);
+            free(t);
+            return;
+        }
+        seed = seed_pair;
+        n_seed = 2;
+    }
+    memcpy(result, seed, n_seed * sizeof(size_t));
+    memset(result + n_seed, 0, (n_result - n_seed) * sizeof(size_t));
+    progress_stop(progress, PHASE_SEED, t_phase);
+    t_phase = progress_start(progress, PHASE_INIT);
+    // 01. Scratch Area Initialization
+    bool* selected = (bool*)malloc(n_sample * sizeof(bool));
+    memset(selected, false, n_sample * sizeof(bool));
+    for (size_t i = 0; i < n_seed; ++i)
+        selected[result[i]] = true;
+    float* x_ref = (float*)calloc(n_feature, sizeof(float));
+    if (n_seed == 2) {
+        sparse_scatter_row(indptr, indices, data, x_ref, seed[0], false);
+        double d2 = t[seed[0]] + t[seed[1]] - 2 * sparse_dot_row(indptr, indices, data, x_ref, seed[1]);
+        v_dist[0] = sqrtf(d2 > 0 ? (float)d2 : 0);
+        sparse_scatter_row(indptr, indices, data, x_ref, seed[0], true);
+    }
+    // 02. Minimum Out-of-Group Initialization (squared distances)
+    float* min_vals = (float*)malloc(n_sample * sizeof(float));
+    for (size_t i = 0; i < n_sample; ++i)
+        min_vals[i] = INFINITY;
+    for (size_t n = 0; n < n_seed; ++n) {
+        size_t s = result[n];
+        sparse_scatter_row(indptr, indices, data, x_ref, s, false);
+        #pragma omp parallel for schedule(guided)
+        for (size_t i = 0; i < n_sample; ++i) {
+            if (selected[i]) continue;
+            double d2 = t[s] + t[i] - 2 * sparse_dot_row(indptr, indices, data, x_ref, i);
+            update_min(&min_vals[i], d2 > 0 ? (float)d2 : 0);
+        }
+        sparse_scatter_row(indptr, indices, data, x_ref, s, true);
+    }
+    free(x_ref);
+    progress_stop(progress, PHASE_INIT, t_phase);
+    // 03. Main Algorithm
+    kennard_stone_sparse_resume(indptr, indices, data, t, result, v_dist, min_vals, selected, n_sample, n_feature, n_seed, n_result, progress);
+    free(selected);
+    free(min_vals);
+    free(t);
+}
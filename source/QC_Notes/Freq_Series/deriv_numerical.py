@@ -1,24 +1,488 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import itertools
+import functools
+import inspect
+import enum
+import warnings
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from pyscf import gto, lib
 
 
+_worker_func = None
+
+
+def _worker_init(func, n_thread):
+    global _worker_func
+    _worker_func = func
+    if n_thread is not None:
+        os.environ["OMP_NUM_THREADS"] = str(n_thread)
+        lib.num_threads(n_thread)
+
+
+def _worker_call(args):
+    return _worker_func(*args)
+
+
+def _code_tag(code):
+    consts = [_code_tag(c) if hasattr(c, "co_code") else c for c in code.co_consts]
+    return code.co_code, code.co_names, consts
+
+
+# Attributes of library objects which only direct output, left out of tags:
+# PySCF `stdout`, and `chkfile` (a new temporary file for every object)
+_OUTPUT_ATTRS = ("stdout", "chkfile")
+
+
+def _value_tag(value, module, seen):
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic, enum.Enum)):
+        return repr(value)
+    if isinstance(value, gto.Mole):
+        return mol_tag(value)
+    if isinstance(value, np.ndarray):
+        return "ndarray", value.dtype.str, value.shape, hashlib.sha256(np.ascontiguousarray(value)).hexdigest()
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__, [_value_tag(v, module, seen) for v in value]
+    if isinstance(value, dict):
+        return "dict", [(repr(k), _value_tag(v, module, seen)) for k, v in value.items()]
+    if isinstance(value, (set, frozenset)):
+        return type(value).__name__, sorted(repr(_value_tag(v, module, seen)) for v in value)
+    if inspect.ismodule(value):
+        return "module", value.__name__
+    if isinstance(value, type):
+        return "type", value.__module__, value.__qualname__
+    if isinstance(value, functools.partial):
+        return func_tag(value, seen)
+    if inspect.isroutine(value) and getattr(value, "__module__", None) not in (None, module):
+        # library functions are identified by name, not followed into their globals
+        if inspect.ismethod(value):
+            return "method", value.__module__, value.__qualname__, _value_tag(value.__self__, module, seen)
+        return "callable", value.__module__, value.__qualname__
+    if inspect.isroutine(value) or (callable(value) and type(value).__module__ == module):
+        return func_tag(value, seen)
+    return _object_tag(value, module, seen)
+
+
+def _object_tag(value, module, seen):
+    # Other objects by their instance state, or pickled bytes; for objects of library classes
+    # (e.g. a PySCF method template), private attributes (caches) and `_OUTPUT_ATTRS` are left out
+    cls = type(value)
+    if id(value) in seen:
+        return "recursive", cls.__module__, cls.__qualname__
+    seen.add(id(value))
+    if hasattr(value, "__dict__"):
+        library = cls.__module__ != module
+        state = [(name, _value_tag(v, module, seen)) for name, v in sorted(vars(value).items())
+                 if not (library and (name.startswith("_") or name in _OUTPUT_ATTRS))]
+        return "object", cls.__module__, cls.__qualname__, state
+    try:
+        return "pickle", cls.__module__, cls.__qualname__, hashlib.sha256(pickle.dumps(value)).hexdigest()
+    except (pickle.PicklingError, AttributeError, TypeError):
+        raise ValueError("Object of " + cls.__module__ + "." + cls.__qualname__ + " could not be tagged "
+                         "for the result cache; pass `cache_tag` to identify the method.")
+
+
+def func_tag(func, _seen=None):
+    """
+    Default tag of a function in keys of the result cache, from its name, bytecode,
+    constants, and the values of its closure variables and referenced globals;
+    for ``functools.partial``, also its arguments, and for bound methods and
+    callable instances, the attributes of the instance.
+
+    Functions of other modules referenced by `func` are tagged by name only.
+    Other objects are tagged by their instance attributes (for objects of
+    other modules, such as PySCF method templates, without private attributes
+    and output settings ``stdout`` and ``chkfile``), or by their pickled bytes;
+    `ValueError` is raised for objects which could not be tagged either way.
+    Pass `cache_tag` to generators in that case, or if these tags do not
+    identify the method.
+    """
+    seen = set() if _seen is None else _seen
+    if id(func) in seen:
+        return "recursive", getattr(func, "__qualname__", type(func).__qualname__)
+    seen.add(id(func))
+    module = getattr(func, "__module__", None)
+    if isinstance(func, functools.partial):
+        return repr(("partial", func_tag(func.func, seen), _value_tag(func.args, module, seen),
+                     _value_tag(func.keywords, module, seen)))
+    if inspect.ismethod(func):
+        return repr(("method", func_tag(func.__func__, seen), _value_tag(func.__self__, module, seen)))
+    if not inspect.isfunction(func):
+        call = getattr(type(func), "__call__", None)
+        state = vars(func) if hasattr(func, "__dict__") else {}
+        call_tag = func_tag(call, seen) if inspect.isfunction(call) else None
+        return repr(("instance", type(func).__module__, type(func).__qualname__, call_tag,
+                     _value_tag(state, module, seen)))
+    code = func.__code__
+    cells = []
+    for cell in func.__closure__ or ():
+        try:
+            cells.append(_value_tag(cell.cell_contents, module, seen))
+        except ValueError:  # cell of a variable not assigned yet
+            cells.append(None)
+    names = sorted(set(code.co_names).intersection(func.__globals__))
+    global_vars = [(name, _value_tag(func.__globals__[name], module, seen)) for name in names]
+    return repr((func.__qualname__, _code_tag(code), cells, global_vars, _value_tag(func.__defaults__, module, seen),
+                 _value_tag(func.__kwdefaults__, module, seen)))
+
+
+def mol_tag(mol):
+    """
+    Tag of a molecule in keys of the result cache: geometry (Bohr, rounded
+    to 1e-10), atoms, basis, ECP, charge and spin.
+    """
+    atoms = [(mol.atom_symbol(A), "{:.10f} {:.10f} {:.10f}".format(*coord))
+             for A, coord in enumerate(mol.atom_coords())]
+    return repr((atoms, mol._basis, mol._ecp, mol.charge, mol.spin, mol.cart))
+
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".pkl")
+
+
+def _cache_save(cache_dir, key, value):
+    # Atomic, so that concurrent jobs sharing `cache_dir` never read partial files
+    fd, tmp = tempfile.mkstemp(suffix=".pkl", dir=cache_dir)
+    with os.fdopen(fd, "wb") as file:
+        pickle.dump(value, file)
+    os.replace(tmp, _cache_path(cache_dir, key))
+
+
+def run_displaced(func, tasks, objects, n_proc=None, n_thread=None, cost=None, mp_context=None,
+                  cache_dir=None, cache_key=None):
+    """
+    Evaluate independent displaced calculations and collect results into `objects`.
+
+    Parameters
+    ----------
+    func : callable
+        Called as ``func(*args)`` for every task.
+    tasks : list of (tuple, tuple)
+        Every task is ``(index, args)``; the result of ``func(*args)`` is
+        stored in ``objects[index]``.
+    objects : np.ndarray
+        Object array receiving the results.
+    n_proc : int or None
+        Number of worker processes. If `None` or 1, tasks run serially in
+        this process, in the order given.
+    n_thread : int or None
+        OpenMP threads of every task (``lib.num_threads``). If `None`, the
+        current setting is kept.
+    cost : callable or None
+        Estimated cost of a task, called as ``cost(*args)``. Tasks are
+        dispatched to the pool from the largest cost to the smallest, so
+        long calculations do not remain at the tail of the job.
+    mp_context : str or None
+        Start method of worker processes. If `None`, "spawn" is used, since
+        the OpenMP runtime of PySCF is not safe to fork; `func` is then
+        pickled to workers and should be a module-level function (or
+        ``functools.partial`` of one). If `func` cannot be pickled (a lambda
+        or closure, e.g. defined in a notebook), "fork" is used instead with
+        a warning, where the platform supports it. "fork" avoids pickling
+        `func` where the OpenMP runtime allows it.
+    cache_dir : str or None
+        Directory of on-disk result cache. Every result is pickled to its own
+        file as soon as the task finishes; tasks with cached results are not
+        evaluated again, so an interrupted job restarts where it stopped, and
+        jobs sharing the directory share identical displacements.
+    cache_key : callable or None
+        Key string of a task in the cache, called as ``cache_key(*args)``.
+        Required with `cache_dir`.
+    """
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        keys = {index: cache_key(*args) for index, args in tasks}
+        todo = []
+        for index, args in tasks:
+            if os.path.isfile(_cache_path(cache_dir, keys[index])):
+                with open(_cache_path(cache_dir, keys[index]), "rb") as file:
+                    objects[index] = pickle.load(file)
+            else:
+                todo.append((index, args))
+        tasks = todo
+
+    def done(index, value):
+        objects[index] = value
+        if cache_dir is not None:
+            _cache_save(cache_dir, keys[index], value)
+
+    if n_proc is None or n_proc == 1:
+        n_thread_old = lib.num_threads()
+        if n_thread is not None:
+            lib.num_threads(n_thread)
+        try:
+            for index, args in tasks:
+                done(index, func(*args))
+        finally:
+            lib.num_threads(n_thread_old)
+        return objects
+    if cost is not None:
+        tasks = sorted(tasks, key=lambda task: -cost(*task[1]))
+    if mp_context is None:
+        mp_context = "spawn" if _picklable(func) else _fork_context()  # OpenMP runtime is not safe to fork
+    with ProcessPoolExecutor(max_workers=n_proc, mp_context=mp.get_context(mp_context),
+                             initializer=_worker_init, initargs=(func, n_thread)) as executor:
+        # Executor dispatches in submission order, which is largest-cost-first
+        futures = {executor.submit(_worker_call, args): index for index, args in tasks}
+        for future in as_completed(futures):
+            done(futures[future], future.result())
+    return objects
+
+
+def _picklable(func):
+    try:
+        pickle.dumps(func)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def _fork_context():
+    # Start method for `func` which cannot be pickled to spawned workers
+    if "fork" not in mp.get_all_start_methods():
+        raise ValueError("`func` cannot be pickled to spawned workers, and fork is not available; "
+                         "use a module-level function (or `functools.partial` of one), or `n_proc=1`.")
+    warnings.warn("`func` cannot be pickled to spawned workers, so workers are forked; "
+                  "the OpenMP runtime may not be safe to fork.", RuntimeWarning, stacklevel=3)
+    return "fork"
+
+
+def _symm_perm(R, coords, species, tol):
+    # Atom permutation `perm` with R @ coords[A] = coords[perm[A]], or None
+    moved = coords @ R.T
+    perm = np.full(len(coords), -1)
+    for A in range(len(coords)):
+        dist = np.linalg.norm(coords - moved[A], axis=-1)
+        dist[species != species[A]] = np.inf
+        B = int(np.argmin(dist))
+        if dist[B] > tol:
+            return None
+        perm[A] = B
+    if len(set(perm)) != len(perm):
+        return None
+    return perm
+
+
+def detect_symm_ops(mol, tol=1e-5):
+    """
+    Point group operations of a molecule, as rotations about the centroid of atoms.
+
+    Parameters
+    ----------
+    mol : pyscf.gto.Mole
+    tol : float
+        Tolerance (Bohr) of atom positions after an operation.
+
+    Returns
+    -------
+    ops : list of (np.ndarray, np.ndarray)
+        Every operation is ``(R, perm)``, where ``R`` is an orthogonal (3, 3)
+        matrix (improper if ``det(R) = -1``) and atom ``A`` is moved to atom
+        ``perm[A]``. Identity is the first operation. For linear molecules and
+        atoms, only the subgroup of D4h (Oh for atoms) aligned to molecular
+        axis is returned.
+
+    Notes
+    -----
+    Origin-dependent properties, such as dipole of charged molecules, are
+    transformed correctly only if their origin is the centroid of atoms.
+    """
+    coords = mol.atom_coords()
+    coords = coords - coords.mean(axis=0)
+    species = np.array([mol.atom_symbol(A) for A in range(mol.natm)])
+    norms = np.linalg.norm(coords, axis=-1)
+    a = int(np.argmax(norms))
+    cross = np.linalg.norm(np.cross(coords[a], coords), axis=-1)
+    b = int(np.argmax(cross))
+    candidates = []
+    if norms[a] > tol and cross[b] > tol * norms[a]:
+        # Operation is determined by images of two non-collinear atoms
+        frame = np.array([coords[a], coords[b], np.cross(coords[a], coords[b])]).T
+        for a_ in np.where((species == species[a]) & (abs(norms - norms[a]) < tol))[0]:
+            for b_ in np.where((species == species[b]) & (abs(norms - norms[b]) < tol))[0]:
+                if abs(coords[a_] @ coords[b_] - coords[a] @ coords[b]) > tol * (norms[a] + norms[b]) or a_ == b_:
+                    continue
+                for det in (1, -1):
+                    frame_ = np.array([coords[a_], coords[b_], det * np.cross(coords[a_], coords[b_])]).T
+                    candidates.append(frame_ @ np.linalg.inv(frame))
+    else:
+        # Linear molecule or atom: signed permutations of axes in a frame along molecular axis
+        e = coords[a] / norms[a] if norms[a] > tol else np.array([0., 0., 1.])
+        u = np.cross(e, np.eye(3)[np.argmin(abs(e))])
+        u /= np.linalg.norm(u)
+        frame = np.array([e, u, np.cross(e, u)]).T
+        for p in itertools.permutations(range(3)):
+            for signs in itertools.product((1, -1), repeat=3):
+                S = np.zeros((3, 3))
+                S[p, range(3)] = signs
+                candidates.append(frame @ S @ frame.T)
+    ops = []
+    for R in candidates:
+        U, _, Vt = np.linalg.svd(R)
+        R = U @ Vt
+        perm = _symm_perm(R, coords, species, tol)
+        if perm is not None and not any(np.allclose(R, R_) for R_, _ in ops):
+            ops.append((R, perm))
+    ops.sort(key=lambda op: not np.allclose(op[0], np.eye(3)))
+    return ops
+
+
+def symm_unique_displacements(ops, natm):
+    """
+    Symmetry-unique nuclear displacements.
+
+    For every set of symmetry-equivalent atoms, the first atom is displaced
+    along the least Cartesian axes, whose images under the operations
+    keeping this atom in place span the 3-D space.
+
+    Parameters
+    ----------
+    ops : list of (np.ndarray, np.ndarray)
+        Symmetry operations, see `detect_symm_ops`.
+    natm : int
+
+    Returns
+    -------
+    unique : list of (tuple of int)
+        List of ``(A, t)``, atom index and coordinate index.
+    """
+    unique = []
+    covered = np.zeros(natm, dtype=bool)
+    for A in range(natm):
+        if covered[A]:
+            continue
+        for _, perm in ops:
+            covered[perm[A]] = True
+        stab = [R for R, perm in ops if perm[A] == A]
+        directions = np.zeros((0, 3))
+        for t in range(3):
+            images = np.concatenate([directions] + [R[:, t][None, :] for R in stab])
+            if np.linalg.matrix_rank(images, tol=1e-8) > np.linalg.matrix_rank(directions, tol=1e-8):
+                unique.append((A, t))
+                directions = images
+    return unique
+
+
+def symm_transform(prop, R, perm, prop_axes):
+    """
+    Apply a symmetry operation to a property.
+
+    Parameters
+    ----------
+    prop : np.ndarray
+    R, perm : np.ndarray
+        Symmetry operation, see `detect_symm_ops`.
+    prop_axes : tuple of str
+        Kind of every axis of ``prop``: "xyz" for Cartesian components,
+        "atom" for atoms, or "atom-xyz" for flattened (atom, Cartesian)
+        components, such as rows of Hessian. Scalars have ``()``.
+
+    Returns
+    -------
+    prop_ret : np.ndarray
+    """
+    prop = np.asarray(prop)
+    assert len(prop_axes) == prop.ndim
+    natm = len(perm)
+    shape = prop.shape
+    kinds = []
+    for kind in prop_axes:
+        kinds += ["atom", "xyz"] if kind == "atom-xyz" else [kind]
+    prop = prop.reshape([d for kind, n in zip(prop_axes, shape)
+                         for d in ((natm, 3) if kind == "atom-xyz" else (n, ))])
+    perm_inv = np.argsort(perm)
+    for i, kind in enumerate(kinds):
+        if kind == "xyz":
+            prop = np.moveaxis(np.tensordot(R, prop, axes=(1, i)), 0, i)
+        elif kind == "atom":
+            prop = np.take(prop, perm_inv, axis=i)
+        else:
+            raise ValueError("Unknown kind of property axis: {:}".format(kind))
+    return prop.reshape(shape)
+
+
+def symm_reconstruct(deriv, unique, ops, prop_axes):
+    """
+    Full derivatives with respect to nuclear coordinates from symmetry-unique ones.
+
+    If ``g`` moves atom ``A`` to ``perm[A]`` by ``R``, displacement of atom
+    ``A`` along axis ``t`` is moved to displacement of atom ``perm[A]`` along
+    ``R[:, t]``, and the property is transformed by ``g``. Derivatives of
+    every atom are the least square solution of all these relations.
+
+    Parameters
+    ----------
+    deriv : dict
+        Derivatives ``deriv[(A, t)]`` of property of every unique displacement.
+    unique : list of (tuple of int)
+        Unique displacements, see `symm_unique_displacements`.
+    ops : list of (np.ndarray, np.ndarray)
+        Symmetry operations, see `detect_symm_ops`.
+    prop_axes : tuple of str
+        See `symm_transform`.
+
+    Returns
+    -------
+    deriv_full : np.ndarray, shape (natm * 3, *prop.shape)
+    """
+    natm = len(ops[0][1])
+    shape = np.asarray(deriv[unique[0]]).shape
+    lhs = np.zeros((natm, 3, 3))
+    rhs = np.zeros((natm, 3) + shape, dtype=np.result_type(float, *deriv.values()))
+    for A, t in unique:
+        for R, perm in ops:
+            B = perm[A]
+            lhs[B] += np.outer(R[:, t], R[:, t])
+            rhs[B] += np.multiply.outer(R[:, t], symm_transform(deriv[(A, t)], R, perm, prop_axes))
+    deriv_full = np.array([np.tensordot(np.linalg.inv(lhs[B]), rhs[B], axes=(1, 0)) for B in range(natm)])
+    return deriv_full.reshape((natm * 3, ) + shape)
+
+
 class AbstractDerivGenerator:
 
     def __init__(self):
         self.objects = NotImplemented  # type: np.ndarray
         self.stencil = NotImplemented  # type: int
         self.interval = NotImplemented  # type: float
+        # symmetry operations and unique displacements, see `detect_symm_ops`
+        self.symm_ops = None  # type: list
+        self.symm_unique = None  # type: list
 
 
 class NucCoordDerivGenerator(AbstractDerivGenerator):
 
-    def __init__(self, mol, mf_func, stencil=3, interval=3e-4):
+    def __init__(self, mol, mf_func, stencil=3, interval=3e-4,
+                 n_proc=None, n_thread=None, cost=None, mp_context=None,
+                 symmetry=False, symm_tol=1e-5, cache_dir=None, cache_tag=None):
         super(NucCoordDerivGenerator, self).__init__()
         self.mol = mol
         self.mf_func = mf_func
         self.objects = None
         self.stencil = stencil
         self.interval = interval / lib.param.BOHR
+        # parallel execution of displacements, see `run_displaced`;
+        # `mf_func` must be picklable unless `mp_context` is "fork"
+        # `cost` is called with displaced molecule
+        self.n_proc = n_proc
+        self.n_thread = n_thread
+        self.cost = cost
+        self.mp_context = mp_context
+        # on-disk result cache, keyed by displaced molecule and `cache_tag`;
+        # `cache_tag` identifies the method, and defaults to `func_tag(mf_func)`
+        self.cache_dir = cache_dir
+        self.cache_tag = cache_tag
+        if cache_dir is not None and cache_tag is None:
+            self.cache_tag = func_tag(mf_func)
+        # only symmetry-unique displacements are performed, and other entries
+        # of `objects` are left as None; derivatives are reconstructed by
+        # `NumericDiff` with `prop_axes`
+        if symmetry:
+            self.symm_ops = detect_symm_ops(mol, symm_tol)
+            self.symm_unique = symm_unique_displacements(self.symm_ops, mol.natm)
         self.init_objects()
         self.perform_mf()
 
@@ -27,6 +491,9 @@ class NucCoordDerivGenerator(AbstractDerivGenerator):
         dim = natm * 3
         self.objects = np.empty((dim, self.stencil - 1), dtype=object)
 
+    def cache_key(self, mol):
+        return repr((self.cache_tag, mol_tag(mol)))
+
     def move_mol(self, movelist):
         """
         Make a temporary molecule, which is moved away from the original molecule
@@ -58,22 +525,32 @@ class NucCoordDerivGenerator(AbstractDerivGenerator):
                     for A in range(natm)
                     for t in range(3)
                     for h in range(self.stencil - 1)]
+        if self.symm_unique is not None:
+            looplist = [(A, t, h) for A, t, h in looplist if (A, t) in self.symm_unique]
         if self.stencil == 5:
             dev_h = [-2, -1, 1, 2]
         else:
             dev_h = [-1, 1]
-        for A, t, h in looplist:
-            movelist = [(A, t, dev_h[h])]
-            self.objects[3 * A + t, h] = self.mf_func(self.move_mol(movelist))
+        tasks = [((3 * A + t, h), (self.move_mol([(A, t, dev_h[h])]), ))
+                 for A, t, h in looplist]
+        run_displaced(self.mf_func, tasks, self.objects, self.n_proc, self.n_thread, self.cost, self.mp_context,
+                      self.cache_dir, self.cache_key)
 
 
 class NumericDiff(AbstractDerivGenerator):
 
-    def __init__(self, scanner: AbstractDerivGenerator, num_method=None):
+    def __init__(self, scanner: AbstractDerivGenerator, num_method=None, prop_axes=None):
         super(NumericDiff, self).__init__()
         self.interval = scanner.interval
         self.stencil = scanner.stencil
         self.objects = scanner.objects
+        self.symm_ops = scanner.symm_ops
+        self.symm_unique = scanner.symm_unique
+        # kind of every axis of `num_method` result, see `symm_transform`;
+        # required if scanner only performed symmetry-unique displacements
+        self.prop_axes = prop_axes
+        if self.symm_unique is not None and prop_axes is None:
+            raise ValueError("prop_axes should be given for symmetry-reduced displacements.")
         self.num_method = num_method
         if self.num_method is None:
             self.num_method = lambda x: x
@@ -85,29 +562,56 @@ class NumericDiff(AbstractDerivGenerator):
         if self._derivative is not NotImplemented:
             return self._derivative
         # self.num_matrix = np.vectorize(self.num_method)(self.objects)
+        rows = range(self.objects.shape[0])
+        if self.symm_unique is not None:
+            rows = [3 * A + t for A, t in self.symm_unique]
         self.num_matrix = np.empty_like(self.objects, dtype=object)
-        for i in range(self.num_matrix.shape[0]):
+        for i in rows:
             for j in range(self.num_matrix.shape[1]):
                 self.num_matrix[i, j] = self.num_method(self.objects[i, j])
         self._derivative = []
-        for matrices in self.num_matrix:
+        for i in rows:
+            matrices = self.num_matrix[i]
             if self.stencil == 3:
                 self._derivative.append((matrices[1] - matrices[0]) / (2 * self.interval))
             elif self.stencil == 5:
                 self._derivative.append((matrices[0] - 8 * matrices[1] + 8 * matrices[2] - matrices[3])
                                         / (12 * self.interval))
+        if self.symm_unique is not None:
+            deriv = dict(zip(self.symm_unique, self._derivative))
+            self._derivative = symm_reconstruct(deriv, self.symm_unique, self.symm_ops, self.prop_axes)
         self._derivative = np.array(self._derivative)
         return self._derivative
 
 
 class DipoleDerivGenerator(AbstractDerivGenerator):
 
-    def __init__(self, mf_func, stencil=3, interval=1e-6):
+    def __init__(self, mf_func, stencil=3, interval=1e-6,
+                 n_proc=None, n_thread=None, cost=None, mp_context=None, cache_dir=None, cache_tag=None,
+                 mol=None):
         super(DipoleDerivGenerator, self).__init__()
         self.mf_func = mf_func
         self.objects = NotImplemented
         self.stencil = stencil
         self.interval = interval
+        # parallel execution of displacements, see `run_displaced`;
+        # `mf_func` must be picklable unless `mp_context` is "fork"
+        # `cost` is called with (t, field), same to `mf_func`
+        self.n_proc = n_proc
+        self.n_thread = n_thread
+        self.cost = cost
+        self.mp_context = mp_context
+        # on-disk result cache, keyed by `mol`, (t, field) and `cache_tag`;
+        # `mol` is the molecule of `mf_func` and required with `cache_dir`;
+        # `cache_tag` identifies the method, and defaults to `func_tag(mf_func)`
+        self.mol = mol
+        self.cache_dir = cache_dir
+        self.cache_tag = cache_tag
+        if cache_dir is not None:
+            if mol is None:
+                raise ValueError("mol should be given with cache_dir, as cache keys include the molecule.")
+            if cache_tag is None:
+                self.cache_tag = func_tag(mf_func)
         self.init_objects()
         self.mf_func = mf_func
         self.perform_mf()
@@ -115,6 +619,9 @@ class DipoleDerivGenerator(AbstractDerivGenerator):
     def init_objects(self):
         self.objects = np.empty((3, self.stencil - 1), dtype=object)
 
+    def cache_key(self, t, field):
+        return repr((self.cache_tag, mol_tag(self.mol), t, "{:+.17e}".format(field)))
+
     def perform_mf(self):
         looplist = [(t, h)
                     for t in range(3)
@@ -123,5 +630,6 @@ class DipoleDerivGenerator(AbstractDerivGenerator):
             dev_h = [-2, -1, 1, 2]
         else:
             dev_h = [-1, 1]
-        for t, h in looplist:
-            self.objects[t, h] = self.mf_func(t, dev_h[h] * self.interval)
+        tasks = [((t, h), (t, dev_h[h] * self.interval)) for t, h in looplist]
+        run_displaced(self.mf_func, tasks, self.objects, self.n_proc, self.n_thread, self.cost, self.mp_context,
+                      self.cache_dir, self.cache_key)
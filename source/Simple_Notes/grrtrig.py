@@ -1,8 +1,70 @@
+import asyncio
+import functools
+import inspect
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 import findiff
 import pandas as pd
 
 
+@functools.lru_cache(maxsize=4096)
+def _fornberg_weights(offsets, max_deriv):
+    # Fornberg's recursion; row m of result are weights of m-th derivative at 0
+    n = len(offsets)
+    weights = np.zeros((max_deriv + 1, n))
+    weights[0, 0] = 1.
+    c1 = 1.
+    for i in range(1, n):
+        c2 = 1.
+        mn = min(i, max_deriv)
+        for j in range(i):
+            c3 = offsets[i] - offsets[j]
+            c2 *= c3
+            if j == i - 1:
+                for m in range(mn, 0, -1):
+                    weights[m, i] = c1 * (m * weights[m - 1, i - 1] - offsets[i - 1] * weights[m, i - 1]) / c2
+                weights[0, i] = -c1 * offsets[i - 1] * weights[0, i - 1] / c2
+            for m in range(mn, 0, -1):
+                weights[m, j] = (offsets[i] * weights[m, j] - m * weights[m - 1, j]) / c3
+            weights[0, j] = offsets[i] * weights[0, j] / c3
+        c1 = c2
+    weights.flags.writeable = False
+    return weights
+
+
+def fornberg_weights(offsets, max_deriv=None):
+    """
+    Finite Difference Coefficients of All Derivative Orders by Fornberg's Algorithm
+    
+    Parameters
+    ----------
+    offsets : array_like
+    max_deriv : int or None
+        Largest derivative order. If None, ``len(offsets) - 1`` is used.
+    
+    Returns
+    -------
+    weights : ndarray
+        Read-only array of shape ``(max_deriv + 1, len(offsets))``; row ``m``
+        are coefficients of ``m``-th derivative at zero.
+    
+    Notes
+    -----
+    Results are cached (LRU) by offsets and order, so repeated stencils of GRR
+    triangles are computed only once. The recursion costs O(n² max_deriv) and
+    does not solve the ill-conditioned Vandermonde system.
+    
+    References
+    ----------
+    Fornberg, B. Math. Comput. 1988, 51 (184), 699-706.
+    """
+    offsets = tuple(float(o) for o in np.asarray(offsets).ravel())
+    max_deriv = len(offsets) - 1 if max_deriv is None else max_deriv
+    return _fornberg_weights(offsets, max_deriv)
+
+
 def calculate_findiff_coefs(offsets, deriv):
     """
     Calculate Finite Difference Coefficients
@@ -24,6 +86,10 @@ def calculate_findiff_coefs(offsets, deriv):
     >>> calculate_findiff_coefs([-2, -1, 0, 1, 2, 1.99], 3)
     array([  -0.1867,   -0.6722,    3.7688,   -6.0505, -124.5   ,  127.6406])
     
+    Notes
+    -----
+    Coefficients of all orders are evaluated by `fornberg_weights' and cached.
+    
     References
     ----------
     https://web.media.mit.edu/~crtaylor/calculator.html
@@ -36,12 +102,7 @@ def calculate_findiff_coefs(offsets, deriv):
         # Note that this program could not handle pathological cases, only make simple check instead.
         raise ValueError("Possibly exactly same offset value is given. Please check `offsets'.")
     
-    offsets = np.asarray(offsets)
-    matrix = np.array([offsets**n for n in range(len(offsets))])
-    rhs = np.zeros(len(offsets))
-    rhs[deriv] = np.math.factorial(deriv)
-    
-    return np.linalg.solve(matrix, rhs)
+    return fornberg_weights(offsets)[deriv].copy()
 
 
 def calculate_GRR_trig(offsets_half, deriv, fx_pos, fx_neg, f0=None):
@@ -57,16 +118,17 @@ def calculate_GRR_trig(offsets_half, deriv, fx_pos, fx_neg, f0=None):
         Do not contain zero in this array.
     deriv : int
     fx_pos : array_like
-        Value list of f(offsets_half). Dimension should be the same to `offsets_half'.
+        Value list of f(offsets_half). First dimension should be the same to `offsets_half';
+            values could be tensors of shape `value_shape', i.e. shape `(n_offsets, *value_shape)'.
     fx_neg : array_like
-        Value list of f(-offsets_half). Dimension should be the same to `offsets_half'.
-    f0 : float or None
-        Value of f(0). May leave as None if derivative order is odd number.
+        Value list of f(-offsets_half). Shape should be the same to `fx_pos'.
+    f0 : float or array_like or None
+        Value of f(0), of shape `value_shape'. May leave as None if derivative order is odd number.
     
     Returns
     -------
     grr_trig : ndarray
-        (Generalized) Rutishauser–Romberg triangle.
+        (Generalized) Rutishauser–Romberg triangle, of shape `(m, m, *value_shape)'.
     """
     
     if deriv % 2 == 0 and f0 is None:
@@ -76,28 +138,38 @@ def calculate_GRR_trig(offsets_half, deriv, fx_pos, fx_neg, f0=None):
     if len(offsets_half) < 2:
         raise ValueError("length of `offsets_half' must >= 2 in order to calculate ratio.")
 
+    offsets_half = np.asarray(offsets_half)
+    fx_pos, fx_neg = np.asarray(fx_pos, dtype=float), np.asarray(fx_neg, dtype=float)
+    value_shape = fx_pos.shape[1:]
     comp_len = (deriv + 1) // 2
     mat_size = len(offsets_half) - comp_len
-    grr_trig = np.zeros((mat_size, mat_size))
+    grr_trig = np.zeros((mat_size, mat_size) + value_shape)
     ratio = offsets_half[-1] / offsets_half[-2]
     
+    # first column: coefficient matrices of positive and negative offsets, and of zero
+    coef_pos = np.zeros((mat_size, len(offsets_half)))
+    coef_neg = np.zeros((mat_size, len(offsets_half)))
+    coef_0 = np.zeros(mat_size)
     for r in range(mat_size):
         i_end = r + comp_len
         offsets = np.concatenate([offsets_half[r:i_end], -offsets_half[r:i_end], [0]])
         coef_list = calculate_findiff_coefs(offsets, deriv)
-        val_list = np.concatenate([fx_pos[r:i_end], fx_neg[r:i_end], [f0]])
-        grr_trig[r, 0] = (coef_list * val_list).sum()
+        coef_pos[r, r:i_end] = coef_list[:comp_len]
+        coef_neg[r, r:i_end] = coef_list[comp_len:2*comp_len]
+        coef_0[r] = coef_list[-1]
+    grr_trig[:, 0] = (np.tensordot(coef_pos, fx_pos[:len(offsets_half)], axes=1)
+                      + np.tensordot(coef_neg, fx_neg[:len(offsets_half)], axes=1)
+                      + np.multiply.outer(coef_0, np.broadcast_to(f0, value_shape)))
     for c in range(1, mat_size):
-        for r in range(mat_size-c):
-            grr_trig[r, c] = (ratio**(2*c) * grr_trig[r, c-1] - grr_trig[r+1, c-1]) / (ratio**(2*c) - 1)    
-            
-    for r in range(mat_size):
-        for c in range(mat_size-r, mat_size):
-            grr_trig[r, c] = np.nan
+        scale = ratio**(2*c)
+        grr_trig[:mat_size-c, c] = (scale * grr_trig[:mat_size-c, c-1] - grr_trig[1:mat_size-c+1, c-1]) / (scale - 1)
+    
+    r, c = np.indices((mat_size, mat_size))
+    grr_trig[r + c >= mat_size] = np.nan
     return grr_trig
 
 
-def calculate_GRR_trig_with_f(offsets_half, deriv, f):
+def calculate_GRR_trig_with_f(offsets_half, deriv, f, tol=None, order="smallest"):
     """
     Calculate (Generalized) Rutishauser–Romberg Triangle with Given Function
     
@@ -107,19 +179,267 @@ def calculate_GRR_trig_with_f(offsets_half, deriv, f):
     deriv : int
     f : function
         Should be able to handle both array_like and float input.
+    tol : float or None
+        If given, evaluate `f' adaptively by `calculate_GRR_trig_adaptive'.
+    order : str
+        "smallest" or "largest", order of offsets in adaptive evaluation.
     
     Returns
     -------
     grr_trig : ndarray
         (Generalized) Rutishauser–Romberg triangle.
+    info : dict
+        Only returned if `tol' is given, see `calculate_GRR_trig_adaptive'.
     """
     
+    if tol is not None:
+        return calculate_GRR_trig_adaptive(offsets_half, deriv, f, tol, order)
     fx_pos = [f(o) for o in offsets_half]
     fx_neg = [f(-o) for o in offsets_half]
     f0 = f(0)
     return calculate_GRR_trig(offsets_half, deriv, fx_pos, fx_neg, f0)
 
 
+def _grr_trig_first_column(offsets_half, deriv, fx_pos, fx_neg, f0, r):
+    # Finite difference of row `r' of GRR triangle
+    comp_len = (deriv + 1) // 2
+    offsets = np.concatenate([offsets_half[r:r+comp_len], -offsets_half[r:r+comp_len], [0]])
+    coef_list = calculate_findiff_coefs(offsets, deriv)
+    return (np.tensordot(coef_list[:comp_len], fx_pos[r:r+comp_len], axes=1)
+            + np.tensordot(coef_list[comp_len:2*comp_len], fx_neg[r:r+comp_len], axes=1)
+            + coef_list[-1] * f0)
+
+
+def _grr_trig_extend(grr_trig, val, ratio, top):
+    # Add one row to GRR triangle, at bottom (new largest offset, only the new anti-diagonal
+    # is evaluated) or at top (new smallest offset, only the new first row is evaluated)
+    m = len(grr_trig) + 1
+    new = np.full((m, m) + np.shape(val), np.nan)
+    if top:
+        new[1:, :m-1] = grr_trig
+        new[0, 0] = val
+        for c in range(1, m):
+            scale = ratio**(2*c)
+            new[0, c] = (scale * new[0, c-1] - new[1, c-1]) / (scale - 1)
+    else:
+        new[:m-1, :m-1] = grr_trig
+        new[m-1, 0] = val
+        for c in range(1, m):
+            scale = ratio**(2*c)
+            new[m-1-c, c] = (scale * new[m-1-c, c-1] - new[m-c, c-1]) / (scale - 1)
+    return new
+
+
+def calculate_GRR_trig_adaptive(offsets_half, deriv, f, tol, order="smallest", f0=None):
+    """
+    Adaptive (Generalized) Rutishauser–Romberg Triangle with Lazily Evaluated Function
+    
+    Offsets are evaluated one at a time (both f(o) and f(-o)), and the triangle is extended
+    by one row each time, until the smallest cell of `check_grr_trig_converge' is below `tol'
+    (for tensor values, the largest element of the cell is used).
+    Every evaluated offset is used in the triangle, so it has one more row than
+    `calculate_GRR_trig' of the same offsets (which does not use value of the largest offset).
+    
+    Parameters
+    ----------
+    offsets_half : array_like
+        Geometric sequence in ascending order, see `calculate_GRR_trig'.
+    deriv : int
+    f : function
+        Could return float or ndarray.
+    tol : float
+    order : str
+        "smallest": start from small offsets, larger offsets are added to the bottom of triangle;
+        "largest": start from large offsets, smaller offsets are added to the top of triangle.
+    f0 : float or array_like or None
+        Value of f(0) if already known. Otherwise `f(0)' is evaluated only for even derivative
+        order, since its coefficient is zero for odd order.
+    
+    Returns
+    -------
+    grr_trig : ndarray
+        (Generalized) Rutishauser–Romberg triangle of evaluated offsets.
+    info : dict
+        "value": extrapolated derivative at the smallest convergence check cell;
+        "position": (row, column) of the cell; "error": its check value;
+        "converged": whether `tol' is met; "offsets_half": evaluated offsets;
+        "n_eval": number of evaluations of `f'; "n_saved": evaluations saved compared
+        to `calculate_GRR_trig_with_f'.
+    """
+    
+    if order not in ("smallest", "largest"):
+        raise ValueError("`order' should be either \"smallest\" or \"largest\".")
+    offsets_half = np.asarray(offsets_half)
+    comp_len = (deriv + 1) // 2
+    n_start = comp_len + 2  # least number of offsets for one convergence check cell
+    if len(offsets_half) < max(n_start, 2):
+        raise ValueError("length of `offsets_half' must >= {:} for adaptive convergence check.".format(max(n_start, 2)))
+    ratio = offsets_half[-1] / offsets_half[-2]
+    n_eval = 0
+    if f0 is None and deriv % 2 == 0:
+        f0 = f(0)
+        n_eval += 1
+    f0 = 0 if f0 is None else f0
+
+    def best(grr_trig):
+        mat_chk = check_grr_trig_converge(grr_trig)
+        mat_chk = mat_chk.reshape(mat_chk.shape[:2] + (-1,)).max(axis=-1)
+        pos = np.unravel_index(np.nanargmin(mat_chk), mat_chk.shape)
+        return pos, mat_chk[pos]
+
+    idx = list(range(len(offsets_half)))
+    if order == "largest":
+        idx = idx[::-1]
+    fx_pos, fx_neg = {}, {}
+    grr_trig, error = None, np.inf
+    for i in idx:
+        if error < tol:
+            break
+        fx_pos[i], fx_neg[i] = f(offsets_half[i]), f(-offsets_half[i])
+        n_eval += 2
+        used = sorted(fx_pos)
+        if len(used) < comp_len:
+            continue
+        r = 0 if order == "largest" else len(used) - comp_len  # row of stencil with the new offset
+        val = _grr_trig_first_column(offsets_half[used], deriv, np.asarray([fx_pos[j] for j in used], dtype=float),
+                                     np.asarray([fx_neg[j] for j in used], dtype=float), f0, r)
+        if grr_trig is None:
+            grr_trig = np.zeros((0, 0) + np.shape(val))
+        grr_trig = _grr_trig_extend(grr_trig, val, ratio, top=(order == "largest"))
+        if len(used) >= n_start:
+            pos, error = best(grr_trig)
+    info = {
+        "value": grr_trig[pos],
+        "position": pos,
+        "error": error,
+        "converged": bool(error < tol),
+        "offsets_half": offsets_half[sorted(fx_pos)],
+        "n_eval": n_eval,
+        "n_saved": 2 * len(offsets_half) + 1 - n_eval,
+    }
+    return grr_trig, info
+
+
+def _memo_path(cache_dir, offset):
+    # File of cached f(offset); offset is written with full precision
+    return os.path.join(cache_dir, "{:+.17e}.npy".format(float(offset)))
+
+
+def _memo_save(cache_dir, offset, value):
+    fd, tmp = tempfile.mkstemp(suffix=".npy", dir=cache_dir)
+    with os.fdopen(fd, "wb") as file:
+        np.save(file, np.asarray(value))
+    os.replace(tmp, _memo_path(cache_dir, offset))
+
+
+def _run_coroutine(coro):
+    # Run coroutine to completion, also if an event loop is already running (e.g. in Jupyter)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+def evaluate_displaced(f, offsets, executor=None, cache_dir=None):
+    """
+    Evaluate Function on Displaced Points, Concurrently and with On-Disk Memo
+    
+    Parameters
+    ----------
+    f : function
+        Picklable if `executor' is a process pool. Could also be a coroutine function.
+    offsets : array_like
+    executor : concurrent.futures.Executor or str or None
+        Evaluations are submitted to the executor (thread or process pool) and run
+        concurrently; "asyncio" (or coroutine function `f') gathers coroutines `f(o)';
+        None evaluates one by one.
+    cache_dir : str or None
+        Directory of on-disk memo, with one `.npy' file for each offset. Cached offsets
+        are not evaluated again, and new values are saved as soon as they are available
+        (also if other evaluations fail), so an interrupted run could be continued. Use
+        one directory for one function.
+    
+    Returns
+    -------
+    values : dict
+        Value of `f' for every offset (float keys).
+    """
+    
+    offsets = list(dict.fromkeys(float(o) for o in np.asarray(offsets).ravel()))
+    values = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        for o in offsets:
+            if os.path.isfile(_memo_path(cache_dir, o)):
+                values[o] = np.load(_memo_path(cache_dir, o))
+    todo = [o for o in offsets if o not in values]
+
+    def done(o, value):
+        values[o] = value
+        if cache_dir is not None:
+            _memo_save(cache_dir, o, value)
+
+    if executor == "asyncio" or inspect.iscoroutinefunction(f):
+        async def gather():
+            async def run(o):
+                value = await f(o) if inspect.iscoroutinefunction(f) else await asyncio.to_thread(f, o)
+                done(o, value)
+            return await asyncio.gather(*[run(o) for o in todo], return_exceptions=True)
+        errors = [e for e in _run_coroutine(gather()) if isinstance(e, BaseException)]
+        if errors:
+            raise errors[0]
+    elif executor is not None:
+        # save results in completion order, and all finished ones before raising a failure
+        futures = {executor.submit(f, o): o for o in todo}
+        error = None
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                error = error or future.exception()
+            else:
+                done(futures[future], future.result())
+        if error is not None:
+            raise error
+    else:
+        for o in todo:
+            done(o, f(o))
+    return {o: values[o] for o in offsets}
+
+
+def calculate_GRR_trigs(offsets_half, derivs, f, executor=None, cache_dir=None):
+    """
+    Calculate (Generalized) Rutishauser–Romberg Triangles of Several Derivative Orders
+    
+    All displaced points are evaluated once by `evaluate_displaced', and triangles of
+    all derivative orders are built from the same values. f(0) is evaluated only if
+    any order is even.
+    
+    Parameters
+    ----------
+    offsets_half : array_like
+    derivs : list of int
+    f : function
+    executor, cache_dir
+        See `evaluate_displaced'.
+    
+    Returns
+    -------
+    grr_trigs : dict
+        (Generalized) Rutishauser–Romberg triangle for every derivative order.
+    """
+    
+    offsets_half = np.asarray(offsets_half)
+    offsets = list(offsets_half) + list(-offsets_half)
+    if any(deriv % 2 == 0 for deriv in derivs):
+        offsets.append(0.)
+    values = evaluate_displaced(f, offsets, executor, cache_dir)
+    fx_pos = [values[float(o)] for o in offsets_half]
+    fx_neg = [values[float(-o)] for o in offsets_half]
+    f0 = values.get(0.)
+    return {deriv: calculate_GRR_trig(offsets_half, deriv, fx_pos, fx_neg, f0) for deriv in derivs}
+
+
 def check_grr_trig_converge(grr_trig):
     """
     Convergence Check Matrix of (Generalized) Rutishauser–Romberg Triangle
@@ -127,23 +447,20 @@ def check_grr_trig_converge(grr_trig):
     Parameters
     ----------
     grr_trig : ndarray
-        (Generalized) Rutishauser–Romberg triangle.
+        (Generalized) Rutishauser–Romberg triangle, of shape `(n, n, *value_shape)'.
     
     Return
     ------
     mat_chk : ndarray
+        Of shape `(n, n, *value_shape)', element-wise for tensor values.
     """
     
+    grr_trig = np.asarray(grr_trig)
     n = len(grr_trig)
-    mat_chk = np.zeros((n, n))
-    for r in range(0, n-1):
-        for c in range(1, n-r-1):
-            mat_chk[r, c] = np.abs(grr_trig[r, c] - grr_trig[r+1, c]) + np.abs(grr_trig[r, c] - grr_trig[r, c-1])
-    for r in range(n):
-        mat_chk[r, 0] = np.nan
-    for r in range(0, n):
-        for c in range(n-r-1, n):
-            mat_chk[r, c] = np.nan
+    mat_chk = np.full(grr_trig.shape, np.nan)
+    mat_chk[:n-1, 1:] = np.abs(grr_trig[:n-1, 1:] - grr_trig[1:, 1:]) + np.abs(grr_trig[:n-1, 1:] - grr_trig[:n-1, :n-1])
+    r, c = np.indices((n, n))
+    mat_chk[(c == 0) | (r + c >= n - 1)] = np.nan
     return mat_chk
 
 